@@ -1,50 +1,124 @@
+import argparse
+import cProfile
+import glob
+import gzip
+import hashlib
+import importlib.util
+import inspect
+import io
+import json
+import mmap
 import os
-from typing import Optional
+import pstats
+import re
+import sqlite3
+import sys
+import time
+import tracemalloc
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from statistics import NormalDist
+from typing import BinaryIO, Callable, Dict, Iterable, List, Optional, Tuple
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib import rcParams
+from pandas.tseries.api import guess_datetime_format
+
+try:
+    import resource
+except ImportError:  # Windows: no peak RSS
+    resource = None
 
 RAW_FILE = "is2018.csv"
 OUT_DIR = "outputs"
 FIG_DIR = os.path.join(OUT_DIR, "figures")
+CACHE_DIR = "cache"
+STATE_DIR = "state"
+RESTRICTED_DIR = "restricted"  # per-province QA tables when suppressing (see write_restricted_table)
 
-os.makedirs(OUT_DIR, exist_ok=True)
-os.makedirs(FIG_DIR, exist_ok=True)
+# Year kept from each raw file; None takes it from the file name (is2018.csv / is2561.csv -> 2018) and
+# keeps every year when the name has none
+YEAR_FILTER = None
 
-# Set Thai-capable font fallback to avoid glyph warnings (best-effort)
-rcParams["font.family"] = [
-    "Tahoma",
-    "Segoe UI",
-    "DejaVu Sans",
-]
-rcParams["axes.unicode_minus"] = False
+# strftime format of adate/hdate (--date-format); None infers it from the first non-null value
+DATE_FORMAT = None
 
-# Focus analysis on 2018 data only
-YEAR_FILTER = 2018  # Set to 2018 to focus on the main year with complete data
+# Rows per chunk in streaming mode (--chunksize); None reads the whole file at once
+CHUNKSIZE = None
 
 # ---------------------- Utilities ----------------------
 
-def parse_dates(df: pd.DataFrame) -> pd.DataFrame:
-    """Derive event_date from adate with fallback to hdate. Handle Buddhist years per-row.
+# Buddhist-era (BE) years run 543 ahead of Gregorian; any 4-digit year above BE_YEAR_MIN is treated as BE
+BE_OFFSET = 543
+BE_YEAR_MIN = 2400
+
+
+def _to_datetime(s: pd.Series, fmt: Optional[str] = None) -> pd.Series:
+    if fmt is None:
+        return pd.to_datetime(s, errors="coerce", dayfirst=True)
+    return pd.to_datetime(s, errors="coerce", dayfirst=True, format=fmt)
+
+
+def fix_buddhist_years(s: pd.Series) -> pd.Series:
+    """Rewrite BE years in date strings as Gregorian (e.g. 05/03/2561 -> 05/03/2018).
+    The first standalone 4-digit number is taken as the year; non-string values pass through unchanged.
+    BE years are out of range for datetime64[ns], so they must be fixed in the text before parsing.
+    """
+    if s.dtype != object:
+        return s
+    parts = s.str.extract(r"^(.*?)(?<!\d)(\d{4})(?!\d)(.*)$")
+    year = pd.to_numeric(parts[1], errors="coerce")
+    be = (year > BE_YEAR_MIN).to_numpy()
+    if not be.any():
+        return s
+    fixed = s.copy()
+    fixed[be] = parts.loc[be, 0] + (year[be] - BE_OFFSET).astype(int).astype(str) + parts.loc[be, 2]
+    return fixed
+
+
+def to_datetime_be(s: pd.Series, fmt: Optional[str] = None) -> pd.Series:
+    """Parse date strings day-first, correcting Buddhist years, without per-row Python calls.
+    Distinct values are parsed once and broadcast back through their factorized codes, so the cost
+    scales with the number of distinct dates rather than rows. Pass fmt to skip format inference.
+    """
+    codes, uniques = pd.factorize(s)
+    text = s.dtype == object or isinstance(s.dtype, (pd.CategoricalDtype, pd.StringDtype))
+    uniques = pd.Series(np.asarray(uniques, dtype=object) if text else uniques)
+    parsed = _to_datetime(fix_buddhist_years(uniques), fmt).to_numpy()
+    # code -1 (missing) picks the trailing NaT
+    parsed = np.append(parsed, np.datetime64("NaT", "ns"))
+    return pd.Series(parsed[codes], index=s.index, name=s.name)
+
+
+def infer_date_format(s: pd.Series) -> Optional[str]:
+    """Format pandas would infer for s (from its first non-null string, BE year corrected), or None if s
+    has no such value. Returns "mixed" when pandas would fall back to per-element parsing.
+    """
+    nat_strings = {"", "NaT", "nat", "NAT", "nan", "NaN", "NAN"}
+    for v in s.dropna():
+        if isinstance(v, str) and v in nat_strings:
+            continue
+        if type(v) is not str:
+            return "mixed"
+        v = fix_buddhist_years(pd.Series([v], dtype=object)).iloc[0]
+        return guess_datetime_format(v, dayfirst=True) or "mixed"
+    return None
+
+
+def parse_dates(df: pd.DataFrame, date_formats: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+    """Derive event_date from adate with fallback to hdate. Buddhist-era years (> 2400) become CE years by
+    rewriting the year in each distinct date string before parsing (to_datetime_be), with no per-row calls.
     Returns a copy with event_date, year, quarter columns; rows with no event_date are removed.
+    date_formats optionally pins the format per column, e.g. {"adate": "%d/%m/%Y"}: an explicit format
+    avoids pandas' per-element fallback, and streaming mode pins the inferred one (see infer_date_format)
+    so every chunk is parsed exactly like the whole file would be.
     """
     df = df.copy()
+    date_formats = date_formats or {}
 
     def _to_dt(s: pd.Series) -> pd.Series:
-        dt = pd.to_datetime(s, errors="coerce", dayfirst=True)
-        # Apply per-row Buddhist year correction to avoid vectorized DateOffset overflow
-        def _fix(ts):
-            if pd.isna(ts):
-                return ts
-            try:
-                if ts.year > 2400:
-                    # use datetime.replace to subtract 543 years safely
-                    return ts.replace(year=ts.year - 543)
-            except Exception:
-                return pd.NaT
-            return ts
-        return dt.apply(_fix)
+        return to_datetime_be(s, date_formats.get(s.name))
 
     adate = _to_dt(df["adate"]) if "adate" in df.columns else pd.Series(pd.NaT, index=df.index)
     hdate = _to_dt(df["hdate"]) if "hdate" in df.columns else pd.Series(pd.NaT, index=df.index)
@@ -58,14 +132,56 @@ def parse_dates(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
+# ---------------------- Normalization ----------------------
+# Raw code columns have a few distinct values repeated over every row. Each is cleaned once per distinct
+# value and the result reaches the rows through their integer codes, so the cost follows a column's
+# cardinality, not its length.
+
+def _per_value(s: pd.Series) -> Tuple[np.ndarray, pd.Series]:
+    """Codes (-1 = missing) of s and its distinct values, so work on s runs once per value."""
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        return s.cat.codes.to_numpy(), pd.Series(np.asarray(s.cat.categories, dtype=object), dtype=object)
+    codes, uniques = pd.factorize(s)
+    return codes, pd.Series(np.asarray(uniques, dtype=object), dtype=object)
+
+
+def _to_rows(codes: np.ndarray, per_value: np.ndarray, missing) -> np.ndarray:
+    """per_value broadcast to rows through codes; rows with a missing value (code -1) get missing."""
+    return np.append(per_value, np.array([missing], dtype=per_value.dtype))[codes]
+
+
+def normalize_values(s: pd.Series, normalize: Callable[[pd.Series], pd.Series]) -> pd.Series:
+    """normalize applied to s, as a categorical Series: normalize gets the distinct values of s plus one
+    missing value (NaN) and returns their normalized values; rows take theirs through their codes.
+    Distinct raw values that normalize alike share one category; categories are sorted."""
+    codes, values = _per_value(s)
+    normalized = normalize(pd.concat([values, pd.Series([np.nan], dtype=object)], ignore_index=True))
+    value_codes, categories = pd.factorize(normalized, sort=True)
+    # code -1 (missing) picks the trailing normalized missing value
+    return pd.Series(pd.Categorical.from_codes(value_codes[codes], categories=categories), index=s.index, name=s.name)
+
+
+def strip_values(values: pd.Series) -> pd.Series:
+    """Values without surrounding whitespace; missing values stay missing."""
+    return values.where(values.isna(), values.astype(str).str.strip())
+
+
+# raw sex code (code_text) -> normalized sex; any other code is "unknown" too
+SEX_CODES = {
+    "m": "male", "male": "male", "ชาย": "male", "1": "male",
+    "f": "female", "female": "female", "หญิง": "female", "2": "female",
+    "x": "unknown", "u": "unknown", "unk": "unknown", "unknown": "unknown", "ไม่ทราบ": "unknown",
+    "0": "unknown", "": "unknown",
+}
+
+
+def code_text(values: pd.Series) -> pd.Series:
+    """Raw codes as text, stripped and in lower case (missing becomes "nan")."""
+    return values.astype(str).str.strip().str.lower()
+
+
 def normalize_sex(s: pd.Series) -> pd.Series:
-    mapping = {
-        "m": "male", "male": "male", "ชาย": "male", "1": "male", 1: "male",
-        "f": "female", "female": "female", "หญิง": "female", "2": "female", 2: "female",
-        "x": "unknown", "u": "unknown", "unk": "unknown", "unknown": "unknown", "ไม่ทราบ": "unknown",
-        "0": "unknown", 0: "unknown", "": "unknown", None: "unknown",
-    }
-    return s.astype(str).str.strip().str.lower().map(mapping).fillna("unknown")
+    return normalize_values(s, lambda values: code_text(values).map(SEX_CODES).fillna("unknown"))
 
 
 def icd_vehicle_map(code: Optional[str]) -> str:
@@ -98,265 +214,1359 @@ def icd_vehicle_map(code: Optional[str]) -> str:
     return "Unspecified"
 
 
-# ---------------------- Aggregations ----------------------
+# Label of each two-digit V-code V00-V99, as icd_vehicle_map assigns it
+V_CODE_LABELS = np.array([icd_vehicle_map(f"V{v:02d}") for v in range(100)], dtype=object)
+# Every label icd_vehicle_map can return, sorted so categorical codes order like groupby keys
+VEHICLE_TYPES = sorted(set(V_CODE_LABELS) | {"Non-road or unspecified"})
 
-def agg_national_quarter(df: pd.DataFrame) -> pd.DataFrame:
-    # Filter for 2018 data only
-    df_2018 = df[df["year"] == 2018].copy()
-    out = df_2018.groupby("quarter", dropna=False).size().reset_index(name="cases").sort_values("quarter")
-    out.to_csv(os.path.join(OUT_DIR, "national_quarter.csv"), index=False)
-    plt.figure(figsize=(12, 5))
-    plt.bar(out["quarter"], out["cases"], color="#4C78A8")
-    plt.title("National injury cases by quarter (2018)")
-    plt.xlabel("Quarter"); plt.ylabel("Cases"); plt.xticks(rotation=45, ha="right"); plt.tight_layout()
-    plt.savefig(os.path.join(FIG_DIR, "national_quarter_cases.png")); plt.close()
-    return out
 
+def _v_code_labels(s: pd.Series) -> np.ndarray:
+    """VEHICLE_TYPES index for each code in s (object Series)."""
+    label_code = {label: i for i, label in enumerate(VEHICLE_TYPES)}
+    if pd.api.types.infer_dtype(s, skipna=True) not in ("string", "mixed", "mixed-integer", "empty"):
+        # no strings at all (e.g. an all-numeric column): nothing to classify
+        return np.full(len(s), label_code["Unspecified"], dtype=np.int8)
+    # everything optional, so the match always succeeds; unmatched groups come back NaN
+    parts = s.str.extract(r"^\s*(?:([vV])\D*(?:(\d)\D*(\d))?)?")
+    # non-strings and strings shorter than 2 characters
+    short = ~(s.str.len() >= 2).to_numpy()
+    has_v = parts[0].notna().to_numpy()
 
-def agg_sex_year(df: pd.DataFrame) -> pd.DataFrame:
-    # Filter for 2018 data only
-    df_2018 = df[df["year"] == 2018].copy()
-    sex_norm = normalize_sex(df_2018["sex"]) if "sex" in df_2018.columns else pd.Series(["unknown"] * len(df_2018))
-    tmp = df_2018.assign(sex_norm=sex_norm)
-    out = (
-        tmp.groupby(["sex_norm"], dropna=False).size().reset_index(name="cases")
+    # digit value of each captured character (any Unicode decimal digit, as int() accepts)
+    chars = pd.unique(parts[[1, 2]].to_numpy().ravel())
+    digit = {ch: unicodedata.decimal(ch) for ch in chars if isinstance(ch, str)}
+    tens = parts[1].map(digit).to_numpy(dtype=float)
+    ones = parts[2].map(digit).to_numpy(dtype=float)
+    has_code = ~np.isnan(tens) & ~np.isnan(ones)
+    v = np.where(has_code, np.nan_to_num(tens) * 10 + np.nan_to_num(ones), 0).astype(np.int64)
+
+    lookup = np.array([label_code[label] for label in V_CODE_LABELS], dtype=np.int8)
+    codes = np.where(has_code, lookup[v], label_code["Unspecified"])
+    codes = np.where(has_v, codes, label_code["Non-road or unspecified"])
+    return np.where(short, label_code["Unspecified"], codes).astype(np.int8)
+
+
+def classify_icd_vehicle(s: pd.Series) -> pd.Categorical:
+    """Vectorized icd_vehicle_map returning a Categorical over VEHICLE_TYPES.
+    Each distinct code goes through one regex that pulls out the V and its first two digits, and the
+    two-digit number indexes V_CODE_LABELS; rows then take their label through the factorized codes.
+    """
+    codes, uniques = pd.factorize(s if isinstance(s.dtype, pd.CategoricalDtype) else pd.Series(s, dtype=object))
+    labels = _v_code_labels(pd.Series(np.asarray(uniques, dtype=object), dtype=object))
+    # code -1 (missing) picks the trailing "Unspecified"
+    labels = np.append(labels, VEHICLE_TYPES.index("Unspecified")).astype(np.int8)
+    return pd.Categorical.from_codes(labels[codes], categories=VEHICLE_TYPES)
+
+
+# ---------------------- Gazetteer ----------------------
+# gazetteer_th.csv lists the 77 provinces (DOPA codes 10-96) and Bangkok's 50 districts (khet, 1001-1050)
+# with their Thai and English names and common variant spellings. Raw names and codes resolve to a place's
+# integer code once per distinct value, and count under its canonical Thai name; names it does not list
+# are kept as they are. Province populations (POPULATION_FILE, optional) give the per-100k rates.
+
+GAZETTEER_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gazetteer_th.csv")
+# prov (a code or any name the gazetteer resolves), year, population; not bundled, and without it the
+# province table has no population or cases_per_100k columns
+POPULATION_FILE = "population_th.csv"
+BKK_CODE = 10
+
+_NAME_PREFIX = re.compile(r"^(?:จังหวัด|จ\.|เขต|อำเภอ|อ\.|changwat|khet|amphoe)\s*")
+_NAME_NOISE = re.compile(r"[\s.\-ฯ]")
+
+
+@dataclass(frozen=True)
+class Gazetteer:
+    names: Dict[int, str]  # code -> canonical Thai name
+    provinces: Dict[str, int]  # name_key -> province code
+    districts: Dict[Tuple[int, str], int]  # (province code, name_key) -> district code
+    population: Dict[Tuple[int, int], int]  # (province code, year) -> population
+
+
+def name_key(values: pd.Series) -> pd.Series:
+    """Lookup form of place names and codes: lower case, without a จังหวัด/เขต/อำเภอ-style prefix, spaces,
+    dots, hyphens or ฯ; whole numbers as integers ("12.0" -> "12")."""
+    text = code_text(values)
+    number = pd.to_numeric(text, errors="coerce")
+    whole = (np.isfinite(number) & (number == np.floor(number))).to_numpy()
+    keys = text.str.replace(_NAME_PREFIX, "", regex=True).str.replace(_NAME_NOISE, "", regex=True)
+    keys[whole] = number[whole].astype(np.int64).astype(str)
+    return keys
+
+
+def load_gazetteer(path: str = GAZETTEER_FILE, population_path: Optional[str] = None) -> Gazetteer:
+    """The places of path keyed by name_key of every name, alias and code (districts also by their code
+    within the province, e.g. "12" for 1012), plus the populations of population_path when given."""
+    places = pd.read_csv(path, dtype=str, keep_default_na=False, encoding="utf-8")
+    names, provinces, districts = {}, {}, {}
+    for place in places.itertuples(index=False):
+        code = int(place.code)
+        names[code] = place.name_th
+        variants = [place.name_th, place.name_en, place.code] + [a for a in place.aliases.split("|") if a]
+        if place.level == "province":
+            provinces.update((key, code) for key in name_key(pd.Series(variants, dtype=object)))
+        else:
+            prov, short = divmod(code, 100)
+            keys = name_key(pd.Series(variants + [str(short)], dtype=object))
+            districts.update(((prov, key), code) for key in keys)
+    gaz = Gazetteer(names, provinces, districts, {})
+    if population_path is not None:
+        pop = pd.read_csv(population_path, dtype={"prov": object}, encoding="utf-8")
+        codes = province_codes(pop["prov"], gaz)
+        if (codes < 0).any():
+            unknown = sorted(set(pop.loc[codes < 0, "prov"].astype(str)))
+            raise ValueError(f"{population_path}: provinces not in the gazetteer: {', '.join(unknown)}")
+        gaz.population.update(zip(zip(codes.tolist(), pop["year"].astype(int)), pop["population"].astype(int)))
+    return gaz
+
+
+_GAZETTEER: Optional[Gazetteer] = None
+
+
+def gazetteer() -> Gazetteer:
+    """The bundled gazetteer with POPULATION_FILE's populations when that file exists; loaded once."""
+    global _GAZETTEER
+    if _GAZETTEER is None:
+        _GAZETTEER = load_gazetteer(GAZETTEER_FILE, POPULATION_FILE if os.path.exists(POPULATION_FILE) else None)
+    return _GAZETTEER
+
+
+def province_codes(values: pd.Series, gaz: Optional[Gazetteer] = None) -> np.ndarray:
+    """Gazetteer code of each province name or code in values; -1 where missing or unknown."""
+    gaz = gaz or gazetteer()
+    codes = name_key(values).map(gaz.provinces).fillna(-1).to_numpy(dtype=np.int64)
+    codes[values.isna().to_numpy()] = -1
+    return codes
+
+
+def canonical_provinces(values: pd.Series) -> pd.Series:
+    """Canonical Thai name of each province the gazetteer resolves; other values stripped, missing kept."""
+    codes = province_codes(values)
+    names = pd.Series([gazetteer().names.get(code) for code in codes], index=values.index, dtype=object)
+    return names.where(codes >= 0, strip_values(values))
+
+
+def canonical_districts(prov: Optional[pd.Series], district: pd.Series) -> pd.Series:
+    """Canonical Thai name of each district the gazetteer resolves within its row's province, as a
+    categorical; other districts as stripped text (missing as "nan"). Resolved once per distinct
+    (province, district) pair."""
+    gaz = gazetteer()
+    district_codes, district_values = _per_value(district)
+    if prov is None:
+        prov_codes, prov_values = np.full(len(district), -1), pd.Series([], dtype=object)
+    else:
+        prov_codes, prov_values = _per_value(prov)
+    # one integer per (province, district) pair; code -1 (missing) picks the trailing entry of each lookup
+    width = len(district_values) + 1
+    pair_codes, pairs = pd.factorize((prov_codes.astype(np.int64) + 1) * width + district_codes + 1)
+    prov_code = np.append(province_codes(prov_values, gaz), -1)[pairs // width - 1]
+    keys = np.append(name_key(district_values).to_numpy(dtype=object), None)[pairs % width - 1]
+    text = np.append(district_values.astype(str).str.strip().to_numpy(dtype=object), "nan")[pairs % width - 1]
+    labels = pd.Series([
+        gaz.names.get(gaz.districts.get((p, k)), t) if k is not None else t
+        for p, k, t in zip(prov_code.tolist(), keys, text)
+    ], dtype=object)
+    label_codes, categories = pd.factorize(labels, sort=True)
+    return pd.Series(pd.Categorical.from_codes(label_codes[pair_codes], categories=categories),
+                     index=district.index, name=district.name)
+
+
+def place_codes(names: pd.Series, prov_code: Optional[int] = None) -> pd.Series:
+    """Gazetteer code of each canonical province name, or district name within prov_code (nullable)."""
+    gaz = gazetteer()
+    if prov_code is None:
+        codes = province_codes(names, gaz)
+    else:
+        keys = name_key(names)
+        codes = np.array([gaz.districts.get((prov_code, key), -1) for key in keys], dtype=np.int64)
+    return pd.Series(pd.array(np.where(codes >= 0, codes, 0), dtype="Int64"), index=names.index).mask(codes < 0)
+
+
+def add_rates(out: pd.DataFrame, year: int) -> pd.DataFrame:
+    """out (prov and cases columns) with prov_code and, when populations are loaded, population and
+    cases_per_100k; the rate of year uses the population of the same year, and both are empty for provinces
+    without one."""
+    out["prov_code"] = place_codes(out["prov"])
+    population = gazetteer().population
+    if not population:
+        return out
+    out["population"] = pd.array(
+        [population.get((code, year)) if code is not pd.NA else None for code in out["prov_code"]], dtype="Int64"
     )
-    # Add year column for consistency
-    out["year"] = 2018
-    out = out.rename(columns={"sex_norm": "sex"})
-    out = out[["sex", "year", "cases"]]
-    out.to_csv(os.path.join(OUT_DIR, "sex_year.csv"), index=False)
-    
-    # Create visualization
-    plt.figure(figsize=(10, 5))
-    plt.bar(out["sex"], out["cases"], color=["#1f77b4", "#ff7f0e", "#2ca02c"])
-    plt.title("Injury cases by sex (2018)")
-    plt.xlabel("Sex"); plt.ylabel("Cases"); plt.tight_layout()
-    plt.savefig(os.path.join(FIG_DIR, "sex_national_by_year.png")); plt.close()
+    out["cases_per_100k"] = (out["cases"] / out["population"] * 100_000).astype("Float64").round(2)
     return out
 
 
-def agg_province_year(df: pd.DataFrame) -> Optional[pd.DataFrame]:
-    prov_col = None
+# ---------------------- Instrumentation ----------------------
+# Every stage of a run (reading, date parsing, counting and finishing each table, rendering each figure)
+# is timed with stage(), which records wall and CPU seconds, the process's peak RSS so far and rows in/out.
+# Worker processes send their records back with their results; main writes the summary to
+# outputs/run_profile.json.
+
+_stage_records: List[dict] = []
+
+
+def _peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (2**20 if sys.platform == "darwin" else 2**10), 1)
+
+
+@contextmanager
+def stage(name: str, rows_in: Optional[int] = None):
+    """Time the block as stage name. Yields the record, so the block can set rec["rows_out"]."""
+    rec = {"stage": name, "rows_in": rows_in, "rows_out": None}
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield rec
+    finally:
+        rec["wall_s"] = time.perf_counter() - wall
+        rec["cpu_s"] = time.process_time() - cpu
+        rec["peak_rss_mb"] = _peak_rss_mb()
+        rec["pid"] = os.getpid()
+        _stage_records.append(rec)
+
+
+@contextmanager
+def collect_stages():
+    """Move the stage records made inside the block into the yielded list (to return from a worker)."""
+    mark = len(_stage_records)
+    records: List[dict] = []
+    try:
+        yield records
+    finally:
+        records.extend(_stage_records[mark:])
+        del _stage_records[mark:]
+
+
+def summarize_stages(records: List[dict]) -> List[dict]:
+    """One entry per stage name, in first-seen order: calls, summed times and rows, max peak RSS."""
+    summary: Dict[str, dict] = {}
+    for rec in records:
+        row = summary.setdefault(rec["stage"], {
+            "stage": rec["stage"], "calls": 0, "wall_s": 0.0, "cpu_s": 0.0,
+            "rows_in": None, "rows_out": None, "peak_rss_mb": None,
+        })
+        row["calls"] += 1
+        row["wall_s"] += rec["wall_s"]
+        row["cpu_s"] += rec["cpu_s"]
+        for k in ["rows_in", "rows_out"]:
+            if rec[k] is not None:
+                row[k] = (row[k] or 0) + rec[k]
+        if rec["peak_rss_mb"] is not None:
+            row["peak_rss_mb"] = max(row["peak_rss_mb"] or 0, rec["peak_rss_mb"])
+    for row in summary.values():
+        row["wall_s"] = round(row["wall_s"], 4)
+        row["cpu_s"] = round(row["cpu_s"], 4)
+    return list(summary.values())
+
+
+def write_run_profile(records: List[dict], info: dict, path: Optional[str] = None) -> str:
+    """Write info plus the stage summary of records as JSON (default outputs/run_profile.json)."""
+    path = path or os.path.join(OUT_DIR, "run_profile.json")
+    profile = dict(info, stages=summarize_stages(records))
+    atomic_write(path, json.dumps(profile, ensure_ascii=False, indent=2).encode("utf-8"))
+    return path
+
+
+# ---------------------- Output writer ----------------------
+# Every output file is written through a temporary file next to it and renamed over the old one, so a
+# file is always a complete old or new version, never half written. OUT_DIR/manifest.json lists each file
+# with its SHA-256, size and rows; it is replaced only when all of a run's writes succeeded, so a loader
+# can check the file set against it (after a crashed run, a rewritten file no longer matches). A table
+# whose bytes equal its manifest entry, and whose file is untouched since, is not written again, so a
+# refresh only writes what changed. Tables are CSV, gzip CSV or Parquet (--format); --consolidate also
+# puts all of a run's tables into one SQLite file, one SQL table each.
+
+OUTPUT_FORMATS = {"csv": ".csv", "csv.gz": ".csv.gz", "parquet": ".parquet"}
+OUTPUT_MANIFEST = "manifest.json"  # under OUT_DIR
+CONSOLIDATED_FILE = "aggregates.sqlite"  # under OUT_DIR
+
+
+def atomic_write(path: str, data: bytes) -> None:
+    """Write data to path through a temporary file in the same directory and an atomic rename."""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    tmp = os.path.join(directory, f".{os.path.basename(path)}.{os.getpid()}.tmp")
+    try:
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def table_bytes(df: pd.DataFrame, fmt: str = "csv") -> bytes:
+    """df as a file of format fmt (see OUTPUT_FORMATS); the same table always gives the same bytes."""
+    if fmt == "parquet":
+        buffer = io.BytesIO()
+        df.to_parquet(buffer, index=False)
+        return buffer.getvalue()
+    data = df.to_csv(index=False).encode("utf-8")
+    # no timestamp in the gzip header, so unchanged tables compress to unchanged bytes
+    return gzip.compress(data, mtime=0) if fmt == "csv.gz" else data
+
+
+class OutputWriter:
+    """Writes the tables and JSON files of one run into out_dir; close() records them in the manifest
+    and writes the consolidated file."""
+
+    def __init__(self, out_dir: str, fmt: str = "csv", consolidate: bool = False):
+        if fmt not in OUTPUT_FORMATS:
+            raise ValueError(f"unknown output format {fmt}; expected one of {', '.join(OUTPUT_FORMATS)}")
+        if fmt == "parquet" and importlib.util.find_spec("pyarrow") is None:
+            raise RuntimeError("Parquet outputs need pyarrow (pip install pyarrow)")
+        self.out_dir, self.fmt, self.consolidate = out_dir, fmt, consolidate
+        self.manifest_path = os.path.join(out_dir, OUTPUT_MANIFEST)
+        self.manifest_text = None
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, encoding="utf-8") as f:
+                self.manifest_text = f.read()
+        self.files: Dict[str, dict] = json.loads(self.manifest_text)["files"] if self.manifest_text else {}
+        self.tables: Dict[str, Tuple[pd.DataFrame, str]] = {}  # stem -> (table, SHA-256 of its file)
+        self.written = self.unchanged = 0
+
+    def _current(self, name: str, digest: str) -> bool:
+        """Whether out_dir/name is the file its manifest entry describes and that entry has digest."""
+        entry = self.files.get(name)
+        if entry is None or entry["sha256"] != digest:
+            return False
+        try:
+            stat = os.stat(os.path.join(self.out_dir, name))
+        except FileNotFoundError:
+            return False
+        return (stat.st_size, stat.st_mtime_ns) == (entry["bytes"], entry["mtime_ns"])
+
+    def _write(self, name: str, data: bytes, rows: Optional[int]) -> str:
+        path = os.path.join(self.out_dir, name)
+        digest = hashlib.sha256(data).hexdigest()
+        if self._current(name, digest):
+            self.unchanged += 1
+            return path
+        atomic_write(path, data)
+        self.files[name] = {"sha256": digest, "bytes": len(data), "rows": rows, "mtime_ns": os.stat(path).st_mtime_ns}
+        self.written += 1
+        return path
+
+    def table(self, df: pd.DataFrame, stem: str) -> str:
+        """Write df as out_dir/<stem> plus the format's extension; returns the path."""
+        name = stem + OUTPUT_FORMATS[self.fmt]
+        data = table_bytes(df, self.fmt)
+        self.tables[stem] = (df, hashlib.sha256(data).hexdigest())
+        return self._write(name, data, len(df))
+
+    def json(self, obj: dict, stem: str) -> str:
+        """Write obj as out_dir/<stem>.json; returns the path."""
+        return self._write(stem + ".json", json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8"), None)
+
+    def _write_consolidated(self) -> None:
+        """Every table of the run as one SQL table of out_dir/CONSOLIDATED_FILE, unless the same tables
+        were consolidated last time and the file is untouched."""
+        path = os.path.join(self.out_dir, CONSOLIDATED_FILE)
+        digest = hashlib.sha256(repr(sorted((s, d) for s, (_, d) in self.tables.items())).encode()).hexdigest()
+        entry = self.files.get(CONSOLIDATED_FILE, {})
+        if entry.get("tables_sha256") == digest and self._current(CONSOLIDATED_FILE, entry["sha256"]):
+            self.unchanged += 1
+            return
+        tmp = os.path.join(self.out_dir, f".{CONSOLIDATED_FILE}.{os.getpid()}.tmp")
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        try:
+            con = sqlite3.connect(tmp)
+            try:
+                for stem, (df, _) in sorted(self.tables.items()):
+                    df.to_sql(stem, con, index=False)
+                con.commit()
+            finally:
+                con.close()
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        stat = os.stat(path)
+        self.files[CONSOLIDATED_FILE] = {
+            "sha256": _file_sha256(path), "bytes": stat.st_size, "rows": sum(len(df) for df, _ in self.tables.values()),
+            "mtime_ns": stat.st_mtime_ns, "tables_sha256": digest,
+        }
+        self.written += 1
+
+    def close(self) -> None:
+        if self.consolidate and self.tables:
+            self._write_consolidated()
+        # entries of files removed since are dropped
+        files = {name: entry for name, entry in sorted(self.files.items())
+                 if os.path.exists(os.path.join(self.out_dir, name))}
+        text = json.dumps({"files": files}, ensure_ascii=False, indent=2)
+        if text != self.manifest_text:
+            atomic_write(self.manifest_path, text.encode("utf-8"))
+
+
+_output_writer: Optional[OutputWriter] = None
+
+
+@contextmanager
+def output_writer(fmt: str = "csv", consolidate: bool = False):
+    """Send the writes made inside the block (write_table, write_json) to OUT_DIR through one OutputWriter,
+    which is yielded. Its manifest is written when the block completes, not when it raises."""
+    global _output_writer
+    writer, previous = OutputWriter(OUT_DIR, fmt, consolidate), _output_writer
+    _output_writer = writer
+    try:
+        yield writer
+    finally:
+        _output_writer = previous
+    writer.close()
+
+
+def write_table(df: pd.DataFrame, stem: str) -> str:
+    """Write df as OUT_DIR/<stem> through the active output_writer (a CSV of its own outside one)."""
+    if _output_writer is not None:
+        return _output_writer.table(df, stem)
+    with output_writer() as writer:
+        return writer.table(df, stem)
+
+
+def write_json(obj: dict, stem: str) -> str:
+    """Write obj as OUT_DIR/<stem>.json through the active output_writer (its own outside one)."""
+    if _output_writer is not None:
+        return _output_writer.json(obj, stem)
+    with output_writer() as writer:
+        return writer.json(obj, stem)
+
+
+# ---------------------- Ingestion schema ----------------------
+# Only the raw IS columns the pipeline reads are loaded (usecols). They are all low-cardinality text
+# (provinces, districts, codes, dates and times), stored as categoricals: one small integer code per row
+# plus each distinct string once. Ages become the smallest integer type that holds them.
+
+RAW_SCHEMA = {
+    # province (any of the names _find_prov_col accepts)
+    "prov": "category", "province": "category", "prov_name": "category", "prov_th": "category",
+    # district (_find_district_col)
+    "aampur": "category", "amphoe": "category", "district": "category", "ampur": "category",
+    "sex": "category",
+    "age": "category",  # converted by compact_age
+    "adate": "category",
+    "hdate": "category",
+    "atime": "category",
+    "icdcause": "category",  # and any other column with "icd" in its name (_find_icd_col)
+    "Head_Injury": "category",
+}
+
+
+def _raw_dtype(col: str) -> Optional[str]:
+    if col in RAW_SCHEMA:
+        return RAW_SCHEMA[col]
+    return "category" if "icd" in str(col).lower() else None
+
+
+def raw_columns(path: str) -> List[str]:
+    """Header of a raw IS CSV."""
+    return list(pd.read_csv(path, encoding="utf-8", nrows=0).columns)
+
+
+def compact_age(s: pd.Series) -> pd.Series:
+    """Ages as numbers (text that is not a number becomes missing) in the smallest fitting type:
+    nullable UInt8 for whole ages 0-255, else float32."""
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        # convert each distinct value once
+        values = pd.to_numeric(pd.Series(s.cat.categories), errors="coerce").to_numpy(dtype=float)
+        age = np.append(values, np.nan)[s.cat.codes.to_numpy()]
+    else:
+        age = pd.to_numeric(s, errors="coerce").to_numpy(dtype=float)
+    known = age[~np.isnan(age)]
+    if ((known >= 0) & (known <= 255) & (known == np.round(known))).all():
+        return pd.Series(pd.array(np.where(np.isnan(age), 0, age).astype(np.uint8), dtype="UInt8"),
+                         index=s.index, name=s.name).mask(np.isnan(age))
+    return pd.Series(age.astype(np.float32), index=s.index, name=s.name)
+
+
+def read_raw(source, columns: Optional[List[str]] = None, **kwargs) -> pd.DataFrame:
+    """Read raw IS rows with RAW_SCHEMA dtypes, loading only the columns the pipeline uses.
+    source is a path or buffer; columns names the columns of a headerless source (header=None).
+    Extra keyword arguments go to pd.read_csv (e.g. chunksize, which returns an iterator)."""
+    header = columns if columns is not None else raw_columns(source)
+    dtype = {c: _raw_dtype(c) for c in header if _raw_dtype(c) is not None}
+    if columns is not None:
+        kwargs.update(header=None, names=columns)
+    reader = pd.read_csv(source, encoding="utf-8", usecols=list(dtype), dtype=dtype, low_memory=False, **kwargs)
+    if "chunksize" in kwargs:
+        return (_compact_raw(chunk) for chunk in reader)
+    return _compact_raw(reader)
+
+
+def _compact_raw(raw: pd.DataFrame) -> pd.DataFrame:
+    if "age" in raw.columns:
+        raw["age"] = compact_age(raw["age"])
+    prov_col = _find_prov_col(raw)
+    if prov_col is not None:
+        raw[prov_col] = normalize_values(raw[prov_col], canonical_provinces)
+    return raw
+
+
+def memory_report(path: str) -> pd.DataFrame:
+    """Per-column memory (deep, in bytes) of path read as before (every column, inferred dtypes) and
+    with read_raw, plus the totals."""
+    before = pd.read_csv(path, encoding="utf-8", low_memory=False)
+    after = read_raw(path)
+    report = pd.DataFrame({
+        "dtype_default": before.dtypes.astype(str),
+        "bytes_default": before.memory_usage(index=False, deep=True),
+        "dtype_schema": after.dtypes.astype(str),
+        "bytes_schema": after.memory_usage(index=False, deep=True),
+    })
+    report["bytes_schema"] = report["bytes_schema"].fillna(0).astype(int)
+    report.loc["TOTAL", ["bytes_default", "bytes_schema"]] = report[["bytes_default", "bytes_schema"]].sum()
+    report[["bytes_default", "bytes_schema"]] = report[["bytes_default", "bytes_schema"]].astype(int)
+    report["ratio"] = (report["bytes_default"] / report["bytes_schema"].replace(0, np.nan)).round(1)
+    return report.rename_axis("column")
+
+
+# ---------------------- Byte ranges ----------------------
+# A large raw file is split into byte ranges that each start at a record, so worker processes can parse
+# and count its parts in parallel (see run_files). The file is memory-mapped: splitting scans it once for
+# quote characters, so a newline inside a quoted field never ends a range, and each worker reads only
+# its own range from the page cache. This is not zero-copy: pandas cannot parse the map in place, so a
+# range's bytes are copied out of it into a buffer (read_raw_range), one range per worker at a time.
+
+# smallest range worth a worker process of its own
+MIN_RANGE_BYTES = 32 * 2**20
+# block size of the quote scan
+_SCAN_BYTES = 64 * 2**20
+
+
+def _quote_parity(data: np.ndarray, start: int, end: int) -> int:
+    """Number of quote characters in data[start:end], modulo 2."""
+    count = 0
+    for pos in range(start, end, _SCAN_BYTES):
+        count += int(np.count_nonzero(data[pos:min(pos + _SCAN_BYTES, end)] == ord('"')))
+    return count % 2
+
+
+def _record_end(mm: mmap.mmap, data: np.ndarray, pos: int, in_quotes: int) -> int:
+    """Offset just past the first newline at or after pos that is outside quotes (in_quotes: whether pos
+    is inside a quoted field), or the end of the file."""
+    while True:
+        newline = mm.find(b"\n", pos)
+        if newline < 0:
+            return len(mm)
+        in_quotes ^= _quote_parity(data, pos, newline)
+        if not in_quotes:
+            return newline + 1
+        pos = newline + 1
+
+
+def raw_byte_ranges(path: str, parts: int) -> List[Tuple[int, int]]:
+    """Split the records of path (everything after the header line) into at most parts (start, end) byte
+    ranges of about equal size, each beginning and ending at a record boundary. Together they cover every
+    record exactly once, in file order."""
+    if os.path.getsize(path) == 0:
+        return []
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        data = np.frombuffer(mm, dtype=np.uint8)
+        bounds = [_record_end(mm, data, 0, 0)]
+        step = max((len(mm) - bounds[0]) // max(parts, 1), 1)
+        for k in range(1, parts):
+            target = bounds[0] + k * step
+            if target <= bounds[-1]:
+                continue
+            # bounds[-1] is outside quotes, so the parity up to target tells whether target is inside
+            end = _record_end(mm, data, target, _quote_parity(data, bounds[-1], target))
+            if end >= len(mm):
+                break
+            bounds.append(end)
+        bounds.append(len(mm))
+        del data  # the map cannot close while a numpy view of it exists
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+def read_raw_range(path: str, start: int, end: int, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """read_raw of the records in bytes [start, end) of path, a range from raw_byte_ranges; columns is
+    path's header (read from the file when not given)."""
+    columns = columns or raw_columns(path)
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return read_raw(io.BytesIO(mm[start:end]), columns)
+
+
+# ---------------------- Aggregation engine ----------------------
+# Every table is an AggSpec: counts per year of all rows (or the Bangkok subset) grouped by derived key
+# columns. Rows are counted once into a count cube, the counts of every combination of all derived keys
+# (build_cube); each table is then a roll-up of the cube (cube_table, via cube_query), which needs no rows.
+# finish_table turns each year's counts into outputs/<name>_<year>.csv plus a FigureJob for its figure.
+
+BKK_NAME = "กรุงเทพมหานคร"  # canonical name of BKK_CODE
+
+
+def bkk_rows(prov: pd.Series) -> np.ndarray:
+    """Boolean mask of the Bangkok rows of prov, by gazetteer code of each distinct value."""
+    codes, values = _per_value(prov)
+    return np.isin(codes, np.flatnonzero(province_codes(values) == BKK_CODE))
+
+
+@dataclass(frozen=True)
+class AggSpec:
+    name: str  # also the output file stem
+    keys: Tuple[str, ...]
+    finish: Callable[[Optional[pd.Series], int], Optional[pd.DataFrame]]
+    subset: str = "all"  # "all" rows or "bkk" for Bangkok only (skipped without a province column)
+    observed: bool = True  # False keeps unobserved categories as zero-count rows (like groupby observed=False)
+    plot: Optional[Callable[[pd.DataFrame, int, BinaryIO], None]] = None  # (year's table, year, png file)
+    figure: Optional[str] = None  # figure file stem, written as figures/<figure>_<year>.png
+    hide: Tuple[str, ...] = ("cases",)  # columns blanked in the rows of suppressed cells (see suppress_table)
+    totals: Tuple[str, ...] = ()  # columns holding totals of several cells, blanked where below the threshold
+    top: Optional[int] = None  # ranked table: keep the first top rows of finish's order (see finish_year)
+
+
+def _find_prov_col(df: pd.DataFrame) -> Optional[str]:
     for cand in ["prov", "province", "prov_name", "prov_th"]:
         if cand in df.columns:
-            prov_col = cand; break
-    if prov_col is None:
-        return None
-    # Filter for 2018 data only
-    df_2018 = df[df["year"] == 2018].copy()
-    out = df_2018.groupby(prov_col, dropna=False).size().reset_index(name="cases")
-    out = out.rename(columns={prov_col: "prov"})
-    # Add year column for consistency
-    out["year"] = 2018
-    out = out[["prov", "year", "cases"]]
-    out.to_csv(os.path.join(OUT_DIR, "province_year.csv"), index=False)
-    return out
+            return cand
+    return None
 
 
-def agg_bkk_quarter(df: pd.DataFrame) -> Optional[pd.DataFrame]:
-    prov_col = "prov" if "prov" in df.columns else None
-    if prov_col is None:
-        return None
-    bkk_name = "กรุงเทพมหานคร"
-    # Filter for 2018 data only
-    df_2018 = df[df["year"] == 2018].copy()
-    bkk = df_2018.loc[df_2018[prov_col].astype(str) == bkk_name]
-    out = bkk.groupby(["quarter"], dropna=False).size().reset_index(name="cases").sort_values("quarter")
-    # Filter to only include 2018 quarters
-    out = out[out["quarter"].str.startswith("2018")]
-    out.to_csv(os.path.join(OUT_DIR, "bkk_quarter.csv"), index=False)
-    plt.figure(figsize=(10, 4))
-    plt.plot(out["quarter"], out["cases"], marker="o")
-    plt.title(f"Bangkok (กรุงเทพมหานคร) cases by quarter (2018)")
-    plt.xlabel("Quarter"); plt.ylabel("Cases"); plt.xticks(rotation=45, ha="right"); plt.tight_layout()
-    plt.savefig(os.path.join(FIG_DIR, "bkk_quarter_cases.png")); plt.close()
-    return out
+def _find_icd_col(df: pd.DataFrame) -> Optional[str]:
+    if "icdcause" in df.columns:
+        return "icdcause"
+    # auto-detect first column containing 'icd'
+    cands = [c for c in df.columns if "icd" in str(c).lower()]
+    return cands[0] if cands else None
 
 
-def agg_mode_mix_bkk_year(df: pd.DataFrame) -> Optional[pd.DataFrame]:
-    if "prov" not in df.columns:
-        return None
-    icd_col = "icdcause" if "icdcause" in df.columns else None
-    if icd_col is None:
-        # auto-detect first column containing 'icd'
-        cands = [c for c in df.columns if "icd" in str(c).lower()]
-        if cands:
-            icd_col = cands[0]
+def _find_district_col(df: pd.DataFrame) -> Optional[str]:
+    for cand in ["aampur", "amphoe", "district", "ampur"]:
+        if cand in df.columns:
+            return cand
+    return None
+
+
+def _derive_year(df: pd.DataFrame, date_formats: Dict[str, str]) -> pd.Series:
+    return df["year"]
+
+
+def _derive_quarter(df: pd.DataFrame, date_formats: Dict[str, str]) -> pd.Series:
+    return df["quarter"]
+
+
+def _derive_sex(df: pd.DataFrame, date_formats: Dict[str, str]) -> pd.Series:
+    return normalize_sex(df["sex"]) if "sex" in df.columns else pd.Series("unknown", index=df.index)
+
+
+def _derive_prov(df: pd.DataFrame, date_formats: Dict[str, str]) -> Optional[pd.Series]:
+    prov_col = _find_prov_col(df)
+    return df[prov_col] if prov_col is not None else None
+
+
+def _derive_vehicle_type(df: pd.DataFrame, date_formats: Dict[str, str]) -> Optional[pd.Series]:
+    icd_col = _find_icd_col(df)
     if icd_col is None:
         return None
-    # Filter for 2018 data only and Bangkok
-    df_2018 = df[df["year"] == 2018].copy()
-    bkk = df_2018.loc[df_2018["prov"].astype(str) == "กรุงเทพมหานคร"].copy()
-    if len(bkk) == 0:
-        return None
-    bkk["vehicle_type"] = bkk[icd_col].map(icd_vehicle_map)
-    out = bkk.groupby("vehicle_type", dropna=False).size().reset_index(name="cases")
-    out["share_of_total"] = out["cases"] / out["cases"].sum()
-    # Add year column for consistency
-    out["year"] = 2018
-    out = out[["year", "vehicle_type", "cases", "share_of_total"]]
-    out.to_csv(os.path.join(OUT_DIR, "mode_mix_bkk_year.csv"), index=False)
-    
-    # Plot the distribution
-    plt.figure(figsize=(12, 6))
-    out_sorted = out.sort_values("share_of_total", ascending=False)
-    plt.bar(out_sorted["vehicle_type"], out_sorted["share_of_total"] * 100, color="#4C78A8")
-    plt.title("Bangkok mode distribution (2018)")
-    plt.xlabel("Vehicle type"); plt.ylabel("Percentage of cases")
-    plt.xticks(rotation=45, ha="right")
-    plt.tight_layout()
-    plt.savefig(os.path.join(FIG_DIR, "mode_mix_bkk_share_by_year.png"))
-    plt.close()
-    return out
+    return pd.Series(classify_icd_vehicle(df[icd_col]), index=df.index)
 
 
-def agg_age_bins_year(df: pd.DataFrame) -> Optional[pd.DataFrame]:
-    """Cases by age bins for 2018, with bar chart figure."""
+def _derive_age_group(df: pd.DataFrame, date_formats: Dict[str, str]) -> Optional[pd.Series]:
     if "age" not in df.columns:
         return None
-    # Filter for 2018 data only
-    df_2018 = df[df["year"] == 2018].copy()
-    age = pd.to_numeric(df_2018["age"], errors="coerce")
+    age = pd.to_numeric(df["age"], errors="coerce")
     bins = [0, 14, 24, 44, 64, 200]
     labels = ["0-14", "15-24", "25-44", "45-64", "65+"]
-    tmp = df_2018.assign(age_group=pd.cut(age, bins=bins, labels=labels, right=True, include_lowest=True))
-    out = tmp.groupby("age_group", dropna=False).size().reset_index(name="cases")
-    # Add year column for consistency
-    out["year"] = 2018
-    out = out[["age_group", "year", "cases"]]
-    out.to_csv(os.path.join(OUT_DIR, "age_bins_year.csv"), index=False)
-    
-    # Plot the distribution
-    plt.figure(figsize=(12, 6))
-    plt.bar(out["age_group"], out["cases"], color="#4C78A8")
-    plt.title("Cases by age group (2018)")
-    plt.xlabel("Age group"); plt.ylabel("Number of cases")
-    plt.tight_layout()
-    plt.savefig(os.path.join(FIG_DIR, "age_bins_by_year.png"))
-    plt.close()
-    return out
+    return pd.cut(age, bins=bins, labels=labels, right=True, include_lowest=True)
 
 
-def agg_hour_of_day(df: pd.DataFrame) -> Optional[pd.DataFrame]:
-    """Cases by hour-of-day for 2018, using event_date hour with fallback to atime hour."""
+def _derive_hour(df: pd.DataFrame, date_formats: Dict[str, str]) -> Optional[pd.Series]:
+    return df["event_date"].dt.hour.astype(np.int8) if "event_date" in df.columns else None
+
+
+def _derive_atime_hour(df: pd.DataFrame, date_formats: Dict[str, str]) -> Optional[pd.Series]:
+    """atime hour, only where the event_date hour is missing (see _finish_hour_of_day)."""
     if "event_date" not in df.columns:
         return None
-    # Filter for 2018 data only
-    df_2018 = df[df["year"] == 2018].copy()
-    hours = df_2018["event_date"].dt.hour
-    if hours.isna().mean() > 0.5 and "atime" in df_2018.columns:
-        atime = pd.to_datetime(df_2018["atime"], errors="coerce", dayfirst=True)
-        hours = hours.fillna(atime.dt.hour)
-    out = hours.value_counts(dropna=False).sort_index().rename_axis("hour").reset_index(name="cases")
-    out = out[out["hour"].notna()].copy()
-    out["hour"] = out["hour"].astype(int)
-    # Add year column for consistency
-    out["year"] = 2018
-    out = out[["hour", "year", "cases"]]
-    out.to_csv(os.path.join(OUT_DIR, "hour_of_day.csv"), index=False)
-    
-    # Plot the distribution
-    plt.figure(figsize=(12, 5))
-    plt.bar(out["hour"], out["cases"], color="#4C78A8")
-    plt.title("Cases by hour of day (2018)")
-    plt.xlabel("Hour of day (0-23)")
-    plt.ylabel("Number of cases")
-    plt.xticks(range(0, 24))
-    plt.grid(axis='y', linestyle='--', alpha=0.7)
-    plt.tight_layout()
-    plt.savefig(os.path.join(FIG_DIR, "hour_of_day.png"))
-    plt.close()
-    return out
+    missing = df["event_date"].isna()
+    if not missing.any() or "atime" not in df.columns:
+        return pd.Series(np.nan, index=df.index)
+    atime = _to_datetime(df["atime"], date_formats.get("atime"))
+    return atime.dt.hour.where(missing)
 
 
-def agg_bkk_top_amphoe(df: pd.DataFrame) -> Optional[pd.DataFrame]:
-    """Top 20 Bangkok districts by cases for 2018 with horizontal bar figure."""
-    if "prov" not in df.columns:
-        return None
-    # Filter for 2018 data only and Bangkok
-    df_2018 = df[df["year"] == 2018].copy()
-    bkk = df_2018.loc[df_2018["prov"].astype(str) == "กรุงเทพมหานคร"].copy()
-    if len(bkk) == 0:
-        return None
-    
-    # Try to find the district column
-    amph_col = None
-    for cand in ["aampur", "amphoe", "district", "ampur"]:
-        if cand in bkk.columns:
-            amph_col = cand
-            break
+def _derive_district(df: pd.DataFrame, date_formats: Dict[str, str]) -> Optional[pd.Series]:
+    amph_col = _find_district_col(df)
     if amph_col is None:
         return None
-    
-    # Clean up district names and count cases
-    bkk["district"] = bkk[amph_col].astype(str).str.strip()
-    out = (
-        bkk.groupby("district", dropna=False)
-        .size()
-        .reset_index(name="cases")
-        .sort_values("cases", ascending=False)
-        .head(20)
-    )
-    
-    # Add year column for consistency
-    out["year"] = 2018
-    out = out[["district", "year", "cases"]]
-    out.to_csv(os.path.join(OUT_DIR, "bkk_top_amphoe.csv"), index=False)
-    
-    # Create the visualization
-    plt.figure(figsize=(12, 8))
-    plt.barh(
-        out["district"][::-1],  # Reverse for descending order
-        out["cases"][::-1],
-        color="#4C78A8",
-        height=0.8
-    )
-    plt.title("Bangkok: Top 20 districts by cases (2018)", pad=20)
-    plt.xlabel("Number of cases", labelpad=10)
-    plt.ylabel("District", labelpad=10)
-    plt.grid(axis="x", linestyle="--", alpha=0.3)
-    
-    # Add value labels on the bars
-    for i, v in enumerate(out["cases"][::-1]):
-        plt.text(v + 5, i, str(v), va="center", fontsize=9)
-    
-    plt.tight_layout()
-    plt.savefig(os.path.join(FIG_DIR, "bkk_top_amphoe.png"), dpi=120, bbox_inches="tight")
-    plt.close()
-    
-    return out
+    prov_col = _find_prov_col(df)
+    return canonical_districts(df[prov_col] if prov_col is not None else None, df[amph_col])
 
 
-def agg_head_injury_year(df: pd.DataFrame) -> Optional[pd.DataFrame]:
-    """Head injury statistics for 2018 with bar chart."""
+def _derive_head_injury(df: pd.DataFrame, date_formats: Dict[str, str]) -> Optional[pd.Series]:
     if "Head_Injury" not in df.columns:
         return None
-    # Filter for 2018 data only
-    df_2018 = df[df["year"] == 2018].copy()
-    if len(df_2018) == 0:
-        return None
-    
-    # Process head injury data
-    hi = df_2018["Head_Injury"].astype(str).str.strip().str.lower()
-    total_cases = len(hi)
-    head_injury_cases = hi.eq("hi").sum()
-    head_injury_share = head_injury_cases / total_cases if total_cases > 0 else 0
-    
-    # Create output dataframe
-    out = pd.DataFrame({
-        "year": [2018],
-        "total_cases": [total_cases],
-        "head_injury_cases": [head_injury_cases],
-        "head_injury_share": [round(head_injury_share, 4)]
-    })
-    
-    out.to_csv(os.path.join(OUT_DIR, "head_injury_year.csv"), index=False)
-    
-    # Create visualization
-    plt.figure(figsize=(10, 6))
+    return normalize_values(df["Head_Injury"], lambda values: code_text(values).eq("hi"))
+
+
+# key name -> derivation (parsed rows, date formats) -> Series, or None if its source is missing
+DERIVED_KEYS = {
+    "year": _derive_year,
+    "quarter": _derive_quarter,
+    "sex": _derive_sex,
+    "prov": _derive_prov,
+    "vehicle_type": _derive_vehicle_type,
+    "age_group": _derive_age_group,
+    "hour": _derive_hour,
+    "atime_hour": _derive_atime_hour,
+    "district": _derive_district,
+    "head_injury": _derive_head_injury,
+}
+
+
+# the dimensions of the count cube: every derived key
+CUBE_DIMS = tuple(DERIVED_KEYS)
+# combinations above which counts are sorted out of the observed ones instead of a slot per possible one
+DENSE_COUNT_MAX = 1 << 22
+
+
+def _codes(values: pd.Series) -> Tuple[np.ndarray, pd.Index]:
+    """Integer codes (-1 = missing) and the sorted categories they index."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.to_numpy(), values.cat.categories
+    codes, uniques = pd.factorize(values, sort=True)
+    return codes, pd.Index(uniques)
+
+
+def _count_codes(
+    columns: List[Tuple[np.ndarray, pd.Index]],
+    names: Tuple[str, ...],
+    observed: bool,
+    weights: Optional[np.ndarray] = None,
+) -> pd.Series:
+    """Counts of each key combination, ordered like groupby(keys, dropna=False).size().
+    With weights, each row counts as its weight (rows that are already grouped counts)."""
+    # one slot per category plus a trailing slot for missing values
+    sizes = [len(cats) + 1 for _, cats in columns]
+    combinations = np.prod(sizes, dtype=float)
+    if combinations >= 2**63:
+        raise ValueError(f"too many combinations of {', '.join(names)} to count")
+    flat = np.zeros(len(columns[0][0]), dtype=np.int64)
+    for (codes, cats), size in zip(columns, sizes):
+        flat = flat * size + np.where(codes < 0, size - 1, codes)
+    if observed and combinations > max(len(flat), DENSE_COUNT_MAX):
+        # sparse, e.g. the cube: sort the combinations that occur
+        keep, inverse = np.unique(flat, return_inverse=True)
+        counts = np.bincount(inverse, weights=weights, minlength=len(keep)).astype(np.int64)
+    else:
+        counts = np.bincount(flat, weights=weights, minlength=int(combinations)).astype(np.int64)
+        present = counts > 0
+        if not observed:
+            # unobserved categories stay (as zeros); the missing slot only when it has rows
+            slots = np.unravel_index(np.arange(len(counts)), sizes)
+            present |= np.logical_and.reduce([slot < size - 1 for slot, size in zip(slots, sizes)])
+        keep = np.flatnonzero(present)
+        counts = counts[keep]
+    slots = np.unravel_index(keep, sizes)
+    levels = [cats.insert(len(cats), np.nan).take(slot) for (_, cats), slot in zip(columns, slots)]
+    index = levels[0].rename(names[0]) if len(levels) == 1 else pd.MultiIndex.from_arrays(levels, names=list(names))
+    return pd.Series(counts, index=index)
+
+
+def build_cube(
+    df: pd.DataFrame, date_formats: Optional[Dict[str, str]] = None, dims: Iterable[str] = CUBE_DIMS
+) -> pd.Series:
+    """Count cube of df: rows per observed combination of dims, as a Series whose MultiIndex (integer codes
+    into one level per dimension) covers the dims df has the columns for. Cubes are additive: cubes of
+    disjoint row slices combine with merge_cubes."""
+    date_formats = date_formats or {}
+    columns, names = [], []
+    with stage("count:cube", rows_in=len(df)) as rec:
+        for dim in dims:
+            if CACHED_KEYS.get(dim) in df.columns:
+                values = df[CACHED_KEYS[dim]]
+            else:
+                values = DERIVED_KEYS[dim](df, date_formats)
+            if values is not None:
+                columns.append(_codes(values))
+                names.append(dim)
+        cube = _count_codes(columns, tuple(names), observed=True)
+        rec["rows_out"] = len(cube)
+    return cube
+
+
+def cube_dims(cube: pd.Series) -> List[str]:
+    return list(cube.index.names)
+
+
+def _level_codes(cube: pd.Series, dim: str) -> Tuple[np.ndarray, pd.Index]:
+    """Codes (-1 = missing) and categories of one cube dimension, straight from its index."""
+    if dim not in cube_dims(cube):
+        raise ValueError(f"the cube has no dimension {dim!r}; it has {', '.join(cube_dims(cube))}")
+    if isinstance(cube.index, pd.MultiIndex):
+        i = cube.index.names.index(dim)
+        return cube.index.codes[i], cube.index.levels[i]
+    return _codes(cube.index.to_series())
+
+
+def _cube_mask(cube: pd.Series, where: Dict[str, object]) -> np.ndarray:
+    mask = np.ones(len(cube), dtype=bool)
+    for dim, wanted in where.items():
+        codes, cats = _level_codes(cube, dim)
+        wanted = list(wanted) if isinstance(wanted, (list, tuple, set)) else [wanted]
+        targets = cats.get_indexer([v for v in wanted if not pd.isna(v)])
+        targets = list(targets[targets >= 0]) + ([-1] if any(pd.isna(v) for v in wanted) else [])
+        mask &= np.isin(codes, targets)
+    return mask
+
+
+def cube_slice(cube: pd.Series, where: Dict[str, object]) -> pd.Series:
+    """The cells of cube matching where: {dim: value or list of values}; NaN/None selects missing values.
+    The slice keeps every category of each dimension, so it is queried like the whole cube."""
+    mask = _cube_mask(cube, where)
+    if mask.all():
+        return cube
+    if not isinstance(cube.index, pd.MultiIndex):
+        return cube[mask]
+    # rebuilt from the masked codes: cube[mask] would recompute the levels, which is much slower
+    index = pd.MultiIndex(
+        levels=cube.index.levels, codes=[c[mask] for c in cube.index.codes], names=cube.index.names,
+        verify_integrity=False,
+    )
+    return pd.Series(cube.to_numpy()[mask], index=index, name=cube.name)
+
+
+def cube_query(
+    cube: pd.Series,
+    by: Iterable[str],
+    where: Optional[Dict[str, object]] = None,
+    observed: bool = True,
+) -> pd.Series:
+    """Counts rolled up to the dimensions by, over the cells matching where (see cube_slice). Same result
+    as groupby(by, dropna=False, observed=observed).size() over the matching rows the cube was built from,
+    without touching them:
+
+        cube_query(cube, ["year", "prov", "sex", "quarter"])
+        cube_query(cube, ["year", "hour"], where={"prov": "กรุงเทพมหานคร"})
+    """
+    by = tuple(by)
+    mask = _cube_mask(cube, where or {})
+    columns = [(codes[mask], cats) for codes, cats in (_level_codes(cube, dim) for dim in by)]
+    return _count_codes(columns, by, observed, cube.to_numpy()[mask])
+
+
+def cube_table(cube: pd.Series, spec: AggSpec) -> Optional[pd.Series]:
+    """Counts of one table from the cube, keyed by year and then the spec's keys (None where the cube
+    lacks a key, or the province for a Bangkok table)."""
+    keys = ("year",) + spec.keys
+    needed = keys + (("prov",) if spec.subset == "bkk" else ())
+    if any(dim not in cube_dims(cube) for dim in needed):
+        return None
+    where = {"prov": BKK_NAME} if spec.subset == "bkk" else None
+    return cube_query(cube, keys, where, spec.observed)
+
+
+def merge_cubes(a: Optional[pd.Series], b: Optional[pd.Series]) -> Optional[pd.Series]:
+    """Add two cubes cell-wise. A dimension only one of them has is summed out of it first."""
+    if a is None or b is None:
+        return a if b is None else b
+    if cube_dims(a) != cube_dims(b):
+        dims = [dim for dim in cube_dims(a) if dim in cube_dims(b)]
+        a, b = cube_query(a, dims), cube_query(b, dims)
+    return add_counts(a, b)
+
+
+def load_cube(path: str) -> pd.Series:
+    """A cube saved by a run (cache/cube_<years>.pkl), for cube_query."""
+    return pd.read_pickle(path)
+
+
+def count_tables(
+    df: pd.DataFrame, specs: Iterable[AggSpec], date_formats: Optional[Dict[str, str]] = None
+) -> Dict[str, Optional[pd.Series]]:
+    """Counts for every spec from one cube of df over the keys they use, keyed by year and then the spec's
+    keys (None where a spec's inputs are missing). Counts are additive: counts of disjoint row slices
+    combine with add_counts."""
+    specs = list(specs)
+    used = {"year"} | {key for spec in specs for key in spec.keys}
+    if any(spec.subset == "bkk" for spec in specs):
+        used.add("prov")
+        if all(spec.subset == "bkk" for spec in specs) and "prov" in df.columns:
+            # Bangkok tables only: derive their keys for Bangkok rows alone
+            df = df.loc[bkk_rows(df["prov"])]
+    cube = build_cube(df, date_formats, [dim for dim in CUBE_DIMS if dim in used])
+    return {spec.name: cube_table(cube, spec) for spec in specs}
+
+
+def years_label(years: List[int]) -> str:
+    """File-name label for a set of years: 2018, or 2016-2019 for several."""
+    return str(years[0]) if len(years) == 1 else f"{min(years)}-{max(years)}"
+
+
+def finish_table(
+    spec: AggSpec,
+    counts: Optional[pd.Series],
+    years: List[int],
+    figures: Optional[List["FigureJob"]] = None,
+) -> Optional[pd.DataFrame]:
+    """Write outputs/<name>_<year>.csv for each year, plus outputs/<name>_<first>-<last>.csv with every
+    year's rows when there are several. Returns the rows of all years.
+    Figure jobs are appended to figures for render_figures; without a list they are rendered here."""
+    render_now = figures is None
+    figures = [] if render_now else figures
+    tables = []
+    os.makedirs(OUT_DIR, exist_ok=True)
+    with stage(f"finish:{spec.name}", rows_in=None if counts is None else len(counts)) as rec:
+        _finish_years(spec, counts, years, figures, tables)
+        rec["rows_out"] = sum(len(t) for t in tables)
+    if render_now:
+        render_figures(figures, jobs=1)
+    if not tables:
+        return None
+    if len(tables) == 1:
+        return tables[0]
+    combined = pd.concat(tables, ignore_index=True)
+    write_table(combined, f"{spec.name}_{years_label(years)}")
+    return combined
+
+
+def finish_year(spec: AggSpec, counts: Optional[pd.Series], year: int) -> Optional[pd.DataFrame]:
+    """spec's table for one year from its counts of all years (None when it cannot be built), with small
+    cells suppressed inside a suppression block. A ranked table (spec.top) is cut after suppression, without
+    its hidden rows: left in rank order, a hidden cell would be bounded by its published neighbours."""
+    if counts is not None:
+        counts = counts[counts.index.get_level_values("year") == year].droplevel("year")
+    out = spec.finish(counts, year)
+    if out is None:
+        return None
+    if _suppress_below:
+        out = suppress_table(out, spec, counts)
+        if spec.top is not None:
+            out = out.loc[~out["suppressed"]]
+    return out if spec.top is None else out.head(spec.top)
+
+
+def _finish_years(
+    spec: AggSpec, counts: Optional[pd.Series], years: List[int], figures: List["FigureJob"], tables: List[pd.DataFrame]
+) -> None:
+    for year in years:
+        out = finish_year(spec, counts, year)
+        if out is None:
+            continue
+        write_table(out, f"{spec.name}_{year}")
+        tables.append(out)
+        if spec.plot is not None:
+            figures.append(FigureJob(spec.plot, out, year, os.path.join(FIG_DIR, f"{spec.figure}_{year}.png")))
+
+
+def run_spec(spec: AggSpec, df: pd.DataFrame) -> Optional[pd.DataFrame]:
+    """Count one table over df and write it for every year in df (CSV + figure)."""
+    years = sorted(int(y) for y in df["year"].unique())
+    return finish_table(spec, count_tables(df, [spec])[spec.name], years)
+
+
+def add_counts(a: Optional[pd.Series], b: Optional[pd.Series]) -> Optional[pd.Series]:
+    """Add two count Series key-wise, ordering keys the way groupby(dropna=False) does."""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    both = pd.concat([a, b])
+    levels = list(range(both.index.nlevels))
+    # observed=True: zero-count categories are still index values, so they survive
+    return both.groupby(level=levels, dropna=False, observed=True).sum()
+
+
+# ---------------------- Figures ----------------------
+# Tables are written as soon as they are counted; their figures are rendered afterwards, in a process
+# pool on the non-interactive Agg backend. A figure whose table, year and plot code are unchanged since
+# it was last rendered is skipped (fingerprints in CACHE_DIR/figures.json). matplotlib is imported on the
+# first figure, so CSV-only runs never load it.
+
+FIGURE_MANIFEST = os.path.join(CACHE_DIR, "figures.json")
+
+
+@dataclass(frozen=True)
+class FigureJob:
+    plot: Callable[[pd.DataFrame, int, BinaryIO], None]
+    table: pd.DataFrame
+    year: int
+    path: str
+
+
+def _pyplot():
+    """matplotlib.pyplot, imported on first use, with a Thai-capable font fallback to avoid glyph
+    warnings (best-effort)."""
+    import matplotlib.pyplot as plt
+    plt.rcParams["font.family"] = [
+        "Tahoma",
+        "Segoe UI",
+        "DejaVu Sans",
+    ]
+    plt.rcParams["axes.unicode_minus"] = False
+    plt.rcParams["savefig.format"] = "png"  # figures are saved to in-memory files, which have no extension
+    return plt
+
+
+def _figure_fingerprint(job: FigureJob) -> str:
+    import matplotlib
+    h = hashlib.sha256(f"{job.year} {matplotlib.__version__}".encode())
+    h.update(inspect.getsource(job.plot).encode())
+    h.update(job.table.to_csv(index=False).encode())
+    return h.hexdigest()
+
+
+def _init_renderer() -> None:
+    _pyplot().switch_backend("Agg")
+
+
+def _render(job: FigureJob) -> List[dict]:
+    """Render one figure and write it atomically; returns its stage records (it may run in a worker process)."""
+    with collect_stages() as records:
+        with stage(f"render:{os.path.basename(job.path)}", rows_in=len(job.table)):
+            # suppressed counts are missing values of nullable columns, which matplotlib cannot draw; NaN
+            # draws nothing
+            nullable = [
+                col for col, dtype in job.table.dtypes.items()
+                if isinstance(dtype, pd.Int64Dtype) and job.table[col].isna().any()
+            ]
+            png = io.BytesIO()
+            job.plot(job.table.astype({col: float for col in nullable}), job.year, png)
+            atomic_write(job.path, png.getvalue())
+    return records
+
+
+def render_figures(figures: List[FigureJob], jobs: Optional[int] = None) -> int:
+    """Render every figure whose input changed since its last render, up to jobs at a time in separate
+    processes (default: one per CPU). Returns the number rendered."""
+    manifest = {}
+    if os.path.exists(FIGURE_MANIFEST):
+        with open(FIGURE_MANIFEST, encoding="utf-8") as f:
+            manifest = json.load(f)
+    fingerprints = {job.path: _figure_fingerprint(job) for job in figures}
+    todo = [job for job in figures if manifest.get(job.path) != fingerprints[job.path] or not os.path.exists(job.path)]
+
+    for folder in {os.path.dirname(job.path) for job in todo}:
+        os.makedirs(folder or ".", exist_ok=True)
+    jobs = min(jobs or os.cpu_count() or 1, len(todo))
+    if jobs <= 1:
+        results = [_render(job) for job in todo]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_renderer) as pool:
+            results = list(pool.map(_render, todo))
+    for records in results:
+        _stage_records.extend(records)
+
+    if todo:
+        manifest.update((job.path, fingerprints[job.path]) for job in todo)
+        atomic_write(FIGURE_MANIFEST, json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8"))
+    return len(todo)
+
+
+# ---------------------- Aggregations ----------------------
+
+def _finish_national_quarter(counts: pd.Series, year: int) -> pd.DataFrame:
+    return counts.reset_index(name="cases").sort_values("quarter")
+
+
+def _plot_national_quarter(out: pd.DataFrame, year: int, png: BinaryIO) -> None:
+    plt = _pyplot()
+    plt.figure(figsize=(12, 5))
+    plt.bar(out["quarter"], out["cases"], color="#4C78A8")
+    plt.title(f"National injury cases by quarter ({year})")
+    plt.xlabel("Quarter"); plt.ylabel("Cases"); plt.xticks(rotation=45, ha="right"); plt.tight_layout()
+    plt.savefig(png); plt.close()
+
+
+NATIONAL_QUARTER = AggSpec(
+    "national_quarter", ("quarter",), _finish_national_quarter, plot=_plot_national_quarter,
+    figure="national_quarter",
+)
+
+
+def agg_national_quarter(df: pd.DataFrame) -> pd.DataFrame:
+    return run_spec(NATIONAL_QUARTER, df)
+
+
+def _finish_sex_year(counts: pd.Series, year: int) -> pd.DataFrame:
+    out = counts.reset_index(name="cases")
+    # Add year column for consistency
+    out["year"] = year
+    return out[["sex", "year", "cases"]]
+
+
+def _plot_sex_year(out: pd.DataFrame, year: int, png: BinaryIO) -> None:
+    plt = _pyplot()
+    plt.figure(figsize=(10, 5))
+    plt.bar(out["sex"], out["cases"], color=["#1f77b4", "#ff7f0e", "#2ca02c"])
+    plt.title(f"Injury cases by sex ({year})")
+    plt.xlabel("Sex"); plt.ylabel("Cases"); plt.tight_layout()
+    plt.savefig(png); plt.close()
+
+
+SEX_YEAR = AggSpec("sex", ("sex",), _finish_sex_year, plot=_plot_sex_year, figure="sex_distribution")
+
+
+def agg_sex_year(df: pd.DataFrame) -> pd.DataFrame:
+    return run_spec(SEX_YEAR, df)
+
+
+def _finish_province_year(counts: Optional[pd.Series], year: int) -> Optional[pd.DataFrame]:
+    if counts is None:
+        return None
+    out = counts.reset_index(name="cases")
+    # Add year column for consistency
+    out["year"] = year
+    out = add_rates(out, year)
+    rates = [col for col in ["population", "cases_per_100k"] if col in out.columns]
+    return out[["prov", "prov_code", "year", "cases"] + rates]
+
+
+PROVINCE_YEAR = AggSpec("province", ("prov",), _finish_province_year, hide=("cases", "cases_per_100k"))
+
+
+def agg_province_year(df: pd.DataFrame) -> Optional[pd.DataFrame]:
+    return run_spec(PROVINCE_YEAR, df)
+
+
+def _finish_bkk_quarter(counts: Optional[pd.Series], year: int) -> Optional[pd.DataFrame]:
+    if counts is None:
+        return None
+    out = counts.reset_index(name="cases").sort_values("quarter")
+    # Filter to only include this year's quarters
+    return out[out["quarter"].str.startswith(str(year))]
+
+
+def _plot_bkk_quarter(out: pd.DataFrame, year: int, png: BinaryIO) -> None:
+    plt = _pyplot()
+    plt.figure(figsize=(10, 4))
+    plt.plot(out["quarter"], out["cases"], marker="o")
+    plt.title(f"Bangkok (กรุงเทพมหานคร) cases by quarter ({year})")
+    plt.xlabel("Quarter"); plt.ylabel("Cases"); plt.xticks(rotation=45, ha="right"); plt.tight_layout()
+    plt.savefig(png); plt.close()
+
+
+BKK_QUARTER = AggSpec(
+    "bkk_quarter", ("quarter",), _finish_bkk_quarter, subset="bkk",
+    plot=_plot_bkk_quarter, figure="bkk_quarter",
+)
+
+
+def agg_bkk_quarter(df: pd.DataFrame) -> Optional[pd.DataFrame]:
+    return run_spec(BKK_QUARTER, df)
+
+
+def _finish_mode_mix_bkk_year(counts: Optional[pd.Series], year: int) -> Optional[pd.DataFrame]:
+    if counts is None or counts.sum() == 0:
+        return None
+    out = counts.reset_index(name="cases")
+    out["share_of_total"] = out["cases"] / out["cases"].sum()
+    # Add year column for consistency
+    out["year"] = year
+    return out[["year", "vehicle_type", "cases", "share_of_total"]]
+
+
+def _plot_mode_mix_bkk_year(out: pd.DataFrame, year: int, png: BinaryIO) -> None:
+    plt = _pyplot()
+    plt.figure(figsize=(12, 6))
+    out_sorted = out.sort_values("share_of_total", ascending=False)
+    plt.bar(out_sorted["vehicle_type"], out_sorted["share_of_total"] * 100, color="#4C78A8")
+    plt.title(f"Bangkok mode distribution ({year})")
+    plt.xlabel("Vehicle type"); plt.ylabel("Percentage of cases")
+    plt.xticks(rotation=45, ha="right")
+    plt.tight_layout()
+    plt.savefig(png)
+    plt.close()
+
+
+MODE_MIX_BKK_YEAR = AggSpec(
+    "mode_mix_bkk", ("vehicle_type",), _finish_mode_mix_bkk_year, subset="bkk",
+    plot=_plot_mode_mix_bkk_year, figure="mode_mix_bkk", hide=("cases", "share_of_total"),
+)
+
+
+def agg_mode_mix_bkk_year(df: pd.DataFrame) -> Optional[pd.DataFrame]:
+    return run_spec(MODE_MIX_BKK_YEAR, df)
+
+
+def _finish_mode_mix_year(counts: Optional[pd.Series], year: int) -> Optional[pd.DataFrame]:
+    if counts is None or counts.sum() == 0:
+        return None
+    out = counts.reset_index(name="cases")
+    out["share_of_total"] = out["cases"] / out["cases"].sum()
+    # Add year column for consistency
+    out["year"] = year
+    out = out[["year", "vehicle_type", "cases", "share_of_total"]]
+    return out
+
+
+MODE_MIX_YEAR = AggSpec("mode_mix", ("vehicle_type",), _finish_mode_mix_year, hide=("cases", "share_of_total"))
+
+
+def agg_mode_mix_year(df: pd.DataFrame) -> Optional[pd.DataFrame]:
+    """National mode mix by vehicle type per year (CSV only)."""
+    return run_spec(MODE_MIX_YEAR, df)
+
+
+def _finish_mode_mix_province_year(counts: Optional[pd.Series], year: int) -> Optional[pd.DataFrame]:
+    if counts is None or counts.sum() == 0:
+        return None
+    out = counts.reset_index(name="cases")
+    out["share_of_province"] = out["cases"] / out.groupby("prov", dropna=False)["cases"].transform("sum")
+    # Add year column for consistency
+    out["year"] = year
+    out = out[["prov", "year", "vehicle_type", "cases", "share_of_province"]]
+    return out
+
+
+MODE_MIX_PROVINCE_YEAR = AggSpec(
+    "mode_mix_province", ("prov", "vehicle_type"), _finish_mode_mix_province_year,
+    hide=("cases", "share_of_province"),
+)
+
+
+def agg_mode_mix_province_year(df: pd.DataFrame) -> Optional[pd.DataFrame]:
+    """Mode mix by vehicle type within each province per year (CSV only)."""
+    return run_spec(MODE_MIX_PROVINCE_YEAR, df)
+
+
+def _finish_age_bins_year(counts: Optional[pd.Series], year: int) -> Optional[pd.DataFrame]:
+    if counts is None:
+        return None
+    out = counts.reset_index(name="cases")
+    # Add year column for consistency
+    out["year"] = year
+    return out[["age_group", "year", "cases"]]
+
+
+def _plot_age_bins_year(out: pd.DataFrame, year: int, png: BinaryIO) -> None:
+    plt = _pyplot()
+    plt.figure(figsize=(12, 6))
+    # rows without a usable age form a NaN group, which matplotlib cannot place on a category axis
+    plt.bar(out["age_group"].astype(object).fillna("unknown"), out["cases"], color="#4C78A8")
+    plt.title(f"Cases by age group ({year})")
+    plt.xlabel("Age group"); plt.ylabel("Number of cases")
+    plt.tight_layout()
+    plt.savefig(png)
+    plt.close()
+
+
+AGE_BINS_YEAR = AggSpec(
+    "age_bins", ("age_group",), _finish_age_bins_year, observed=False, plot=_plot_age_bins_year, figure="age_bins"
+)
+
+
+def agg_age_bins_year(df: pd.DataFrame) -> Optional[pd.DataFrame]:
+    """Cases by age bins per year, with bar chart figure."""
+    return run_spec(AGE_BINS_YEAR, df)
+
+
+def _finish_hour_of_day(counts: Optional[pd.Series], year: int) -> Optional[pd.DataFrame]:
+    if counts is None:
+        return None
+    pairs = counts.reset_index(name="cases")
+    hours = pairs["hour"]
+    missing_share = pairs.loc[hours.isna(), "cases"].sum() / pairs["cases"].sum() if len(pairs) else np.nan
+    if missing_share > 0.5:
+        hours = hours.fillna(pairs["atime_hour"])
+    out = pairs["cases"].groupby(hours, dropna=False).sum().sort_index().rename_axis("hour").reset_index(name="cases")
+    out = out[out["hour"].notna()].copy()
+    out["hour"] = out["hour"].astype(int)
+    # Add year column for consistency
+    out["year"] = year
+    return out[["hour", "year", "cases"]]
+
+
+def _plot_hour_of_day(out: pd.DataFrame, year: int, png: BinaryIO) -> None:
+    plt = _pyplot()
+    plt.figure(figsize=(12, 5))
+    plt.bar(out["hour"], out["cases"], color="#4C78A8")
+    plt.title(f"Cases by hour of day ({year})")
+    plt.xlabel("Hour of day (0-23)")
+    plt.ylabel("Number of cases")
+    plt.xticks(range(0, 24))
+    plt.grid(axis='y', linestyle='--', alpha=0.7)
+    plt.tight_layout()
+    plt.savefig(png)
+    plt.close()
+
+
+HOUR_OF_DAY = AggSpec(
+    "hour_of_day", ("hour", "atime_hour"), _finish_hour_of_day, plot=_plot_hour_of_day, figure="hour_of_day"
+)
+
+
+def agg_hour_of_day(df: pd.DataFrame) -> Optional[pd.DataFrame]:
+    """Cases by hour-of-day per year, using event_date hour with fallback to atime hour."""
+    return run_spec(HOUR_OF_DAY, df)
+
+
+def _finish_bkk_top_amphoe(counts: Optional[pd.Series], year: int) -> Optional[pd.DataFrame]:
+    if counts is None or counts.sum() == 0:
+        return None
+    out = (
+        counts
+        .reset_index(name="cases")
+        .sort_values("cases", ascending=False)
+    )
+    
+    # Add year column for consistency
+    out["year"] = year
+    out["district_code"] = place_codes(out["district"], BKK_CODE)
+    return out[["district", "district_code", "year", "cases"]]
+
+
+def _plot_bkk_top_amphoe(out: pd.DataFrame, year: int, png: BinaryIO) -> None:
+    plt = _pyplot()
+    plt.figure(figsize=(12, 8))
+    plt.barh(
+        out["district"][::-1],  # Reverse for descending order
+        out["cases"][::-1],
+        color="#4C78A8",
+        height=0.8
+    )
+    plt.title(f"Bangkok: Top 20 districts by cases ({year})", pad=20)
+    plt.xlabel("Number of cases", labelpad=10)
+    plt.ylabel("District", labelpad=10)
+    plt.grid(axis="x", linestyle="--", alpha=0.3)
+    
+    # Add value labels on the bars
+    for i, v in enumerate(out["cases"][::-1]):
+        plt.text(v + 5, i, f"{v:.0f}", va="center", fontsize=9)
+    
+    plt.tight_layout()
+    plt.savefig(png, dpi=120, bbox_inches="tight")
+    plt.close()
+
+
+BKK_TOP_AMPHOE = AggSpec(
+    "bkk_top_amphoe", ("district",), _finish_bkk_top_amphoe, subset="bkk",
+    plot=_plot_bkk_top_amphoe, figure="bkk_top_amphoe", top=20,
+)
+
+
+def agg_bkk_top_amphoe(df: pd.DataFrame) -> Optional[pd.DataFrame]:
+    """Top 20 Bangkok districts by cases per year with horizontal bar figure."""
+    return run_spec(BKK_TOP_AMPHOE, df)
+
+
+def _finish_head_injury_year(counts: Optional[pd.Series], year: int) -> Optional[pd.DataFrame]:
+    if counts is None or counts.sum() == 0:
+        return None
+    total_cases = counts.sum()
+    head_injury_cases = counts.get(True, 0)
+    head_injury_share = head_injury_cases / total_cases if total_cases > 0 else 0
+    
+    # Create output dataframe
+    return pd.DataFrame({
+        "year": [year],
+        "total_cases": [total_cases],
+        "head_injury_cases": [head_injury_cases],
+        "head_injury_share": [round(head_injury_share, 4)]
+    })
+
+
+def _plot_head_injury_year(out: pd.DataFrame, year: int, png: BinaryIO) -> None:
+    plt = _pyplot()
+    plt.figure(figsize=(10, 6))
     categories = ["All Cases", "Head Injuries"]
-    counts = [total_cases, head_injury_cases]
+    counts = [out["total_cases"].iloc[0], out["head_injury_cases"].iloc[0]]
     
     bars = plt.bar(categories, counts, color=["#4C78A8", "#E45756"])
     
@@ -367,54 +1577,54 @@ def agg_head_injury_year(df: pd.DataFrame) -> Optional[pd.DataFrame]:
                 f"{height:,}",
                 ha='center', va='bottom')
     
-    plt.title("Head Injury Cases (2018)", pad=20)
+    plt.title(f"Head Injury Cases ({year})", pad=20)
     plt.ylabel("Number of Cases")
     plt.ylim(0, max(counts) * 1.15)  # Add some padding at the top
     plt.grid(axis='y', linestyle='--', alpha=0.3)
     plt.tight_layout()
     
-    plt.savefig(os.path.join(FIG_DIR, "head_injury_share_by_year.png"), dpi=120)
+    plt.savefig(png, dpi=120)
     plt.close()
-    
-    return out
 
 
-def agg_top10_provinces_latest_year(df: pd.DataFrame) -> Optional[pd.DataFrame]:
-    """Top 10 provinces by cases in 2018, with horizontal bar figure."""
-    if "prov" not in df.columns:
-        return None
-    
-    # Filter for 2018 data only
-    df_2018 = df[df["year"] == 2018].copy()
-    if len(df_2018) == 0:
+HEAD_INJURY_YEAR = AggSpec(
+    "head_injury", ("head_injury",), _finish_head_injury_year, plot=_plot_head_injury_year, figure="head_injury",
+    hide=("head_injury_cases", "head_injury_share"), totals=("total_cases",),
+)
+
+
+def agg_head_injury_year(df: pd.DataFrame) -> Optional[pd.DataFrame]:
+    """Head injury statistics per year with bar chart."""
+    return run_spec(HEAD_INJURY_YEAR, df)
+
+
+def _finish_top10_provinces_latest_year(counts: Optional[pd.Series], year: int) -> Optional[pd.DataFrame]:
+    if counts is None or counts.sum() == 0:
         return None
     
-    # Get top 10 provinces by case count
+    # Provinces by case count; finish_year keeps the top 10
     prov_cases = (
-        df_2018.groupby("prov", dropna=False)
-        .size()
+        counts
         .reset_index(name="cases")
         .sort_values("cases", ascending=False)
-        .head(10)
     )
     
     # Add year column for consistency
-    prov_cases["year"] = 2018
-    prov_cases = prov_cases[["prov", "year", "cases"]]
-    
-    # Save to CSV
-    prov_cases.to_csv(os.path.join(OUT_DIR, "top10_provinces_latest_year.csv"), index=False)
-    
-    # Create visualization
+    prov_cases["year"] = year
+    return prov_cases[["prov", "year", "cases"]]
+
+
+def _plot_top10_provinces_latest_year(prov_cases: pd.DataFrame, year: int, png: BinaryIO) -> None:
+    plt = _pyplot()
     plt.figure(figsize=(12, 7))
     
     # Sort values in descending order for plotting
-    prov_cases = prov_cases.sort_values("cases", ascending=True)
+    plot_data = prov_cases.sort_values("cases", ascending=True)
     
     # Create horizontal bar plot
     bars = plt.barh(
-        prov_cases["prov"],
-        prov_cases["cases"],
+        plot_data["prov"],
+        plot_data["cases"],
         color="#4C78A8",
         height=0.7
     )
@@ -422,15 +1632,17 @@ def agg_top10_provinces_latest_year(df: pd.DataFrame) -> Optional[pd.DataFrame]:
     # Add value labels on the bars
     for bar in bars:
         width = bar.get_width()
+        if np.isnan(width):  # suppressed
+            continue
         plt.text(
-            width + (0.01 * prov_cases["cases"].max()),  # Position text just outside the bar
+            width + (0.01 * plot_data["cases"].max()),  # Position text just outside the bar
             bar.get_y() + bar.get_height() / 2,  # Center text vertically
             f"{int(width):,}",  # Format number with thousands separator
             va="center",
             fontsize=10
         )
     
-    plt.title("Top 10 Provinces by Road Traffic Injury Cases (2018)", pad=20)
+    plt.title(f"Top 10 Provinces by Road Traffic Injury Cases ({year})", pad=20)
     plt.xlabel("Number of Cases", labelpad=10)
     plt.ylabel("Province", labelpad=10)
     plt.grid(axis="x", linestyle="--", alpha=0.3)
@@ -440,87 +1652,1791 @@ def agg_top10_provinces_latest_year(df: pd.DataFrame) -> Optional[pd.DataFrame]:
     
     # Save the figure with high DPI for better quality
     plt.savefig(
-        os.path.join(FIG_DIR, "top10_provinces_latest_year.png"),
+        png,
         dpi=120,
         bbox_inches="tight"
     )
     plt.close()
-    
-    return prov_cases
 
 
-def qa_parsed_coverage_by_province_year(raw_df: pd.DataFrame, parsed_df: pd.DataFrame) -> None:
-    """Write a coverage table: for each province-year, rows_parsed / rows_total."""
-    # Determine province column in raw
-    prov_col = None
-    for cand in ["prov", "province", "prov_name", "prov_th"]:
-        if cand in raw_df.columns:
-            prov_col = cand; break
-    if prov_col is None or "year" not in parsed_df.columns:
-        return
-    # Total rows per province-year in raw (even if no date)
-    raw_year = parsed_df[["event_date"]].copy()
-    # recompute year from raw's dates to align? Instead, approximate with parsed year groups only for denominator per prov.
-    # Better: use parsed_df for year dimension, but count raw totals per province to gauge relative share by province overall.
-    total_by_prov = raw_df.groupby(prov_col, dropna=False).size().reset_index(name="rows_raw")
-    parsed_by_prov_year = parsed_df.groupby(["prov", "year"], dropna=False).size().reset_index(name="rows_parsed") if "prov" in parsed_df.columns else None
-    if parsed_by_prov_year is None or parsed_by_prov_year.empty:
-        return
-    cov = parsed_by_prov_year.merge(total_by_prov.rename(columns={prov_col: "prov"}), on="prov", how="left")
-    cov["share_parsed_vs_prov_total"] = (cov["rows_parsed"] / cov["rows_raw"]).round(4)
-    cov.to_csv(os.path.join(OUT_DIR, "qa_coverage_province_year.csv"), index=False)
+TOP10_PROVINCES_LATEST_YEAR = AggSpec(
+    "top10_provinces", ("prov",), _finish_top10_provinces_latest_year,
+    plot=_plot_top10_provinces_latest_year, figure="top10_provinces", top=10,
+)
 
-# ---------------------- Main ----------------------
 
-def main():
-    print("Loading raw data...")
-    raw = pd.read_csv(RAW_FILE, encoding="utf-8", low_memory=False)
-    print(f"Rows: {len(raw):,}")
-
-    print("Parsing dates and deriving time buckets...")
-    df = parse_dates(raw)
-    print(f"Rows with valid event_date: {len(df):,}")
-
-    # Apply 2018 year filter
-    df = df.loc[df["year"] == YEAR_FILTER].copy()
-    print(f"Filtering to year {YEAR_FILTER} only: {len(df):,} rows")
-
-    print("Building aggregations...")
-    agg_national_quarter(df)
-    agg_sex_year(df)
-    agg_province_year(df)
-    agg_bkk_quarter(df)
-    agg_mode_mix_bkk_year(df)
-    agg_age_bins_year(df)
-    agg_hour_of_day(df)
-    agg_bkk_top_amphoe(df)
-    agg_head_injury_year(df)
-    agg_top10_provinces_latest_year(df)
-
-    # QA summary
-    try:
-        import json
-        # completeness relative to raw
-        total_rows = int(raw.shape[0])
-        parsed_rows = int(df.shape[0]) if YEAR_FILTER is None else int(df.shape[0])
-        qa = {
-            "total_rows_raw": total_rows,
-            "rows_with_parsed_event_date": parsed_rows,
-            "share_parsed": round(parsed_rows / total_rows, 4) if total_rows else None,
-            "year_filter": YEAR_FILTER,
-            "columns_present": list(df.columns),
-        }
-        with open(os.path.join(OUT_DIR, "qa_summary.json"), "w", encoding="utf-8") as f:
-            json.dump(qa, f, ensure_ascii=False, indent=2)
-        # Year distribution
-        year_counts = df["year"].value_counts().sort_index().rename_axis("year").reset_index(name="rows")
-        year_counts.to_csv(os.path.join(OUT_DIR, "qa_year_counts.csv"), index=False)
-        # Province coverage summary (parsed vs total rows by province)
-        qa_parsed_coverage_by_province_year(raw, df)
-    except Exception:
-        pass
+def agg_top10_provinces_latest_year(df: pd.DataFrame) -> Optional[pd.DataFrame]:
+    """Top 10 provinces by cases per year, with horizontal bar figure."""
+    return run_spec(TOP10_PROVINCES_LATEST_YEAR, df)
+
+
+def _count_qa_coverage(
+    raw_by_prov: Optional[pd.Series], parsed_df: pd.DataFrame, year: Optional[int] = None
+) -> Optional[pd.Series]:
+    """Counts keyed by (kind, prov, year): kind "raw" holds total raw rows per province (raw_by_prov, from
+    count_qa_checks; None without a province column; year is the file's year, NaN when unknown), kind
+    "parsed" holds parsed rows per province-year."""
+    if raw_by_prov is None or "year" not in parsed_df.columns:
+        return None
+    total_by_prov = raw_by_prov.copy()
+    total_by_prov.index = pd.MultiIndex.from_arrays(
+        [["raw"] * len(total_by_prov), total_by_prov.index, [np.nan if year is None else year] * len(total_by_prov)],
+        names=["kind", "prov", "year"],
+    )
+    if "prov" not in parsed_df.columns:
+        return total_by_prov
+    # observed=False: every province of the categorical prov gets a row per year, zero where it has none
+    parsed_by_prov_year = parsed_df.groupby(["prov", "year"], dropna=False, observed=False).size()
+    parsed_by_prov_year.index = pd.MultiIndex.from_arrays(
+        [["parsed"] * len(parsed_by_prov_year)]
+        + [parsed_by_prov_year.index.get_level_values(i) for i in range(2)],
+        names=["kind", "prov", "year"],
+    )
+    return pd.concat([total_by_prov, parsed_by_prov_year])
+
+
+def _finish_qa_coverage(counts: Optional[pd.Series], years: List[int]) -> None:
+    if counts is None:
+        return
+    kinds = counts.index.get_level_values("kind")
+    if not (kinds == "parsed").any():
+        return
+    raw_counts = counts[kinds == "raw"].droplevel("kind")
+    raw_years = raw_counts.index.get_level_values("year")
+    parsed_by_prov_year = counts[kinds == "parsed"].droplevel("kind").reset_index(name="rows_parsed")
+    parsed_by_prov_year["year"] = parsed_by_prov_year["year"].astype(int)
+    tables = []
+    for year in years:
+        # raw rows of the files for this year, plus those of files without a year
+        in_year = (raw_years == year) | raw_years.isna()
+        total_by_prov = raw_counts[in_year].groupby(level="prov", dropna=False).sum().reset_index(name="rows_raw")
+        cov = parsed_by_prov_year.loc[parsed_by_prov_year["year"] == year].merge(total_by_prov, on="prov", how="left")
+        cov["share_parsed_vs_prov_total"] = (cov["rows_parsed"] / cov["rows_raw"]).round(4)
+        write_restricted_table(cov, f"qa_coverage_province_{year}")
+        tables.append(cov)
+    if len(tables) > 1:
+        combined = pd.concat(tables, ignore_index=True)
+        write_restricted_table(combined, f"qa_coverage_province_{years_label(years)}")
+
+
+def qa_parsed_coverage_by_province_year(raw_df: pd.DataFrame, parsed_df: pd.DataFrame) -> None:
+    """Write a coverage table per year: for each province-year, rows_parsed / rows_total."""
+    years = sorted(int(y) for y in parsed_df["year"].unique())
+    _finish_qa_coverage(_count_qa_coverage(qa_rows_by_prov(raw_df, count_qa_checks(raw_df)), parsed_df), years)
+
+
+# ---------------------- QA checks ----------------------
+# Data-quality checks on every raw row, counted while the rows are ingested (partial_counts) rather than by
+# a second scan: each check is evaluated once per distinct value of its column and reaches the rows through
+# the value codes, the rows' failed checks are packed into one bitmask, and a single count over province x
+# event quarter x bitmask gives every check's failures per province and quarter. The counts are additive
+# across chunks and files like the other partial counts.
+
+QA_AGE_MAX = 120  # older ages are counted as out of range (the age bins still take them, up to 200)
+# check -> (column checked, rows counted); the order gives each check its bit
+QA_CHECKS = {
+    "adate_missing": ("adate", "no accident date"),
+    "adate_unparseable": ("adate", "accident date that does not parse"),
+    "adate_be_corrected": ("adate", "accident date with a Buddhist-era year, converted to Gregorian"),
+    "hdate_missing": ("hdate", "no admission date"),
+    "hdate_unparseable": ("hdate", "admission date that does not parse"),
+    "hdate_be_corrected": ("hdate", "admission date with a Buddhist-era year, converted to Gregorian"),
+    "no_event_date": ("adate, hdate", "neither date parses: the row is in no table"),
+    "sex_unmapped": ("sex", "sex missing or a code normalize_sex does not know: counted as unknown"),
+    "icd_missing": ("icdcause", "no ICD-10 cause: mode Unspecified"),
+    "icd_not_v": ("icdcause", "ICD-10 cause outside V01-V99 (not a transport accident)"),
+    "age_missing": ("age", "no age, or one that is not a number"),
+    "age_out_of_range": ("age", f"age below 0 or above {QA_AGE_MAX}"),
+    "hour_missing": ("atime", "no accident time, or one that does not parse"),
+}
+
+
+def _bits(**failed) -> int:
+    """Bitmask of the named QA_CHECKS."""
+    return sum(1 << list(QA_CHECKS).index(check) for check, fails in failed.items() if fails)
+
+
+def qa_flags(raw: pd.DataFrame, date_formats: Optional[Dict[str, str]] = None) -> Tuple[np.ndarray, pd.Series]:
+    """Bitmask of the QA_CHECKS each raw row fails (bit i for the i-th check) and each row's event quarter
+    (missing where no date parses), dated as parse_dates dates it. Every check runs on the distinct values
+    of its column; rows get a column's bits through its codes."""
+    date_formats = pin_date_formats(raw, date_formats or {})
+    n = len(raw)
+    flags = np.zeros(n, dtype=np.int32)
+    # event quarter per row as quarters since 1970 (-1: no date), adate first, else hdate
+    quarter = np.full(n, -1, dtype=np.int64)
+    for col in ["adate", "hdate"]:
+        if col not in raw.columns:
+            flags |= _bits(**{f"{col}_missing": True})
+            continue
+        codes, values = _per_value(raw[col])
+        fixed = fix_buddhist_years(values)
+        parsed = _to_datetime(fixed, date_formats.get(col)).to_numpy()
+        bits = (np.isnat(parsed) * _bits(**{f"{col}_unparseable": True})
+                | (fixed != values).to_numpy() * _bits(**{f"{col}_be_corrected": True}))
+        flags |= _to_rows(codes, bits.astype(np.int32), _bits(**{f"{col}_missing": True}))
+        value_quarter = np.where(np.isnat(parsed), -1, parsed.astype("datetime64[M]").astype(np.int64) // 3)
+        quarter = np.where(quarter < 0, _to_rows(codes, value_quarter, -1), quarter)
+    flags |= (quarter < 0) * np.int32(_bits(no_event_date=True))
+
+    if "sex" in raw.columns:
+        codes, values = _per_value(raw["sex"])
+        known = code_text(values).isin(list(SEX_CODES)).to_numpy()
+        flags |= _to_rows(codes, (~known * _bits(sex_unmapped=True)).astype(np.int32), _bits(sex_unmapped=True))
+    else:
+        flags |= _bits(sex_unmapped=True)
+
+    icd_col = _find_icd_col(raw)
+    if icd_col is not None:
+        codes, values = _per_value(raw[icd_col])
+        not_v = _v_code_labels(values) == VEHICLE_TYPES.index("Non-road or unspecified")
+        flags |= _to_rows(codes, (not_v * _bits(icd_not_v=True)).astype(np.int32), _bits(icd_missing=True))
+    else:
+        flags |= _bits(icd_missing=True)
+
+    if "age" in raw.columns:
+        age = pd.to_numeric(raw["age"], errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+        flags |= np.isnan(age) * np.int32(_bits(age_missing=True))
+        flags |= ((age < 0) | (age > QA_AGE_MAX)) * np.int32(_bits(age_out_of_range=True))
+    else:
+        flags |= _bits(age_missing=True)
+
+    if "atime" in raw.columns:
+        codes, values = _per_value(raw["atime"])
+        parsed = _to_datetime(values, date_formats.get("atime")).to_numpy()
+        flags |= _to_rows(codes, (np.isnat(parsed) * _bits(hour_missing=True)).astype(np.int32), _bits(hour_missing=True))
+    else:
+        flags |= _bits(hour_missing=True)
+
+    # "YYYY-Qn" like parse_dates, as a categorical over the quarters between the first and the last
+    dated = quarter[quarter >= 0]
+    first = int(dated.min()) if len(dated) else 0
+    last = int(dated.max()) if len(dated) else -1
+    labels = [f"{1970 + k // 4}-Q{k % 4 + 1}" for k in range(first, last + 1)]
+    codes = np.where(quarter < 0, -1, quarter - first)
+    return flags, pd.Series(pd.Categorical.from_codes(codes, categories=labels), index=raw.index, name="quarter")
+
+
+def count_qa_checks(raw: pd.DataFrame, date_formats: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+    """Raw rows ("rows") and rows failing each of QA_CHECKS, per (prov, quarter) with rows. raw is a slice
+    of raw rows as read, or of the Parquet cache, whose qa_flags and quarter columns already hold them."""
+    if "qa_flags" in raw.columns:
+        flags, quarter = raw["qa_flags"].to_numpy(), raw["quarter"]
+    else:
+        flags, quarter = qa_flags(raw, date_formats)
+    prov_col = _find_prov_col(raw)
+    prov = raw[prov_col] if prov_col is not None else pd.Series(np.nan, index=raw.index, dtype=object)
+    # the bitmasks that occur, numbered in order without sorting the rows
+    present = np.flatnonzero(np.bincount(flags))
+    lookup = np.zeros(present[-1] + 1 if len(present) else 1, dtype=np.int64)
+    lookup[present] = np.arange(len(present))
+    counts = _count_codes(
+        [_codes(prov), _codes(quarter), (lookup[flags], pd.Index(present))], ("prov", "quarter", "flags"), observed=True
+    )
+    out = counts.reset_index(name="rows")
+    bits = out.pop("flags").to_numpy().astype(np.int64)
+    for bit, check in enumerate(QA_CHECKS):
+        out[check] = np.where((bits >> bit) & 1, out["rows"], 0)
+    return out.groupby(["prov", "quarter"], dropna=False, sort=True).sum()
+
+
+def qa_rows_by_prov(raw: pd.DataFrame, checks: pd.DataFrame) -> Optional[pd.Series]:
+    """Raw rows per province from count_qa_checks, for the coverage table (None without a province column)."""
+    if _find_prov_col(raw) is None:
+        return None
+    return checks["rows"].groupby(level="prov", dropna=False).sum()
+
+
+def _finish_qa_checks(checks: Optional[pd.DataFrame], label: str) -> Optional[dict]:
+    """Write the outputs/qa_checks_province_quarter_<label> table and return the totals of each check for the QA
+    summary."""
+    if checks is None:
+        return None
+    table = checks.sort_index().reset_index()
+    # relative to OUT_DIR, where the summary is written
+    name = os.path.relpath(write_restricted_table(table, f"qa_checks_province_quarter_{label}"), OUT_DIR)
+    total = int(table["rows"].sum())
+    return {
+        "rows_checked": total,
+        "by_province_quarter": name,
+        "checks": {
+            check: {
+                "column": column,
+                "rows": int(table[check].sum()),
+                "share": round(int(table[check].sum()) / total, 4) if total else None,
+                "counts": description,
+            }
+            for check, (column, description) in QA_CHECKS.items()
+        },
+    }
+
+
+@contextmanager
+def qa_step(name: str, errors: List[dict]):
+    """Run one QA output step; a failure is recorded in errors (and reported) instead of stopping the run."""
+    try:
+        yield
+    except Exception as e:
+        errors.append({"step": name, "error": f"{type(e).__name__}: {e}"})
+        print(f"QA step {name} failed: {type(e).__name__}: {e}", file=sys.stderr)
+
+
+# ---------------------- Time series ----------------------
+# Cases per province and day are counted while the rows are ingested (count_daily; additive like the other
+# partial counts) and laid out as one dense province x day matrix over every day of the run's years, zeros
+# included. Rolling means, weekly sums, holiday windows and anomaly flags are then whole-matrix NumPy
+# operations (cumulative sums along the day axis), whatever the number of provinces and years.
+
+DAILY_TABLE = "daily"  # --table name of the time-series outputs
+NATIONAL_LABEL = "ทั้งประเทศ"  # prov of the national rows
+ROLLING_WINDOWS = (7, 28)  # trailing days of the rolling means (avg_7d, avg_28d)
+ANOMALY_WINDOW = 28  # days before a day that its z-score is measured against
+ANOMALY_Z = 3.0
+ANOMALY_MIN_CASES = 5  # fewer cases on a day are never flagged
+# holiday -> (month, day) at the centre of its "7 dangerous days" campaign window
+HOLIDAY_WINDOWS = {"new_year": (1, 1), "songkran": (4, 14)}
+HOLIDAY_HALF_WIDTH = 3  # days either side of the centre
+
+
+def count_daily(df: pd.DataFrame, date_formats: Optional[Dict[str, str]] = None) -> Optional[pd.Series]:
+    """Parsed rows per (prov, day of event_date); one missing province without a province column."""
+    if "event_date" not in df.columns:
+        return None
+    with stage("count:daily", rows_in=len(df)) as rec:
+        prov = DERIVED_KEYS["prov"](df, date_formats or {})
+        if prov is None:
+            prov = pd.Series(np.nan, index=df.index, dtype=object)
+        day = df["event_date"].dt.normalize()
+        counts = _count_codes([_codes(prov), _codes(day)], ("prov", "day"), observed=True)
+        rec["rows_out"] = len(counts)
+    return counts
+
+
+def _matrix_axis(values: pd.Index) -> Tuple[np.ndarray, pd.Index]:
+    """Matrix position of each of values and the labels of the positions (sorted, missing last)."""
+    codes, labels = _codes(pd.Series(values, dtype=object))
+    if (codes < 0).any():
+        labels = labels.insert(len(labels), np.nan)
+        codes = np.where(codes < 0, len(labels) - 1, codes)
+    return codes, labels
+
+
+def daily_matrix(counts: pd.Series, years: List[int]) -> Tuple[np.ndarray, pd.Index, pd.DatetimeIndex]:
+    """count_daily's counts as a dense (province, day) matrix over every day from Jan 1 of the first year
+    to Dec 31 of the last, with its provinces (sorted, missing last) and days."""
+    days = pd.date_range(f"{min(years)}-01-01", f"{max(years)}-12-31", freq="D")
+    prov_codes, provinces = _matrix_axis(counts.index.get_level_values("prov"))
+    day = (counts.index.get_level_values("day") - days[0]).days.to_numpy()
+    inside = (day >= 0) & (day < len(days))
+    flat = prov_codes[inside] * len(days) + day[inside]
+    matrix = np.bincount(flat, weights=counts.to_numpy()[inside], minlength=len(provinces) * len(days))
+    return matrix.astype(np.int64).reshape(len(provinces), len(days)), provinces, days
+
+
+def trailing_sums(matrix: np.ndarray, window: int, lag: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """Sum of each row over the window days ending lag days before each day, and the number of those
+    days inside the matrix (fewer at the start)."""
+    padded = np.zeros((matrix.shape[0], matrix.shape[1] + window + lag), dtype=float)
+    padded[:, window + lag:] = np.cumsum(matrix, axis=1)
+    sums = padded[:, window:window + matrix.shape[1]] - padded[:, :matrix.shape[1]]
+    days = np.clip(np.arange(matrix.shape[1]) - lag + 1, 0, window)
+    return sums, days
+
+
+def rolling_mean(matrix: np.ndarray, window: int) -> np.ndarray:
+    """Mean of each day and the window - 1 days before it (fewer at the start)."""
+    sums, days = trailing_sums(matrix, window)
+    return sums / days
+
+
+def anomaly_scores(matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Z-score of each day against the ANOMALY_WINDOW days before it (NaN until there are that many) and
+    whether it is an anomaly: z >= ANOMALY_Z with at least ANOMALY_MIN_CASES cases. The variance is
+    floored at the mean and at 1, since counts are at least Poisson-noisy: a run of zeros does not make
+    every later case an anomaly."""
+    sums, days = trailing_sums(matrix, ANOMALY_WINDOW, lag=1)
+    squares, _ = trailing_sums(matrix.astype(float) ** 2, ANOMALY_WINDOW, lag=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = sums / days
+        var = np.maximum(squares / days - mean ** 2, np.maximum(mean, 1.0))
+        z = np.where(days == ANOMALY_WINDOW, (matrix - mean) / np.sqrt(var), np.nan)
+    return z, (z >= ANOMALY_Z) & (matrix >= ANOMALY_MIN_CASES)
+
+
+def weekly_sums(matrix: np.ndarray, days: pd.DatetimeIndex) -> Tuple[np.ndarray, np.ndarray, pd.DatetimeIndex]:
+    """Sums of each row per Monday-to-Sunday week, the days of each week inside days, and the Mondays."""
+    lead = days[0].weekday()
+    weeks = -(-(lead + len(days)) // 7)
+    padded = np.zeros((matrix.shape[0], weeks * 7), dtype=matrix.dtype)
+    padded[:, lead:lead + len(days)] = matrix
+    inside = np.zeros(weeks * 7, dtype=np.int64)
+    inside[lead:lead + len(days)] = 1
+    mondays = pd.date_range(days[0] - pd.Timedelta(days=lead), periods=weeks, freq="7D")
+    return padded.reshape(len(matrix), weeks, 7).sum(axis=2), inside.reshape(weeks, 7).sum(axis=1), mondays
+
+
+def holiday_windows(matrix: np.ndarray, days: pd.DatetimeIndex, years: List[int]) -> pd.DataFrame:
+    """Cases of each matrix row (column row) in every HOLIDAY_WINDOWS window of years, over the days of the
+    window inside days, with their daily mean against the mean daily cases of the same year's days outside
+    every window. A New Year window belongs to the year of its Jan 1; the next year's still counts as holiday
+    days of the last year (its Dec 29-31), not as ordinary ones."""
+    windows = {}
+    for year in [*years, max(years) + 1]:
+        for name, (month, day) in HOLIDAY_WINDOWS.items():
+            centre = (pd.Timestamp(year, month, day) - days[0]).days
+            span = np.arange(centre - HOLIDAY_HALF_WIDTH, centre + HOLIDAY_HALF_WIDTH + 1)
+            windows[(year, name)] = span[(span >= 0) & (span < len(days))]
+    in_window = np.zeros(len(days), dtype=bool)
+    for span in windows.values():
+        in_window[span] = True
+
+    tables = []
+    for (year, name), span in windows.items():
+        if year not in years or not len(span):
+            continue
+        ordinary = matrix[:, (days.year == year) & ~in_window].mean(axis=1)
+        daily_mean = matrix[:, span].mean(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            ratio = daily_mean / ordinary
+        tables.append(pd.DataFrame({
+            "row": np.arange(len(matrix)),
+            "year": year,
+            "window": name,
+            "start": days[span[0]].strftime("%Y-%m-%d"),
+            "end": days[span[-1]].strftime("%Y-%m-%d"),
+            "days": len(span),
+            "cases": matrix[:, span].sum(axis=1),
+            "daily_mean": daily_mean.round(2),
+            "ordinary_daily_mean": ordinary.round(2),
+            "ratio": ratio.round(2),
+        }))
+    return pd.concat(tables, ignore_index=True)
+
+
+def _finish_daily(counts: Optional[pd.Series], years: List[int], label: str) -> None:
+    """Write outputs/daily_province_<label>.csv (cases per province and day with rolling means, z-score and
+    anomaly flag), weekly_province_<label>.csv and holiday_windows_<label>.csv. Each has the national
+    series too, as prov NATIONAL_LABEL."""
+    if counts is None:
+        return
+    matrix, provinces, days = daily_matrix(counts, years)
+    matrix = np.vstack([matrix, matrix.sum(axis=0)])
+    names = pd.Series(list(provinces) + [NATIONAL_LABEL], dtype=object)
+    codes = place_codes(names)
+
+    def frame(index_name: str, index: pd.DatetimeIndex, columns: Dict[str, np.ndarray]) -> pd.DataFrame:
+        out = pd.DataFrame({
+            "prov": np.repeat(names.to_numpy(), len(index)),
+            "prov_code": codes.array.take(np.repeat(np.arange(len(names)), len(index))),
+            index_name: np.tile(index.strftime("%Y-%m-%d"), len(names)),
+        })
+        for name, values in columns.items():
+            out[name] = values.ravel()
+        return out
+
+    daily = {"cases": matrix}
+    for window in ROLLING_WINDOWS:
+        daily[f"avg_{window}d"] = rolling_mean(matrix, window).round(2)
+    z, anomaly = anomaly_scores(matrix)
+    daily["zscore"], daily["anomaly"] = z.round(2), anomaly
+    weekly, week_days, mondays = weekly_sums(matrix, days)
+    weeks = frame("week", mondays, {"days": np.broadcast_to(week_days, weekly.shape), "cases": weekly})
+    holidays = holiday_windows(matrix, days, years)
+    daily = frame("date", days, daily)
+    if _suppress_below:
+        daily, weeks, holidays = _suppress_daily(matrix, days, years, daily, weeks, holidays)
+    write_table(daily, f"daily_province_{label}")
+    write_table(weeks, f"weekly_province_{label}")
+
+    rows = holidays.pop("row").to_numpy()
+    holidays.insert(0, "prov_code", codes.array.take(rows))
+    holidays.insert(0, "prov", names.to_numpy()[rows])
+    write_table(holidays, f"holiday_windows_{label}")
+
+
+def _suppress_daily(
+    matrix: np.ndarray, days: pd.DatetimeIndex, years: List[int],
+    daily: pd.DataFrame, weeks: pd.DataFrame, holidays: pd.DataFrame,
+) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """The three time-series tables with the active suppression applied (see suppress_series). A rolling
+    mean, z-score or holiday window covering a hidden day is hidden too, since it would give the day away;
+    so is a year's ordinary daily mean when one of its holiday windows is hidden."""
+    hidden, hidden_weeks = suppress_series(matrix, days, _suppress_below)
+    covered = {"cases": hidden}
+    for window in ROLLING_WINDOWS:
+        covered[f"avg_{window}d"] = trailing_sums(hidden, window)[0] > 0
+    covered["zscore"] = covered["anomaly"] = hidden | (trailing_sums(hidden, ANOMALY_WINDOW, lag=1)[0] > 0)
+    daily = _blank_rows(daily, hidden.ravel(), (), (), _suppress_below)
+    for col, mask in covered.items():
+        daily[col] = _blank(daily[col], mask.ravel())
+    weeks = _blank_rows(weeks, hidden_weeks.ravel(), ("cases",), (), _suppress_below)
+
+    in_window = holiday_windows(hidden.astype(np.int64), days, years)["cases"].to_numpy() > 0
+    holidays = _blank_rows(holidays, in_window, ("cases", "daily_mean", "ratio"), (), _suppress_below)
+    in_year = pd.Series(in_window).groupby([holidays["row"], holidays["year"]]).transform("any").to_numpy()
+    for col in ("ordinary_daily_mean", "ratio"):
+        holidays[col] = _blank(holidays[col], in_year)
+    return daily, weeks, holidays
+
+
+# ---------------------- Share intervals ----------------------
+# Companion tables of the province shares with their uncertainty: for every province x category cell, the
+# share of the province's cases with a Wilson score interval and a percentile bootstrap interval. The
+# bootstrap redraws each province's count vector from a multinomial with its own total and shares, which
+# is the same as resampling its rows, for all provinces and replicates in one batched NumPy draw; no row is
+# touched. Draws are seeded per year, so the tables are reproducible.
+
+SHARE_CONFIDENCE = 0.95
+BOOTSTRAP_REPLICATES = 2000
+BOOTSTRAP_SEED = 0
+
+
+def wilson_interval(
+    cases: np.ndarray, total: np.ndarray, confidence: float = SHARE_CONFIDENCE
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Wilson score interval of the shares cases / total (NaN where total is 0)."""
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        n = np.asarray(total, dtype=float)
+        p = cases / n
+        centre = (p + z**2 / (2 * n)) / (1 + z**2 / n)
+        half = z * np.sqrt(p * (1 - p) / n + z**2 / (4 * n**2)) / (1 + z**2 / n)
+    return np.clip(centre - half, 0, 1), np.clip(centre + half, 0, 1)
+
+
+def bootstrap_interval(
+    matrix: np.ndarray,
+    rng: np.random.Generator,
+    replicates: Optional[int] = None,
+    confidence: float = SHARE_CONFIDENCE,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Percentile bootstrap interval of each share matrix[i, j] / matrix[i].sum(), from replicates (default
+    BOOTSTRAP_REPLICATES) multinomial redraws of every row's counts (NaN for rows without cases)."""
+    replicates = replicates or BOOTSTRAP_REPLICATES
+    totals = matrix.sum(axis=1)
+    live = totals > 0
+    low, high = np.full(matrix.shape, np.nan), np.full(matrix.shape, np.nan)
+    if live.any():
+        n = totals[live]
+        draws = rng.multinomial(n, matrix[live] / n[:, None], size=(replicates, len(n)))
+        alpha = (1 - confidence) / 2
+        low[live], high[live] = np.quantile(draws / n[:, None], [alpha, 1 - alpha], axis=0)
+    return low, high
+
+
+def share_intervals(counts: pd.Series, category: str, year: int) -> pd.DataFrame:
+    """Cases, province total, share and the SHARE_CONFIDENCE Wilson and bootstrap intervals of every
+    province x category cell of counts (keyed by prov and category), plus the national cells as prov
+    NATIONAL_LABEL. Provinces without cases are left out."""
+    prov_codes, provinces = _matrix_axis(counts.index.get_level_values("prov"))
+    cat_codes, categories = _matrix_axis(counts.index.get_level_values(category))
+    flat = prov_codes * len(categories) + cat_codes
+    matrix = np.bincount(flat, weights=counts.to_numpy(), minlength=len(provinces) * len(categories))
+    matrix = matrix.astype(np.int64).reshape(len(provinces), len(categories))
+    live = matrix.sum(axis=1) > 0
+    matrix = np.vstack([matrix[live], matrix.sum(axis=0)])
+    names = pd.Series(list(provinces[live]) + [NATIONAL_LABEL], dtype=object)
+
+    totals = np.repeat(matrix.sum(axis=1), len(categories))
+    cases = matrix.ravel()
+    wilson_low, wilson_high = wilson_interval(cases, totals)
+    boot_low, boot_high = bootstrap_interval(matrix, np.random.default_rng([BOOTSTRAP_SEED, year]))
+    return pd.DataFrame({
+        "prov": np.repeat(names.to_numpy(), len(categories)),
+        "prov_code": place_codes(names).array.take(np.repeat(np.arange(len(names)), len(categories))),
+        "year": year,
+        category: np.tile(np.asarray(categories, dtype=object), len(names)),
+        "cases": cases,
+        "total": totals,
+        "share": (cases / totals).round(4),
+        "wilson_low": wilson_low.round(4),
+        "wilson_high": wilson_high.round(4),
+        "bootstrap_low": boot_low.ravel().round(4),
+        "bootstrap_high": boot_high.ravel().round(4),
+    })
+
+
+def _finish_mode_mix_province_ci(counts: Optional[pd.Series], year: int) -> Optional[pd.DataFrame]:
+    if counts is None or counts.sum() == 0:
+        return None
+    return share_intervals(counts, "vehicle_type", year)
+
+
+# a hidden cell's share and intervals would give its cases away
+CI_HIDE = ("cases", "share", "wilson_low", "wilson_high", "bootstrap_low", "bootstrap_high")
+
+MODE_MIX_PROVINCE_CI = AggSpec(
+    "mode_mix_province_ci", ("prov", "vehicle_type"), _finish_mode_mix_province_ci, observed=False,
+    hide=CI_HIDE, totals=("total",),
+)
+
+
+def agg_mode_mix_province_ci(df: pd.DataFrame) -> Optional[pd.DataFrame]:
+    """Vehicle-type shares per province per year with Wilson and bootstrap intervals (CSV only)."""
+    return run_spec(MODE_MIX_PROVINCE_CI, df)
+
+
+def _finish_head_injury_province_ci(counts: Optional[pd.Series], year: int) -> Optional[pd.DataFrame]:
+    if counts is None or counts.sum() == 0:
+        return None
+    return share_intervals(counts, "head_injury", year)
+
+
+HEAD_INJURY_PROVINCE_CI = AggSpec(
+    "head_injury_province_ci", ("prov", "head_injury"), _finish_head_injury_province_ci, observed=False,
+    hide=CI_HIDE, totals=("total",),
+)
+
+
+def agg_head_injury_province_ci(df: pd.DataFrame) -> Optional[pd.DataFrame]:
+    """Head-injury shares per province per year with Wilson and bootstrap intervals (CSV only)."""
+    return run_spec(HEAD_INJURY_PROVINCE_CI, df)
+
+
+# ---------------------- Disclosure control ----------------------
+# Inside a suppression(threshold) block (--suppress-below), every table is published with its small cells
+# hidden. Primary suppression hides the cells with 0 < cases < threshold. A hidden cell could still be
+# worked out from a published total (a row or column total of the table, or the same total in another
+# table) when it is the only hidden cell adding up to it, so complementary suppression then hides the
+# smallest other positive cell of every such line, repeated until no line has a single hidden cell. A line
+# whose other cells are all zero cannot be protected inside the table, but its total equals the hidden cell
+# and is itself hidden wherever it is published. Lines are given as arrays of line ids per cell, so a
+# whole table, or any cube roll-up, is one set of NumPy passes (bincount and lexsort) per round.
+
+SUPPRESS_BELOW = 0  # default threshold: 0 publishes every cell
+
+_suppress_below = SUPPRESS_BELOW
+
+
+@contextmanager
+def suppression(threshold: int):
+    """Suppress cells below threshold in the tables finished inside the block (see finish_year)."""
+    global _suppress_below
+    previous, _suppress_below = _suppress_below, threshold
+    try:
+        yield
+    finally:
+        _suppress_below = previous
+
+
+def suppression_threshold() -> int:
+    """Threshold of the active suppression block; 0 outside one."""
+    return _suppress_below
+
+
+def suppress_cells(
+    values: np.ndarray, lines: List[np.ndarray], threshold: int, hidden: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """Which cells of values (counts) to hide: those with 0 < count < threshold and those already hidden,
+    then complementary cells. lines holds one array per kind of known total, giving each cell's line
+    (cells with the same id add up to a published total; -1 for none)."""
+    values = np.asarray(values)
+    hidden = (values > 0) & (values < threshold) | (False if hidden is None else hidden)
+    if not hidden.any():
+        return hidden
+    compact = []
+    for line in lines:
+        ids = np.full(len(values), -1, dtype=np.int64)
+        inside = line >= 0
+        uniques, ids[inside] = np.unique(line[inside], return_inverse=True)
+        compact.append((ids, len(uniques)))
+    positive = values > 0
+    changed = True
+    while changed:
+        changed = False
+        for ids, n in compact:
+            per_line = np.bincount(ids[hidden & (ids >= 0)], minlength=n)
+            exposed = np.flatnonzero(~hidden & positive & (ids >= 0))
+            exposed = exposed[per_line[ids[exposed]] == 1]
+            if not len(exposed):
+                continue
+            # the smallest exposed cell of each line (the first of equals)
+            order = exposed[np.lexsort((values[exposed], ids[exposed]))]
+            first = np.r_[True, ids[order][1:] != ids[order][:-1]]
+            hidden[order[first]] = True
+            changed = True
+    return hidden
+
+
+def grid_lines(codes: List[np.ndarray]) -> List[np.ndarray]:
+    """Lines of a table whose cells are keyed by codes (one non-negative array per key): for each key,
+    the cells that agree on every other key (all cells for a single key)."""
+    sizes = [int(c.max()) + 1 if len(c) else 1 for c in codes]
+    if np.prod(sizes, dtype=float) >= 2**63:
+        raise ValueError("too many key combinations to suppress")
+    lines = []
+    for i in range(len(codes)):
+        line = np.zeros(len(codes[i]), dtype=np.int64)
+        for j, (c, size) in enumerate(zip(codes, sizes)):
+            if j != i:
+                line = line * size + c
+        lines.append(line)
+    return lines
+
+
+def suppress_counts(counts: pd.Series, threshold: Optional[int] = None) -> np.ndarray:
+    """Cells of counts to hide (see suppress_cells), its totals along each key being known; counts is keyed
+    by one or more keys, like a table's counts or a cube_query roll-up. threshold defaults to the active
+    suppression."""
+    threshold = _suppress_below if threshold is None else threshold
+    index = counts.index
+    if isinstance(index, pd.MultiIndex):
+        codes = [np.asarray(c) + 1 for c in index.codes]
+    else:
+        codes = [pd.factorize(index, use_na_sentinel=False)[0]]
+    return suppress_cells(counts.to_numpy(), grid_lines(codes), threshold)
+
+
+def _blank(values: pd.Series, hidden: np.ndarray) -> pd.Series:
+    """values with the hidden ones missing; integers and flags stay integers and flags (nullable)."""
+    if values.dtype.kind in "iu":
+        values = values.astype("Int64")
+    elif values.dtype.kind == "b":
+        values = values.astype("boolean")
+    return values.mask(hidden)
+
+
+def suppress_rows(
+    out: pd.DataFrame, keys: List[str], hide: Tuple[str, ...] = ("cases",), totals: Tuple[str, ...] = (),
+    threshold: Optional[int] = None,
+) -> pd.DataFrame:
+    """out, whose rows are cells keyed by the keys columns with their count in cases, with the hide columns
+    of the cells to hide blanked, the totals columns blanked where below threshold, and a suppressed
+    column. threshold defaults to the active suppression; without one, out is returned as it is."""
+    threshold = _suppress_below if threshold is None else threshold
+    if not threshold:
+        return out
+    codes = [pd.factorize(out[key], use_na_sentinel=False)[0] for key in keys]
+    hidden = suppress_cells(out["cases"].to_numpy(), grid_lines(codes), threshold)
+    return _blank_rows(out, hidden, hide, totals, threshold)
+
+
+def _blank_rows(
+    out: pd.DataFrame, hidden: np.ndarray, hide: Tuple[str, ...], totals: Tuple[str, ...], threshold: int
+) -> pd.DataFrame:
+    out = out.copy()
+    for col in hide:
+        if col in out.columns:  # e.g. cases_per_100k only exists with populations loaded
+            out[col] = _blank(out[col], hidden)
+    for col in totals:
+        out[col] = _blank(out[col], ((out[col] > 0) & (out[col] < threshold)).to_numpy())
+    out["suppressed"] = hidden
+    return out
+
+
+def suppress_table(out: pd.DataFrame, spec: AggSpec, counts: Optional[pd.Series]) -> pd.DataFrame:
+    """One year's table of spec with the active suppression applied. Its rows are the cells, keyed by the
+    spec's keys that the table has; a table with none of them (one summary row) is hidden whenever its
+    counts have a cell to hide."""
+    keys = [key for key in spec.keys if key in out.columns]
+    if keys:
+        return suppress_rows(out, keys, spec.hide, spec.totals)
+    hidden = counts is not None and suppress_counts(counts).any()
+    return _blank_rows(out, np.full(len(out), hidden), spec.hide, spec.totals, _suppress_below)
+
+
+def write_restricted_table(df: pd.DataFrame, stem: str) -> str:
+    """write_table for the per-province QA tables, which are not suppressed: their row counts would give
+    the hidden cells of the published tables away. Under an active suppression they are written as CSV to
+    RESTRICTED_DIR instead, outside OUT_DIR and its manifest, and a copy an unsuppressed run left in
+    OUT_DIR is removed. Returns the path."""
+    if not _suppress_below:
+        return write_table(df, stem)
+    for ext in OUTPUT_FORMATS.values():
+        stale = os.path.join(OUT_DIR, stem + ext)
+        if os.path.exists(stale):
+            os.remove(stale)
+    path = os.path.join(RESTRICTED_DIR, stem + ".csv")
+    atomic_write(path, table_bytes(df))
+    return path
+
+
+def suppress_series(
+    matrix: np.ndarray, days: pd.DatetimeIndex, threshold: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Cells to hide of a (province, day) matrix whose last row is the national series, and of its weekly
+    sums (weekly_sums). Week cells have the national week and each province's weeks of a year as totals.
+    Day cells have the national day and their week as totals, and every day of a hidden week is hidden,
+    so that published days cannot add up to it."""
+    rows, n_days = matrix.shape
+    weekly, _, mondays = weekly_sums(matrix, days)
+    n_weeks = weekly.shape[1]
+    row = np.repeat(np.arange(rows), n_weeks)
+    week = np.tile(np.arange(n_weeks), rows)
+    national = row == rows - 1
+    year = np.tile(mondays.year.to_numpy() - mondays.year.min(), rows)
+    hidden_weeks = suppress_cells(
+        weekly.ravel(), [row * (year.max() + 1) + year, np.where(national, -1, week)], threshold
+    ).reshape(rows, n_weeks)
+
+    week_of_day = (days[0].weekday() + np.arange(n_days)) // 7
+    row = np.repeat(np.arange(rows), n_days)
+    day = np.tile(np.arange(n_days), rows)
+    lines = [np.where(row == rows - 1, -1, day), row * n_weeks + week_of_day[day]]
+    hidden = suppress_cells(matrix.ravel(), lines, threshold, hidden_weeks[:, week_of_day].ravel())
+    return hidden.reshape(rows, n_days), hidden_weeks
+
+
+# ---------------------- Streaming ----------------------
+
+AGG_SPECS = [
+    NATIONAL_QUARTER,
+    SEX_YEAR,
+    PROVINCE_YEAR,
+    BKK_QUARTER,
+    MODE_MIX_BKK_YEAR,
+    MODE_MIX_YEAR,
+    MODE_MIX_PROVINCE_YEAR,
+    AGE_BINS_YEAR,
+    HOUR_OF_DAY,
+    BKK_TOP_AMPHOE,
+    HEAD_INJURY_YEAR,
+    TOP10_PROVINCES_LATEST_YEAR,
+    MODE_MIX_PROVINCE_CI,
+    HEAD_INJURY_PROVINCE_CI,
+]
+
+
+def partial_counts(
+    raw: pd.DataFrame,
+    df: pd.DataFrame,
+    date_formats: Optional[Dict[str, str]] = None,
+    columns_present: Optional[List[str]] = None,
+    year: Optional[int] = None,
+) -> dict:
+    """Additive counts over one slice of rows: the count cube (every table is a query of it), the daily
+    counts per province and the QA outputs. raw is the slice as read, df the same slice after parse_dates and the year filter (year, if
+    any). columns_present overrides df's columns in the QA summary (the cache loads only some columns)."""
+    parts = {"cube": build_cube(df, date_formats), "daily": count_daily(df, date_formats)}
+    with stage("count:qa_checks", rows_in=len(raw)) as rec:
+        parts["qa_checks"] = count_qa_checks(raw, date_formats)
+        rec["rows_out"] = len(parts["qa_checks"])
+    with stage("count:qa_coverage", rows_in=len(df)):
+        parts["qa_coverage"] = _count_qa_coverage(qa_rows_by_prov(raw, parts["qa_checks"]), df, year)
+    parts["qa_year_counts"] = df["year"].value_counts()
+    parts["total_rows_raw"] = int(raw.shape[0])
+    parts["rows_parsed"] = int(df.shape[0])
+    parts["columns_present"] = list(df.columns) if columns_present is None else columns_present
+    return parts
+
+
+def merge_partials(acc: Optional[dict], parts: dict) -> dict:
+    """Fold one slice's partial_counts into the running totals."""
+    if acc is None:
+        return parts
+    for key, value in parts.items():
+        if key == "columns_present":
+            continue
+        if isinstance(value, (int, list)):
+            acc[key] = acc.get(key, type(value)()) + value
+        elif key == "cube":
+            acc[key] = merge_cubes(acc[key], value)
+        else:
+            acc[key] = add_counts(acc[key], value)
+    return acc
+
+
+def finish_partials(
+    parts: dict, figures: bool = True, jobs: Optional[int] = None, tables: Optional[List[str]] = None
+) -> None:
+    """Write every table, figure and QA file from (merged) partial counts, one file per year and
+    a combined <first>-<last> file when there are several years. Figures are rendered last, up to
+    jobs at a time (see render_figures); figures=False writes the CSVs only. tables restricts the
+    tables (and their figures) to those names; the QA files are always written. The cube is kept as
+    cache/cube_<years>.pkl for ad hoc queries (load_cube, cube_query) and plot_cube; it is not
+    published with the outputs since its cells go down to single people."""
+    years = sorted(int(y) for y in parts["qa_year_counts"].index)
+    if not years:
+        print("No rows with a parsed event date in the selected years; nothing to write.")
+        return
+    label = years_label(years)
+    os.makedirs(OUT_DIR, exist_ok=True)
+    figure_jobs = []
+    for spec in select_specs(tables):
+        finish_table(spec, cube_table(parts["cube"], spec), years, figure_jobs)
+    if tables is None or DAILY_TABLE in tables:
+        with stage("finish:daily"):
+            _finish_daily(parts.get("daily"), years, label)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    parts["cube"].to_pickle(os.path.join(CACHE_DIR, f"cube_{label}.pkl"))
+
+    # QA summary: completeness relative to raw, the QA checks and any QA step that failed
+    total_rows = parts["total_rows_raw"]
+    parsed_rows = parts["rows_parsed"]
+    qa = {
+        "total_rows_raw": total_rows,
+        "rows_with_parsed_event_date": parsed_rows,
+        "share_parsed": round(parsed_rows / total_rows, 4) if total_rows else None,
+        "year_filter": years[0] if len(years) == 1 else years,
+        "raw_files": parts.get("raw_files", []),
+        "columns_present": parts["columns_present"],
+    }
+    errors: List[dict] = []
+    with qa_step("year_counts", errors):
+        year_counts = parts["qa_year_counts"].sort_index().rename_axis("year").reset_index(name="rows")
+        write_table(year_counts, f"qa_year_counts_{label}")
+    # Province coverage summary (parsed vs total rows by province)
+    with qa_step("coverage", errors), stage("finish:qa_coverage"):
+        _finish_qa_coverage(parts["qa_coverage"], years)
+    with qa_step("checks", errors), stage("finish:qa_checks"):
+        qa["qa_checks"] = _finish_qa_checks(parts.get("qa_checks"), label)
+    qa["errors"] = errors
+    write_json(qa, f"qa_summary_{label}")
+
+    if figures:
+        rendered = render_figures(figure_jobs, jobs)
+        print(f"Figures: {rendered} rendered, {len(figure_jobs) - rendered} unchanged")
+
+
+def _parse_year(raw: pd.DataFrame, date_formats: Optional[Dict[str, str]], year: Optional[int]) -> pd.DataFrame:
+    """parse_dates, then keep the rows of year (if given)."""
+    with stage("parse_dates", rows_in=len(raw)) as rec:
+        df = parse_dates(raw, date_formats)
+        rec["rows_out"] = len(df)
+    if year is not None:
+        with stage("filter_year", rows_in=len(df)) as rec:
+            df = df.loc[df["year"] == year]
+            rec["rows_out"] = len(df)
+    return df
+
+
+def pin_date_formats(raw: pd.DataFrame, date_formats: Dict[str, str]) -> Dict[str, str]:
+    """date_formats plus the inferred format of each date column of raw that has none yet."""
+    date_formats = dict(date_formats)
+    for col in ["adate", "hdate", "atime"]:
+        if col in raw.columns and col not in date_formats:
+            fmt = infer_date_format(raw[col])
+            if fmt is not None:
+                date_formats[col] = fmt
+    return date_formats
+
+
+def pin_file_date_formats(path: str, date_formats: Dict[str, str], chunksize: int = 10_000) -> Dict[str, str]:
+    """pin_date_formats for the whole of path without parsing it: read chunksize rows at a time until every
+    date column has a value, so each is pinned from its first value in the file, as a whole-file read infers
+    it, however many leading rows leave it empty."""
+    wanted = [col for col in ["adate", "hdate", "atime"] if col in raw_columns(path)]
+    date_formats = dict(date_formats)
+    for chunk in read_raw(path, chunksize=chunksize):
+        date_formats = pin_date_formats(chunk, date_formats)
+        if all(col in date_formats for col in wanted):
+            break
+    return date_formats
+
+
+def iter_partials(
+    path: str, chunksize: int, date_formats: Optional[Dict[str, str]] = None, year: Optional[int] = None
+) -> Iterable[dict]:
+    """Read path in chunks of chunksize rows and yield partial_counts per chunk (rows of year only, if given).
+    Date formats not given explicitly are pinned from the first chunk that has a value, as a whole-file
+    read would infer them."""
+    date_formats = dict(date_formats or {})
+    columns_present = raw_columns(path) + ["event_date", "year", "quarter"]
+    chunks = read_raw(path, chunksize=chunksize)
+    while True:
+        with stage("read_csv") as rec:
+            raw = next(chunks, None)
+            rec["rows_out"] = 0 if raw is None else len(raw)
+        if raw is None:
+            return
+        date_formats = pin_date_formats(raw, date_formats)
+        df = _parse_year(raw, date_formats, year)
+        yield partial_counts(raw, df, date_formats, columns_present, year)
+
+
+def stream_partials(
+    path: str, chunksize: int, date_formats: Optional[Dict[str, str]] = None, year: Optional[int] = None
+) -> dict:
+    """Merged partial_counts of path, read chunk by chunk; memory is bounded by chunksize, not by the
+    file's row count."""
+    acc = None
+    for i, parts in enumerate(iter_partials(path, chunksize, date_formats, year), start=1):
+        acc = merge_partials(acc, parts)
+        print(f"  {os.path.basename(path)} chunk {i}: {acc['total_rows_raw']:,} rows read")
+    if acc is None:
+        raise ValueError(f"{path} has no rows")
+    return acc
+
+
+def select_specs(tables: Optional[Iterable[str]] = None) -> List[AggSpec]:
+    """The AGG_SPECS named in tables, in AGG_SPECS order (all of them for None). DAILY_TABLE is accepted too
+    (the time-series outputs, which have no spec)."""
+    if tables is None:
+        return list(AGG_SPECS)
+    names = {spec.name for spec in AGG_SPECS} | {DAILY_TABLE}
+    unknown = sorted(set(tables) - names)
+    if unknown:
+        raise ValueError(f"unknown table(s) {', '.join(unknown)}; expected one of {', '.join(sorted(names))}")
+    return [spec for spec in AGG_SPECS if spec.name in tables]
+
+
+def plot_cube(path: str, tables: Optional[List[str]] = None, jobs: Optional[int] = None) -> Tuple[int, int]:
+    """Render the figures of every year in a cube saved by finish_partials (cache/cube_<years>.pkl), without
+    reading the raw files; tables restricts them to those tables. Figures unchanged since their last
+    render are skipped. Returns (rendered, total)."""
+    cube = load_cube(path)
+    years = sorted(int(y) for y in cube.index.get_level_values("year").dropna().unique())
+    figure_jobs = []
+    for spec in select_specs(tables):
+        if spec.plot is None:
+            continue
+        counts = cube_table(cube, spec)
+        for year in years:
+            out = finish_year(spec, counts, year)
+            if out is not None:
+                figure_jobs.append(FigureJob(spec.plot, out, year, os.path.join(FIG_DIR, f"{spec.figure}_{year}.png")))
+    return render_figures(figure_jobs, jobs), len(figure_jobs)
+
+
+def run_streaming(
+    path: str, chunksize: int, date_formats: Optional[Dict[str, str]] = None, figures: bool = True
+) -> dict:
+    """Aggregate path chunk by chunk and write every output."""
+    acc = stream_partials(path, chunksize, date_formats, file_year(path))
+    acc["raw_files"] = [os.path.basename(path)]
+    finish_partials(acc, figures)
+    return acc
+
+
+# ---------------------- Multi-file runner ----------------------
+# Each raw file is parsed and counted in its own worker process; the workers return additive partial
+# counts (small, keyed by year), which the parent merges and finishes into per-year outputs.
+
+_FILE_YEAR_RE = re.compile(r"(?<!\d)(\d{4})(?!\d)")
+
+
+def file_year(path: str) -> Optional[int]:
+    """Year whose rows are kept from path: YEAR_FILTER when set, else the last 4-digit number in the file
+    name (BE years converted), else None (keep every year)."""
+    if YEAR_FILTER is not None:
+        return YEAR_FILTER
+    found = _FILE_YEAR_RE.findall(os.path.basename(path))
+    if not found:
+        return None
+    year = int(found[-1])
+    return year - BE_OFFSET if year > BE_YEAR_MIN else year
+
+
+def raw_paths(patterns: Iterable[str]) -> List[str]:
+    """Files matching patterns (globs or plain paths) in pattern order, each once; a pattern that matches
+    nothing is kept as given."""
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) or [pattern]
+        paths += [p for p in matches if p not in paths]
+    return paths
+
+
+def file_partials(
+    path: str,
+    chunksize: Optional[int] = None,
+    date_formats: Optional[Dict[str, str]] = None,
+    use_cache: bool = False,
+    incremental: bool = False,
+) -> dict:
+    """partial_counts of one whole raw file, restricted to its file_year, with the stage records of the
+    work under "profile". Runs in a worker process."""
+    year = file_year(path)
+    with collect_stages() as records:
+        if incremental:
+            parts = incremental_partials(path, date_formats)
+        elif chunksize:
+            parts = stream_partials(path, chunksize, date_formats, year)
+        else:
+            if use_cache:
+                with stage("load_cache") as rec:
+                    raw, df, columns_present = load_cached(path, date_formats)
+                    rec["rows_out"] = len(raw)
+                if year is not None:
+                    df = df.loc[df["year"] == year]
+            else:
+                with stage("read_csv") as rec:
+                    raw = read_raw(path)
+                    rec["rows_out"] = len(raw)
+                df = _parse_year(raw, date_formats, year)
+                columns_present = raw_columns(path) + ["event_date", "year", "quarter"]
+            parts = partial_counts(raw, df, columns_present=columns_present, year=year)
+    parts["profile"] = records
+    parts["raw_files"] = [os.path.basename(path)]
+    shown = "all years" if year is None else f"year {year}"
+    print(f"  {os.path.basename(path)}: {parts['total_rows_raw']:,} rows, {parts['rows_parsed']:,} in {shown}")
+    return parts
+
+
+def range_partials(
+    path: str, start: int, end: int, date_formats: Optional[Dict[str, str]] = None, year: Optional[int] = None
+) -> dict:
+    """partial_counts of the records in bytes [start, end) of path (see raw_byte_ranges), restricted to
+    year, with the stage records of the work under "profile". Runs in a worker process."""
+    columns = raw_columns(path)
+    with collect_stages() as records:
+        with stage("read_csv") as rec:
+            raw = read_raw_range(path, start, end, columns)
+            rec["rows_out"] = len(raw)
+        df = _parse_year(raw, date_formats, year)
+        parts = partial_counts(raw, df, date_formats, columns + ["event_date", "year", "quarter"], year)
+    parts["profile"] = records
+    return parts
+
+
+def _file_tasks(path: str, splits: int, options: tuple) -> List[tuple]:
+    """Work items (function, arguments) for one raw file: the whole file, or up to splits byte ranges
+    when whole-file reads were asked for and the file is large enough. The date formats of the ranges
+    are pinned from the first value of each date column in the file, as a whole-file read infers them."""
+    chunksize, date_formats, use_cache, incremental = options
+    splits = min(splits, os.path.getsize(path) // MIN_RANGE_BYTES)
+    if splits <= 1 or chunksize or use_cache or incremental:
+        return [(file_partials, (path,) + options)]
+    with stage("pin_date_formats"):
+        date_formats = pin_file_date_formats(path, date_formats or {})
+    year = file_year(path)
+    return [(range_partials, (path, start, end, date_formats, year)) for start, end in raw_byte_ranges(path, splits)]
+
+
+def run_files(
+    paths: List[str],
+    jobs: Optional[int] = None,
+    chunksize: Optional[int] = None,
+    date_formats: Optional[Dict[str, str]] = None,
+    use_cache: bool = False,
+    incremental: bool = False,
+    figures: bool = True,
+    tables: Optional[List[str]] = None,
+) -> dict:
+    """Aggregate every raw file in paths, up to jobs files at a time in separate processes (default:
+    one per CPU), merge their counts and write the per-year outputs (see finish_partials). With more
+    processes than files, each large file is split into byte ranges counted in parallel (range_partials)."""
+    workers = jobs or os.cpu_count() or 1
+    options = (chunksize, date_formats, use_cache, incremental)
+    tasks = [(path, task) for path in paths for task in _file_tasks(path, workers // len(paths), options)]
+    workers = min(workers, len(tasks))
+    by_file = {}
+    if workers <= 1:
+        for path, (func, args) in tasks:
+            by_file[path] = merge_partials(by_file.get(path), func(*args))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [(path, pool.submit(func, *args)) for path, (func, args) in tasks]
+            for path, future in futures:
+                by_file[path] = merge_partials(by_file.get(path), future.result())
+    acc = None
+    for path in paths:
+        ranges = sum(task_path == path for task_path, _ in tasks)
+        if ranges > 1:
+            by_file[path]["raw_files"] = [os.path.basename(path)]
+            year = file_year(path)
+            print(f"  {os.path.basename(path)}: {by_file[path]['total_rows_raw']:,} rows, "
+                  f"{by_file[path]['rows_parsed']:,} in {'all years' if year is None else f'year {year}'} "
+                  f"({ranges} byte ranges)")
+        acc = merge_partials(acc, by_file[path])
+    finish_partials(acc, figures, jobs, tables)
+    return acc
+
+
+def parse_files(
+    paths: List[str], date_formats: Optional[Dict[str, str]] = None, use_cache: bool = False
+) -> List[dict]:
+    """Read and parse every raw file in paths without counting anything, refreshing its Parquet cache
+    with use_cache. Returns per file: rows, rows with a parsed event date (all years and its file_year)
+    and the date formats used."""
+    summaries = []
+    for path in paths:
+        year = file_year(path)
+        with stage(f"parse:{os.path.basename(path)}") as rec:
+            if use_cache:
+                raw, df, _ = load_cached(path, date_formats)
+                formats = date_formats or {}
+            else:
+                raw = read_raw(path)
+                formats = pin_date_formats(raw, date_formats or {})
+                df = parse_dates(raw, formats)
+            rec["rows_in"], rec["rows_out"] = len(raw), len(df)
+        summary = {
+            "raw_file": os.path.basename(path),
+            "rows": len(raw),
+            "rows_parsed": len(df),
+            "year": year,
+            "rows_in_year": len(df) if year is None else int((df["year"] == year).sum()),
+            "date_formats": formats,
+        }
+        print(
+            f"  {summary['raw_file']}: {summary['rows']:,} rows, {summary['rows_parsed']:,} with an event date, "
+            f"{summary['rows_in_year']:,} in {'all years' if year is None else f'year {year}'}"
+        )
+        summaries.append(summary)
+    return summaries
+
+
+# ---------------------- Cache ----------------------
+# The parsed, normalized raw file is cached as Parquet next to a JSON manifest. The cache is reused while
+# the raw file (size + mtime, or sha256 when those changed) and the parsing/normalization code are unchanged.
+
+# key name -> cache column holding that key precomputed for every row (see count_tables)
+CACHED_KEYS = {"sex": "norm_sex", "vehicle_type": "norm_vehicle_type", "age_group": "norm_age_group"}
+
+
+def _cache_paths(raw_path: str) -> Tuple[str, str]:
+    stem = os.path.splitext(os.path.basename(raw_path))[0]
+    return os.path.join(CACHE_DIR, f"{stem}.parquet"), os.path.join(CACHE_DIR, f"{stem}.json")
+
+
+def _file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _code_version() -> str:
+    """Fingerprint of the code that shapes cached values; editing any of it invalidates old caches."""
+    funcs = [_to_datetime, fix_buddhist_years, to_datetime_be, parse_dates, normalize_values, strip_values, code_text,
+             normalize_sex, icd_vehicle_map, _v_code_labels, classify_icd_vehicle, _find_icd_col, build_cache, read_raw,
+             _compact_raw, compact_age, qa_flags, name_key, load_gazetteer, province_codes, canonical_provinces,
+             canonical_districts]
+    funcs += [DERIVED_KEYS[key] for key in CACHED_KEYS]
+    h = hashlib.sha256(f"{BE_OFFSET} {BE_YEAR_MIN} {pd.__version__} {RAW_SCHEMA} {SEX_CODES} {QA_CHECKS} {QA_AGE_MAX}".encode())
+    h.update(_file_sha256(GAZETTEER_FILE).encode())
+    for fn in funcs:
+        h.update(inspect.getsource(fn).encode())
+    return h.hexdigest()
+
+
+def build_cache(raw: pd.DataFrame, date_formats: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+    """Every raw row with parse_dates' event_date/year/quarter (missing where undated), the CACHED_KEYS
+    columns and qa_flags. Undated rows are kept so raw-level QA counts can come from the cache too."""
+    parsed = parse_dates(raw, date_formats)
+    cache = raw.join(parsed[["event_date", "year", "quarter"]])
+    for key, col in CACHED_KEYS.items():
+        values = DERIVED_KEYS[key](raw, date_formats or {})
+        if values is not None:
+            cache[col] = values.astype("category")
+    cache["qa_flags"] = qa_flags(raw, date_formats)[0]
+    return cache
+
+
+def _cache_columns(names: List[str]) -> List[str]:
+    """Columns build_cube and the QA step read, given the cache's column names."""
+    probe = pd.DataFrame(columns=names)
+    wanted = ["event_date", "year", "quarter", "prov", "atime", "Head_Injury", "qa_flags", *CACHED_KEYS.values()]
+    wanted += [_find_prov_col(probe), _find_district_col(probe)]
+    if CACHED_KEYS["sex"] not in names:
+        wanted.append("sex")
+    if CACHED_KEYS["vehicle_type"] not in names:
+        wanted.append(_find_icd_col(probe))
+    if CACHED_KEYS["age_group"] not in names:
+        wanted.append("age")
+    return [c for c in names if c in wanted]
+
+
+def load_cached(raw_path: str, date_formats: Optional[Dict[str, str]] = None) -> Tuple[pd.DataFrame, pd.DataFrame, List[str]]:
+    """(raw rows, parsed rows, parsed columns) for raw_path, from the cache when it is current or else by
+    parsing raw_path and writing the cache. Only the columns the aggregations need are loaded."""
+    if importlib.util.find_spec("pyarrow") is None:
+        raise RuntimeError("the Parquet cache needs pyarrow (pip install pyarrow)")
+    data_path, manifest_path = _cache_paths(raw_path)
+    stat = os.stat(raw_path)
+    key = {
+        "size": stat.st_size,
+        "code_version": _code_version(),
+        "date_formats": date_formats or {},
+    }
+
+    manifest = None
+    if os.path.exists(manifest_path) and os.path.exists(data_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        if any(manifest.get(k) != v for k, v in key.items()):
+            manifest = None
+        elif manifest.get("mtime_ns") != stat.st_mtime_ns:
+            # touched or copied: still valid if the content is the same
+            if manifest.get("sha256") == _file_sha256(raw_path):
+                manifest["mtime_ns"] = stat.st_mtime_ns
+                atomic_write(manifest_path, json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8"))
+            else:
+                manifest = None
+
+    if manifest is None:
+        print(f"Building cache {data_path}...")
+        raw = read_raw(raw_path)
+        cache = build_cache(raw, date_formats)
+        # both files replaced atomically, the manifest last: a crash leaves no truncated Parquet behind, and
+        # whatever made this run rebuild also fails the old manifest, if any, so the next run builds it again
+        buffer = io.BytesIO()
+        cache.to_parquet(buffer, index=False)
+        atomic_write(data_path, buffer.getvalue())
+        manifest = dict(
+            key,
+            raw_file=os.path.abspath(raw_path),
+            mtime_ns=stat.st_mtime_ns,
+            sha256=_file_sha256(raw_path),
+            columns_present=raw_columns(raw_path) + ["event_date", "year", "quarter"],
+        )
+        atomic_write(manifest_path, json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8"))
+    else:
+        print(f"Loading cache {data_path}...")
+
+    import pyarrow.parquet as pq
+    columns = _cache_columns(pq.read_schema(data_path).names)
+    cache = pd.read_parquet(data_path, columns=columns)
+    df = cache.loc[cache["event_date"].notna()].copy()
+    # back to parse_dates' int32 year (undated rows made it float in the cache)
+    df["year"] = df["year"].astype("int32")
+    return cache, df, manifest["columns_present"]
+
+
+# ---------------------- Incremental ----------------------
+# For each raw file the merged partial counts ingested so far are pickled under STATE_DIR next to a JSON
+# watermark: the byte offset and row count ingested, checksums of the first and last block before that
+# offset, and the date formats pinned on the first ingest. Appended rows are read with the file's header
+# and RAW_SCHEMA, so they derive the same keys as a whole-file read. A refresh parses only the rows appended after
+# the offset; a file that was rewritten rather than appended to, or a change in the counting code, makes
+# that file's state start over. Both files are replaced atomically, the watermark last with the sha256 of
+# the counts, so an interrupted run or a concurrent one (the CLI while serve_aggregates.py reloads) leaves
+# a mismatch that restarts the state rather than counting rows twice.
+
+WATERMARK_BLOCK = 1 << 16  # bytes checksummed at each end of the ingested region
+
+
+def _state_paths(raw_path: str) -> Tuple[str, str]:
+    stem = os.path.splitext(os.path.basename(raw_path))[0]
+    return os.path.join(STATE_DIR, f"{stem}.pkl"), os.path.join(STATE_DIR, f"{stem}.json")
+
+
+def _watermark_checksums(path: str, offset: int) -> Tuple[str, str]:
+    """sha256 of the first and of the last WATERMARK_BLOCK bytes before offset."""
+    with open(path, "rb") as f:
+        head = f.read(min(offset, WATERMARK_BLOCK))
+        f.seek(max(0, offset - WATERMARK_BLOCK))
+        tail = f.read(min(offset, WATERMARK_BLOCK))
+    return hashlib.sha256(head).hexdigest(), hashlib.sha256(tail).hexdigest()
+
+
+def _state_version() -> str:
+    """Fingerprint of the code that shapes the stored counts; editing any of it restarts every state."""
+    funcs = [build_cube, _count_codes, partial_counts, merge_partials, _count_qa_coverage, count_qa_checks,
+             qa_rows_by_prov, count_daily, *DERIVED_KEYS.values()]
+    h = hashlib.sha256(_code_version().encode())
+    h.update(repr([(spec.name, spec.keys, spec.subset, spec.observed) for spec in AGG_SPECS]).encode())
+    for fn in funcs:
+        h.update(inspect.getsource(fn).encode())
+    return h.hexdigest()
+
+
+def incremental_partials(path: str, date_formats: Optional[Dict[str, str]] = None) -> dict:
+    """partial_counts of path, restricted to its file_year, updated from the state under STATE_DIR by
+    parsing only the rows appended since the last run. The state covers rows up to the last complete line;
+    a final row with no newline yet is counted in the result but left out of the state, and read again
+    next run."""
+    year = file_year(path)
+    data_path, manifest_path = _state_paths(path)
+    key = {"state_version": _state_version(), "date_formats": date_formats or {}, "year": year}
+    size = os.path.getsize(path)
+
+    manifest = acc = None
+    if os.path.exists(manifest_path) and os.path.exists(data_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        with open(data_path, "rb") as f:
+            blob = f.read()
+        if any(manifest.get(k) != v for k, v in key.items()):
+            manifest = None
+        elif manifest.get("data_sha256") != hashlib.sha256(blob).hexdigest():
+            print(f"  state of {os.path.basename(path)} does not match its watermark; ingesting it again")
+            manifest = None
+        elif manifest["offset"] > size or list(_watermark_checksums(path, manifest["offset"])) != manifest["checksums"]:
+            print(f"  {os.path.basename(path)} was rewritten, not appended to; ingesting it again")
+            manifest = None
+        else:
+            acc = pd.read_pickle(io.BytesIO(blob))
+
+    start = 0 if manifest is None else manifest["offset"]
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read()
+    cut = data.rfind(b"\n") + 1
+    data, tail = data[:cut], data[cut:]
+    if manifest is None and not data:
+        tail = b""  # no complete line yet: the tail is (part of) the header
+
+    columns = raw_columns(path)
+    with stage("read_csv") as rec:
+        if manifest is None:
+            raw = read_raw(io.BytesIO(data), columns, skiprows=1)
+            pinned, rows = dict(date_formats or {}), 0
+        else:
+            pinned, rows = manifest["pinned_formats"], manifest["rows"]
+            raw = read_raw(io.BytesIO(data), columns) if data else None
+        tail_raw = read_raw(io.BytesIO(tail), columns) if tail.strip() else None
+        rec["rows_out"] = sum(len(r) for r in (raw, tail_raw) if r is not None)
+
+    if raw is not None and len(raw):
+        pinned = pin_date_formats(raw, pinned)
+        df = _parse_year(raw, pinned, year)
+        acc = merge_partials(acc, partial_counts(raw, df, pinned, columns + ["event_date", "year", "quarter"], year))
+        rows += len(raw)
+    print(f"  {os.path.basename(path)}: {len(raw) if raw is not None else 0:,} new rows after {start:,} bytes")
+
+    offset = start + len(data)
+    if acc is not None and (manifest is None or offset != start):
+        # the counts first, then the watermark naming their digest: a run that stops in between leaves a
+        # watermark that no longer matches the counts, which the next run ingests again instead of adding to
+        blob = io.BytesIO()
+        pd.to_pickle(acc, blob)
+        atomic_write(data_path, blob.getvalue())
+        manifest = dict(
+            key,
+            raw_file=os.path.abspath(path),
+            offset=offset,
+            rows=rows,
+            checksums=list(_watermark_checksums(path, offset)),
+            pinned_formats=pinned,
+            data_sha256=hashlib.sha256(blob.getvalue()).hexdigest(),
+        )
+        atomic_write(manifest_path, json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8"))
+
+    if tail_raw is not None and len(tail_raw):
+        print(f"  {os.path.basename(path)}: last row has no newline yet; counted now, kept out of the state")
+        pinned = pin_date_formats(tail_raw, pinned)
+        df = _parse_year(tail_raw, pinned, year)
+        columns_present = columns + ["event_date", "year", "quarter"]
+        acc = merge_partials(acc, partial_counts(tail_raw, df, pinned, columns_present, year))
+    if acc is None:
+        raise ValueError(f"{path} has no rows")
+    return acc
+
+
+# ---------------------- SQL backend ----------------------
+# For extracts that do not fit in memory even streamed through pandas, --backend sqlite loads the raw files
+# chunk by chunk into an on-disk SQLite database and builds the count cube with one GROUP BY query. Table
+# events holds one row per parsed event with its derived keys and its day (days since SQL_EPOCH), text keys
+# dictionary-encoded as integers
+# (table dictionary); table raw_counts holds raw rows per file and province for the QA totals. events has
+# no indexes: the one GROUP BY scans the whole table, so they would only cost load time. The grouped rows go
+# through the same _count_codes as build_cube, so finish_partials writes the same CSVs as the pandas path.
+
+SQL_DB = os.path.join(CACHE_DIR, "is.sqlite")
+SQL_CHUNKSIZE = 200_000  # rows read, parsed and inserted at a time unless --chunksize is given
+SQL_EPOCH = pd.Timestamp("1970-01-01")
+
+
+def _sql_encode(values: pd.Series, dictionary: Dict[object, int]) -> pd.Series:
+    """values as codes into dictionary, which grows by the values it has not seen; missing values as NULL."""
+    codes, uniques = pd.factorize(values)
+    lookup = np.array([dictionary.setdefault(value, len(dictionary)) for value in uniques] + [-1], dtype=np.int64)
+    encoded = lookup[codes]
+    return pd.Series(encoded, index=values.index, dtype="Int64").mask(encoded < 0)
+
+
+def _sql_decode(codes: pd.Series, dictionary: Dict[object, int]) -> pd.Series:
+    values = np.array(list(dictionary) + [np.nan], dtype=object)
+    return pd.Series(values[codes.fillna(-1).astype(np.int64).to_numpy()], index=codes.index, name=codes.name)
+
+
+def sql_load(
+    con: sqlite3.Connection,
+    paths: List[str],
+    chunksize: Optional[int] = None,
+    date_formats: Optional[Dict[str, str]] = None,
+) -> dict:
+    """Insert the parsed rows of each raw file (rows of its file_year only) into events and its raw row
+    counts into raw_counts, chunksize rows at a time. Returns what sql_cube needs to rebuild build_cube's
+    output: the dtype each key was derived with, the dictionaries of the encoded keys and, per file, its
+    columns and the keys it could not derive; plus the count_qa_checks of every raw row."""
+    keys = list(CUBE_DIMS)
+    con.execute("PRAGMA journal_mode = OFF")  # the database is rebuilt from the raw files on every run
+    con.execute("PRAGMA synchronous = OFF")
+    con.execute(f"CREATE TABLE events (file, {', '.join(keys)}, bkk, day)")
+    con.execute("CREATE TABLE raw_counts (file, file_year, prov, n)")
+    dtypes: Dict[str, object] = {}
+    dictionaries: Dict[str, Dict[object, int]] = {}
+    files = []
+    qa_checks = None
+    for file_id, path in enumerate(paths):
+        year = file_year(path)
+        pinned = dict(date_formats or {})
+        missing = set()
+        rows = parsed = 0
+        chunks = read_raw(path, chunksize=chunksize or SQL_CHUNKSIZE)
+        while True:
+            with stage("read_csv") as rec:
+                raw = next(chunks, None)
+                rec["rows_out"] = 0 if raw is None else len(raw)
+            if raw is None:
+                break
+            pinned = pin_date_formats(raw, pinned)
+            df = _parse_year(raw, pinned, year)
+            with stage("count:qa_checks", rows_in=len(raw)):
+                qa_checks = add_counts(qa_checks, count_qa_checks(raw, pinned))
+            with stage("sql:insert", rows_in=len(raw)) as rec:
+                prov_col = _find_prov_col(raw)
+                if prov_col is not None:
+                    counts = raw.groupby(prov_col, dropna=False, observed=True).size()
+                else:
+                    counts = pd.Series([len(raw)], index=[np.nan])
+                pd.DataFrame({
+                    "file": file_id,
+                    "file_year": year,
+                    "prov": _sql_encode(counts.index.to_series(), dictionaries.setdefault("prov", {})).to_numpy(),
+                    "n": counts.to_numpy(),
+                }).to_sql("raw_counts", con, if_exists="append", index=False)
+                events = pd.DataFrame({"file": file_id}, index=df.index)
+                for key in keys:
+                    values = DERIVED_KEYS[key](df, pinned)
+                    if values is None:
+                        missing.add(key)
+                        continue
+                    # a key whose dtype differs between chunks (e.g. categories) is read back as plain values
+                    dtypes[key] = values.dtype if dtypes.get(key, values.dtype) == values.dtype else np.dtype(object)
+                    if pd.api.types.is_numeric_dtype(values.dtype):
+                        events[key] = values
+                    else:
+                        events[key] = _sql_encode(values, dictionaries.setdefault(key, {}))
+                events["bkk"] = bkk_rows(df["prov"]) if "prov" in df.columns else False
+                events["day"] = (df["event_date"].dt.normalize() - SQL_EPOCH).dt.days
+                events.to_sql("events", con, if_exists="append", index=False)
+                rec["rows_out"] = len(events)
+            rows += len(raw)
+            parsed += len(df)
+        files.append({"columns": raw_columns(path) + ["event_date", "year", "quarter"], "missing": missing})
+        shown = "all years" if year is None else f"year {year}"
+        print(f"  {os.path.basename(path)}: {rows:,} rows, {parsed:,} in {shown}")
+    with stage("sql:dictionary"):
+        # the dictionaries too, so the database can be queried on its own
+        con.execute("CREATE TABLE dictionary (key, code, value)")
+        con.executemany("INSERT INTO dictionary VALUES (?, ?, ?)", [
+            (key, code, str(value)) for key, dictionary in dictionaries.items() for value, code in dictionary.items()
+        ])
+        con.commit()
+    return {"dtypes": dtypes, "dictionaries": dictionaries, "files": files, "qa_checks": qa_checks}
+
+
+def _sql_values(values: pd.Series, key: str, meta: dict) -> pd.Series:
+    """Key column read back from the database, decoded and in the dtype it was derived with (where its
+    NULLs allow it)."""
+    if key in meta["dictionaries"]:
+        values = _sql_decode(values, meta["dictionaries"][key])
+    dtype = meta["dtypes"].get(key)
+    if dtype is None or dtype == object:
+        return values
+    if isinstance(dtype, pd.CategoricalDtype):
+        return values.astype(dtype)
+    return values if values.isna().any() else values.astype(dtype)
+
+
+def sql_cube(con: sqlite3.Connection, meta: dict) -> pd.Series:
+    """build_cube's cube of every loaded row, from one GROUP BY over events. Like merge_cubes, it leaves out
+    the dimensions some file could not derive."""
+    dims = [dim for dim in CUBE_DIMS if not any(dim in f["missing"] for f in meta["files"])]
+    with stage("query:cube") as rec:
+        grouped = pd.read_sql_query(
+            f"SELECT {', '.join(dims)}, COUNT(*) AS n FROM events GROUP BY {', '.join(dims)}", con
+        )
+        columns = [_codes(_sql_values(grouped[dim], dim, meta)) for dim in dims]
+        cube = _count_codes(columns, tuple(dims), True, grouped["n"].to_numpy())
+        rec["rows_out"] = len(cube)
+    return cube
+
+
+def sql_daily(con: sqlite3.Connection, meta: dict) -> pd.Series:
+    """count_daily's counts of every loaded row, from one GROUP BY over events (prov is NULL for the rows
+    of a file without a province column)."""
+    with stage("query:daily") as rec:
+        grouped = pd.read_sql_query("SELECT prov, day, COUNT(*) AS n FROM events GROUP BY prov, day", con)
+        day = SQL_EPOCH + pd.to_timedelta(grouped["day"], unit="D")
+        columns = [_codes(_sql_values(grouped["prov"], "prov", meta).astype(object)), _codes(day)]
+        counts = _count_codes(columns, ("prov", "day"), True, grouped["n"].to_numpy())
+        rec["rows_out"] = len(counts)
+    return counts
+
+
+def _sql_qa(con: sqlite3.Connection, meta: dict) -> dict:
+    """The QA entries of partial_counts, queried from the database."""
+    year_counts = pd.read_sql_query("SELECT year, COUNT(*) AS n FROM events GROUP BY year", con)
+    raw = pd.read_sql_query(
+        "SELECT prov, file_year AS year, SUM(n) AS n FROM raw_counts GROUP BY prov, file_year", con
+    )
+    parsed = pd.read_sql_query("SELECT file, prov, year, COUNT(*) AS n FROM events GROUP BY file, prov, year", con)
+    # like _count_qa_coverage's groupby (observed=False) on the categorical prov, every province of a file gets a row for
+    # every year parsed from that file, with zero rows where it has none
+    grid = pd.read_sql_query("SELECT DISTINCT file, prov FROM raw_counts WHERE prov IS NOT NULL", con).merge(
+        pd.read_sql_query("SELECT DISTINCT file, year FROM events", con), on="file"
+    )
+    parsed = pd.concat([grid.assign(n=0), parsed])
+    raw["prov"], parsed["prov"] = _sql_values(raw["prov"], "prov", meta), _sql_values(parsed["prov"], "prov", meta)
+    parsed = parsed.groupby(["prov", "year"], dropna=False, observed=True)["n"].sum().reset_index()
+    coverage = pd.concat([raw.assign(kind="raw"), parsed.assign(kind="parsed")], ignore_index=True)
+    return {
+        "qa_coverage": coverage.set_index(["kind", "prov", "year"])["n"],
+        "qa_year_counts": year_counts.set_index("year")["n"],
+        "total_rows_raw": int(con.execute("SELECT COALESCE(SUM(n), 0) FROM raw_counts").fetchone()[0]),
+        "rows_parsed": con.execute("SELECT COUNT(*) FROM events").fetchone()[0],
+    }
+
+
+def sql_partials(
+    paths: List[str],
+    chunksize: Optional[int] = None,
+    date_formats: Optional[Dict[str, str]] = None,
+    db_path: Optional[str] = None,
+) -> dict:
+    """Merged partial_counts of paths, computed in a fresh SQLite database at db_path (default SQL_DB)
+    instead of in memory."""
+    db_path = db_path or SQL_DB
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    con = sqlite3.connect(db_path)
+    try:
+        meta = sql_load(con, paths, chunksize, date_formats)
+        parts = {"cube": sql_cube(con, meta), "daily": sql_daily(con, meta), "qa_checks": meta["qa_checks"]}
+        with stage("query:qa"):
+            parts.update(_sql_qa(con, meta))
+    finally:
+        con.close()
+    parts["columns_present"] = meta["files"][0]["columns"]
+    parts["raw_files"] = [os.path.basename(path) for path in paths]
+    return parts
+
+
+def run_sql(
+    paths: List[str],
+    chunksize: Optional[int] = None,
+    date_formats: Optional[Dict[str, str]] = None,
+    figures: bool = True,
+    jobs: Optional[int] = None,
+    tables: Optional[List[str]] = None,
+) -> dict:
+    """Aggregate every raw file in paths through the SQLite backend and write the outputs (see finish_partials)."""
+    parts = sql_partials(paths, chunksize, date_formats)
+    finish_partials(parts, figures, jobs, tables)
+    return parts
+
+
+# ---------------------- Main ----------------------
+# One subcommand per job. The command may be left out, in which case the arguments are those of
+# "aggregate" (aggregate_from_raw.py is2018.csv --jobs 4). Nothing is imported or created beyond
+# what the command needs: matplotlib only when figures are rendered, directories only when written.
+
+COMMANDS = ["aggregate", "qa", "parse", "plot", "tables"]
+
+
+def _input_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "raw_files", nargs="*", default=[RAW_FILE],
+        help=f"raw IS CSVs or glob patterns, one file per year, e.g. 'is20*.csv' (default: {RAW_FILE})",
+    )
+    parser.add_argument(
+        "--date-format", default=DATE_FORMAT,
+        help='strftime format of adate/hdate, e.g. "%%d/%%m/%%Y" (default: inferred from the first value)',
+    )
+    parser.add_argument(
+        "--cache", action="store_true",
+        help=f"reuse the parsed raw files cached as Parquet under {CACHE_DIR}/ (needs pyarrow; not with --chunksize)",
+    )
+
+
+def _run_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--jobs", type=int, default=None,
+        help="raw files processed, and figures rendered, in parallel processes; with more processes than files, "
+             "large files are split into byte ranges processed in parallel (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--chunksize", type=int, default=CHUNKSIZE,
+        help="stream each raw file in chunks of this many rows to bound memory use",
+    )
+    parser.add_argument(
+        "--incremental", action="store_true",
+        help=f"keep counts and a watermark per raw file under {STATE_DIR}/ and only parse rows appended since the last run",
+    )
+    parser.add_argument(
+        "--profile", action="store_true",
+        help="run in one process under cProfile and tracemalloc; dumps outputs/run_profile.prof and adds the "
+             "top allocation sites to outputs/run_profile.json",
+    )
+    parser.add_argument(
+        "--backend", choices=["pandas", "sqlite"], default="pandas",
+        help=f"pandas counts in memory; sqlite loads the raw files into {SQL_DB} and counts with SQL queries, "
+             "for extracts too large for memory (not with --cache or --incremental)",
+    )
+    parser.add_argument(
+        "--format", choices=list(OUTPUT_FORMATS), default="csv",
+        help="file format of the tables: CSV, gzip CSV or Parquet (needs pyarrow)",
+    )
+    parser.add_argument(
+        "--consolidate", action="store_true",
+        help=f"also write all tables of the run into one SQLite file, outputs/{CONSOLIDATED_FILE}",
+    )
+
+
+def _table_arg(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--table", dest="tables", action="append", metavar="NAME", choices=[spec.name for spec in AGG_SPECS] + [DAILY_TABLE],
+        help="only this table and its figure; repeat for several (names: see the tables command)",
+    )
+
+
+def _suppress_arg(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--suppress-below", type=int, default=SUPPRESS_BELOW, metavar="N",
+        help="hide table cells with fewer than N cases, plus the cells that would give them away through "
+             f"totals (default: {SUPPRESS_BELOW}, nothing hidden)",
+    )
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Build aggregate CSVs and figures from raw IS files.",
+        epilog="Without a command the arguments are those of aggregate, e.g. aggregate_from_raw.py is2018.csv.",
+    )
+    commands = parser.add_subparsers(dest="command", metavar="command")
+
+    aggregate = commands.add_parser(
+        "aggregate", help="write the tables, figures and QA files (the default)",
+        description="Write the tables, figures and QA files of the raw files.",
+    )
+    _input_args(aggregate)
+    _run_args(aggregate)
+    _table_arg(aggregate)
+    _suppress_arg(aggregate)
+    aggregate.add_argument(
+        "--no-figures", dest="figures", action="store_false",
+        help="write the CSVs only and leave the figures as they are",
+    )
+    aggregate.set_defaults(run=_cmd_aggregate)
+
+    qa = commands.add_parser(
+        "qa", help="write the QA files only",
+        description="Write the QA summary, coverage and check files of the raw files, without tables or figures.",
+    )
+    _input_args(qa)
+    _run_args(qa)
+    qa.set_defaults(run=_cmd_aggregate, figures=False, tables=[], suppress_below=SUPPRESS_BELOW)
+
+    parse = commands.add_parser(
+        "parse", help="read and parse the raw files and report their rows",
+        description="Read and parse the raw files without counting; with --cache this builds or refreshes "
+                    "the Parquet cache for later runs.",
+    )
+    _input_args(parse)
+    parse.set_defaults(run=_cmd_parse)
+
+    plot = commands.add_parser(
+        "plot", help="render the figures from the cube of the last run",
+        description=f"Render the figures from a cube saved by aggregate ({CACHE_DIR}/cube_<years>.pkl) "
+                    "without reading the raw files; unchanged figures are skipped.",
+    )
+    plot.add_argument("--cube", default=None, help=f"cube to plot (default: the newest {CACHE_DIR}/cube_*.pkl)")
+    plot.add_argument("--jobs", type=int, default=None, help="figures rendered in parallel processes (default: number of CPUs)")
+    _table_arg(plot)
+    _suppress_arg(plot)
+    plot.set_defaults(run=_cmd_plot)
+
+    tables = commands.add_parser("tables", help="list the tables", description="List the tables and their keys.")
+    tables.set_defaults(run=_cmd_tables)
+    return parser
+
+
+def _date_formats(args: argparse.Namespace) -> Optional[Dict[str, str]]:
+    return {"adate": args.date_format, "hdate": args.date_format} if args.date_format else None
+
+
+def _cmd_aggregate(args: argparse.Namespace, parser: argparse.ArgumentParser, argv: List[str]) -> None:
+    if args.backend == "sqlite" and (args.cache or args.incremental):
+        parser.error("--backend sqlite reloads every raw file; it cannot be combined with --cache or --incremental")
+    if args.incremental and (args.chunksize or args.cache):
+        parser.error("--incremental reads only new rows; it cannot be combined with --chunksize or --cache")
+    date_formats = _date_formats(args)
+
+    paths = raw_paths(args.raw_files)
+
+    if args.backend == "sqlite":
+        print(f"Loading {len(paths)} raw file(s) into {SQL_DB}...")
+    elif args.chunksize:
+        print(f"Streaming raw data in chunks of {args.chunksize:,} rows...")
+    elif args.incremental:
+        print(f"Ingesting new rows of {len(paths)} raw file(s)...")
+    else:
+        print(f"Loading and parsing {len(paths)} raw file(s)...")
+    if args.profile:
+        # everything in this process, so cProfile and tracemalloc see all of it
+        args.jobs = 1
+        tracemalloc.start()
+        profiler = cProfile.Profile()
+        profiler.enable()
+    with collect_stages() as records, output_writer(args.format, args.consolidate) as writer:
+        with suppression(args.suppress_below), stage("total") as rec:
+            if args.backend == "sqlite":
+                parts = run_sql(paths, args.chunksize, date_formats, args.figures, args.jobs, args.tables)
+            else:
+                parts = run_files(
+                    paths, args.jobs, args.chunksize, date_formats, args.cache, args.incremental, args.figures,
+                    args.tables,
+                )
+            rec["rows_in"], rec["rows_out"] = parts["total_rows_raw"], parts["rows_parsed"]
+    print(f"Rows: {parts['total_rows_raw']:,}")
+    print(f"Rows with valid event_date in the selected years: {parts['rows_parsed']:,}")
+    print(f"Output files: {writer.written} written, {writer.unchanged} unchanged")
+
+    info = {
+        "argv": argv,
+        "raw_files": parts["raw_files"],
+        "jobs": args.jobs or os.cpu_count(),
+    }
+    if args.profile:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        info["tracemalloc_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+        tracemalloc.stop()
+        info["cprofile"] = os.path.join(OUT_DIR, "run_profile.prof")
+        profiler.dump_stats(info["cprofile"])
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(15)
+        info["tracemalloc_top"] = [
+            {"where": str(stat.traceback[0]), "size_mb": round(stat.size / 2**20, 2), "blocks": stat.count}
+            for stat in snapshot.statistics("lineno")[:20]
+        ]
+    print(f"Run profile: {write_run_profile(parts.get('profile', []) + records, info)}")
+    if args.figures:
+        print(f"Done. CSVs in '{OUT_DIR}', figures in '{FIG_DIR}'.")
+    else:
+        print(f"Done. CSVs in '{OUT_DIR}'.")
+
+
+def _cmd_parse(args: argparse.Namespace, parser: argparse.ArgumentParser, argv: List[str]) -> None:
+    paths = raw_paths(args.raw_files)
+    print(f"Parsing {len(paths)} raw file(s)...")
+    parse_files(paths, _date_formats(args), args.cache)
+
+
+def _cmd_plot(args: argparse.Namespace, parser: argparse.ArgumentParser, argv: List[str]) -> None:
+    path = args.cube
+    if path is None:
+        cubes = glob.glob(os.path.join(CACHE_DIR, "cube_*.pkl"))
+        if not cubes:
+            parser.error(f"no cube under {CACHE_DIR}/; run aggregate first or pass --cube")
+        path = max(cubes, key=os.path.getmtime)
+    with suppression(args.suppress_below):
+        rendered, total = plot_cube(path, args.tables, args.jobs)
+    print(f"Figures from {path}: {rendered} rendered, {total - rendered} unchanged, in '{FIG_DIR}'.")
+
+
+def _cmd_tables(args: argparse.Namespace, parser: argparse.ArgumentParser, argv: List[str]) -> None:
+    for spec in AGG_SPECS:
+        figure = f", figure {spec.figure}" if spec.figure else ""
+        subset = " (Bangkok)" if spec.subset == "bkk" else ""
+        print(f"{spec.name:<32} by {', '.join(('year',) + spec.keys)}{subset}{figure}")
+    print(f"{DAILY_TABLE:<32} by prov, day (daily_province, weekly_province, holiday_windows)")
+
 
-    print(f"Done. CSVs in '{OUT_DIR}', figures in '{FIG_DIR}'.")
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    parser = build_parser()
+    command = argv
+    if not argv or argv[0] not in COMMANDS + ["-h", "--help"]:
+        command = ["aggregate"] + argv
+    args = parser.parse_args(command)
+    args.run(args, parser, argv)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,111 @@
+"""Check and time the daily province time series (count_daily, daily_matrix and _finish_daily).
+
+Synthetic events for every gazetteer province over --years years (holiday weeks busier, a few injected
+spikes) are counted per province and day. The matrix results are checked against a per-province pandas
+reference: rolling means (groupby + rolling), weekly sums (resample) and the trailing z-scores. Then the
+whole time-series stage is timed, writing its CSVs to a temporary directory. Any mismatch makes the exit
+status 1.
+
+    python benchmarks/bench_daily.py --years 5 --rows 5000000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import aggregate_from_raw as agg  # noqa: E402
+
+
+def synthetic_events(rows: int, years: list, seed: int = 0) -> pd.DataFrame:
+    """rows events with prov (gazetteer names, skewed, some missing) and event_date over years."""
+    rng = np.random.default_rng(seed)
+    gaz = agg.gazetteer()
+    provinces = np.array([name for code, name in sorted(gaz.names.items()) if code < 100], dtype=object)
+    weights = 1 / np.arange(1, len(provinces) + 1) ** 0.8
+    prov = provinces[rng.choice(len(provinces), rows, p=weights / weights.sum())]
+    prov[rng.random(rows) < 0.01] = np.nan
+    days = pd.date_range(f"{min(years)}-01-01", f"{max(years)}-12-31", freq="D")
+    busy = np.where(days.dayofyear.isin(range(100, 108)) | (days.dayofyear <= 4), 2.0, 1.0)
+    day = rng.choice(len(days), rows, p=busy / busy.sum())
+    seconds = rng.integers(0, 86_400, rows)
+    event_date = days[day] + pd.to_timedelta(seconds, unit="s")
+    return pd.DataFrame({"prov": pd.Categorical(prov), "event_date": event_date})
+
+
+def reference(events: pd.DataFrame, years: list) -> dict:
+    """Per-province pandas results to check the matrix code against, keyed like the matrix rows."""
+    days = pd.date_range(f"{min(years)}-01-01", f"{max(years)}-12-31", freq="D")
+    prov = events["prov"].astype(object)
+    daily = (
+        events.assign(prov=prov.fillna("<missing>"), day=events["event_date"].dt.normalize())
+        .groupby(["prov", "day"]).size()
+        .unstack(fill_value=0).reindex(columns=days, fill_value=0)
+    )
+    out = {}
+    for name, series in daily.iterrows():
+        s = pd.Series(series.to_numpy(), index=days)
+        before = s.shift(1).rolling(agg.ANOMALY_WINDOW)
+        mean = before.mean()
+        var = np.maximum(before.var(ddof=0), np.maximum(mean, 1.0))
+        out[name] = {
+            "avg_7d": s.rolling(7, min_periods=1).mean().to_numpy(),
+            "weekly": s.resample("W-SUN").sum().to_numpy(),
+            "zscore": ((s - mean) / np.sqrt(var)).to_numpy(),
+        }
+    return out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=2_000_000, help="synthetic events (default 2M)")
+    parser.add_argument("--years", type=int, default=4, help="years of events, from 2016 (default 4)")
+    args = parser.parse_args(argv)
+    years = list(range(2016, 2016 + args.years))
+    problems = []
+
+    events = synthetic_events(args.rows, years)
+    start = time.perf_counter()
+    counts = agg.count_daily(events)
+    count_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matrix, provinces, days = agg.daily_matrix(counts, years)
+    avg = agg.rolling_mean(matrix, 7)
+    z, anomaly = agg.anomaly_scores(matrix)
+    weekly, _, _ = agg.weekly_sums(matrix, days)
+    agg.holiday_windows(matrix, days, years)
+    matrix_s = time.perf_counter() - start
+
+    expected = reference(events, years)
+    for i, name in enumerate(provinces):
+        want = expected["<missing>" if pd.isna(name) else name]
+        if not np.allclose(avg[i], want["avg_7d"]):
+            problems.append(f"{name}: 7-day means differ")
+        if not np.array_equal(weekly[i], want["weekly"]):
+            problems.append(f"{name}: weekly sums differ")
+        if not np.allclose(z[i], want["zscore"], equal_nan=True):
+            problems.append(f"{name}: z-scores differ")
+    print(f"{len(provinces)} provinces x {len(days):,} days: {'same as pandas' if not problems else 'MISMATCH'}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        agg.OUT_DIR = tmp
+        start = time.perf_counter()
+        agg._finish_daily(counts, years, agg.years_label(years))
+        finish_s = time.perf_counter() - start
+
+    print(f"{'count_daily':<36} {count_s:6.2f}s  ({args.rows:,} events)")
+    print(f"{'matrix, rolling, anomalies, weeks':<36} {matrix_s:6.2f}s  ({int(anomaly.sum())} anomalies)")
+    print(f"{'_finish_daily (with CSVs)':<36} {finish_s:6.2f}s")
+    if problems:
+        print("\nMISMATCHES:\n" + "\n".join(f"  {p}" for p in problems[:20]))
+        sys.exit(1)
+    print("\nSame results.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Check classify_icd_vehicle against icd_vehicle_map on a random corpus, then time both.
+
+The corpus mixes well-formed V-codes (V20, v29.1, V 1 2) with random strings over V/v, ASCII and Thai
+digits, punctuation, whitespace and letters, plus non-string values.
+
+    python benchmarks/bench_icd_vehicle.py --rows 2000000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from aggregate_from_raw import classify_icd_vehicle, icd_vehicle_map  # noqa: E402
+
+ALPHABET = list("VvVvWXY0123456789๐๑๒๓ .-_/ab\t")
+
+
+def random_corpus(n: int, seed: int = 0) -> pd.Series:
+    """n random codes: a mix of noise strings and well-formed codes, plus None/NaN/ints."""
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(0, 8, n)
+    chars = rng.choice(ALPHABET, size=(n, 8))
+    noise = ["".join(row[:k]) for row, k in zip(chars, lengths)]
+    wellformed = [f"{p}V{v:02d}{s}" for p, v, s in zip(
+        rng.choice(["", " ", "  "], n), rng.integers(0, 100, n), rng.choice(["", ".1", ".9", " "], n))]
+    corpus = np.where(rng.random(n) < 0.5, np.array(noise, dtype=object), np.array(wellformed, dtype=object))
+    odd = rng.random(n)
+    corpus[odd < 0.02] = None
+    corpus[(odd >= 0.02) & (odd < 0.04)] = np.nan
+    corpus[(odd >= 0.04) & (odd < 0.05)] = 20
+    return pd.Series(corpus, dtype=object)
+
+
+def check(n: int, seed: int) -> None:
+    corpus = random_corpus(n, seed)
+    expected = [icd_vehicle_map(c) for c in corpus]
+    got = classify_icd_vehicle(corpus)
+    mismatches = [(c, e, g) for c, e, g in zip(corpus, expected, got) if e != g]
+    if mismatches:
+        raise AssertionError(f"{len(mismatches)} mismatches, e.g. {mismatches[:5]}")
+    print(f"seed {seed}: {n:,} random codes, labels identical")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=2_000_000, help="rows for the timing run")
+    parser.add_argument("--seeds", type=int, default=20, help="random corpora to check")
+    args = parser.parse_args(argv)
+
+    for seed in range(args.seeds):
+        check(50_000, seed)
+
+    rng = np.random.default_rng(0)
+    codes = pd.Series(
+        np.array([f"V{v:02d}.{v % 10}" for v in range(100)] + ["W19", "X59"], dtype=object)[
+            rng.integers(0, 102, args.rows)
+        ]
+    )
+    t0 = time.perf_counter()
+    codes.map(icd_vehicle_map)
+    t_map = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    classify_icd_vehicle(codes)
+    t_vec = time.perf_counter() - t0
+    print(f"{args.rows:,} codes: map(icd_vehicle_map) {t_map:.2f}s, classify_icd_vehicle {t_vec:.2f}s "
+          f"({t_map / t_vec:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
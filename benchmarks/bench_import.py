@@ -0,0 +1,103 @@
+"""Time the cold start of aggregate_from_raw and check what importing it loads.
+
+Each command runs --repeat times in a fresh interpreter and the median wall time is reported: importing
+pandas and numpy alone (the floor every command pays), importing aggregate_from_raw, `--help` and the
+tables command. Importing the module must not load matplotlib nor create any file or directory,
+and it may take at most --max-overhead seconds longer than the pandas/numpy floor; a violation makes the
+exit status 1. The slowest imports below aggregate_from_raw (python -X importtime) are listed too.
+
+    python benchmarks/bench_import.py
+    python benchmarks/bench_import.py --repeat 10 --max-overhead 0.1
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Tuple
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+SCRIPT = os.path.join(ROOT, "aggregate_from_raw.py")
+# modules that only figures need (pyarrow is not listed: pandas imports it when installed)
+LAZY_MODULES = ["matplotlib"]
+
+
+def _python(args: List[str], cwd: str) -> Tuple[float, subprocess.CompletedProcess]:
+    env = dict(os.environ, PYTHONPATH=ROOT, PYTHONDONTWRITEBYTECODE="1")
+    start = time.perf_counter()
+    done = subprocess.run([sys.executable] + args, cwd=cwd, env=env, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if done.returncode != 0:
+        raise RuntimeError(f"{' '.join(args)} failed:\n{done.stderr}")
+    return elapsed, done
+
+
+def median_seconds(args: List[str], cwd: str, repeat: int) -> float:
+    _python(args, cwd)  # warm the OS file cache and the bytecode cache
+    return statistics.median(_python(args, cwd)[0] for _ in range(repeat))
+
+
+def slowest_imports(cwd: str, top: int) -> List[Tuple[int, str]]:
+    """(cumulative microseconds, module) of the top slowest imports made by importing aggregate_from_raw."""
+    _, done = _python(["-X", "importtime", "-c", "import aggregate_from_raw"], cwd)
+    rows = []
+    for line in done.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative), name.rstrip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="runs per command (default 5)")
+    parser.add_argument("--max-overhead", type=float, default=0.15,
+                        help="allowed import time beyond importing pandas and numpy, in seconds (default 0.15)")
+    parser.add_argument("--top", type=int, default=12, help="slowest imports listed (default 12)")
+    args = parser.parse_args(argv)
+
+    problems = []
+    with tempfile.TemporaryDirectory() as tmp:
+        check = (
+            "import sys, aggregate_from_raw; "
+            f"print(' '.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+        )
+        loaded = _python(["-c", check], tmp)[1].stdout.split()
+        if loaded:
+            problems.append(f"importing aggregate_from_raw loads {', '.join(loaded)}")
+        created = os.listdir(tmp)
+        if created:
+            problems.append(f"importing aggregate_from_raw creates {', '.join(sorted(created))}")
+
+        commands = [
+            ("import pandas, numpy", ["-c", "import pandas, numpy"]),
+            ("import aggregate_from_raw", ["-c", "import aggregate_from_raw"]),
+            ("aggregate_from_raw.py --help", [SCRIPT, "--help"]),
+            ("aggregate_from_raw.py tables", [SCRIPT, "tables"]),
+        ]
+        print(f"{'command':<32} {'seconds':>8}  (median of {args.repeat})")
+        seconds = {}
+        for name, command in commands:
+            seconds[name] = median_seconds(command, tmp, args.repeat)
+            print(f"{name:<32} {seconds[name]:>8.3f}")
+        overhead = seconds["import aggregate_from_raw"] - seconds["import pandas, numpy"]
+        print(f"{'import overhead over pandas':<32} {overhead:>8.3f}")
+        if overhead > args.max_overhead:
+            problems.append(f"import overhead {overhead:.3f}s exceeds --max-overhead {args.max_overhead:g}s")
+
+        print("\nslowest imports (cumulative ms):")
+        for micros, name in slowest_imports(tmp, args.top):
+            print(f"{micros / 1000:>9.1f}  {name}")
+
+    if problems:
+        print("\nREGRESSIONS:\n" + "\n".join(f"  {p}" for p in problems))
+        sys.exit(1)
+    print("\nNo regressions.")
+
+
+if __name__ == "__main__":
+    main()
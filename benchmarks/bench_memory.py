@@ -0,0 +1,40 @@
+"""Report per-column memory of a raw IS file read with inferred dtypes versus RAW_SCHEMA (read_raw).
+
+Columns the pipeline does not use are not loaded at all under the schema (bytes_schema 0).
+
+    python benchmarks/bench_memory.py is2018.csv
+"""
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from aggregate_from_raw import RAW_FILE, memory_report, read_raw  # noqa: E402
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("raw_file", nargs="?", default=RAW_FILE, help=f"raw IS CSV (default: {RAW_FILE})")
+    args = parser.parse_args(argv)
+
+    report = memory_report(args.raw_file)
+    with pd.option_context("display.max_rows", None, "display.width", 120):
+        print(report.fillna("-").to_string())
+    total = report.loc["TOTAL"]
+    print(f"\n{total['bytes_default'] / 2**20:,.1f} MiB -> {total['bytes_schema'] / 2**20:,.1f} MiB "
+          f"({total['ratio']}x smaller)")
+
+    for label, read in [
+        ("inferred dtypes", lambda: pd.read_csv(args.raw_file, encoding="utf-8", low_memory=False)),
+        ("read_raw", lambda: read_raw(args.raw_file)),
+    ]:
+        start = time.perf_counter()
+        read()
+        print(f"read with {label}: {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""Time the pipeline's stages on synthetic IS data and compare them with a stored baseline.
+
+Writes --rows synthetic rows (see synthetic_is.py) to a temporary directory, then times read_raw,
+parse_dates, count_qa_checks, normalize_sex, classify_icd_vehicle, icd_vehicle_map, count_tables and every
+agg_* function. Each stage gets a second, traced run for its peak memory (tracemalloc) and a checksum of its
+result. Against benchmarks/baseline.json a changed checksum is a correctness regression and a time or
+peak more than --tolerance times the baseline a performance one; either makes the exit status 1.
+Baselines are machine-specific: refresh them with --update-baseline on the machine that runs the check.
+
+    python benchmarks/bench_pipeline.py --rows 1000000
+    python benchmarks/bench_pipeline.py --rows 1000000 --update-baseline
+"""
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, ".."))
+import aggregate_from_raw as agg  # noqa: E402
+from synthetic_is import write_synthetic_is  # noqa: E402
+
+BASELINE = os.path.join(HERE, "baseline.json")
+YEAR = 2018
+# sub-second stages jitter by tens of percent: a slowdown must also add this many seconds to count
+MIN_SLOWDOWN_S = 0.25
+
+
+def checksum(result) -> str:
+    """Short, order-sensitive hash of a stage's result (frame, series, categorical or dict of them)."""
+    h = hashlib.sha256()
+    if isinstance(result, dict):
+        for key in sorted(result):
+            h.update(f"{key}:{checksum(result[key])}".encode())
+    elif result is None:
+        h.update(b"none")
+    else:
+        if isinstance(result, pd.Categorical):
+            result = pd.Series(result)
+        try:
+            hashed = pd.util.hash_pandas_object(result, index=True)
+        except ValueError:
+            # an index with missing values among its levels (groupby dropna=False) cannot be hashed as is
+            hashed = pd.util.hash_pandas_object(result.reset_index(), index=False)
+        h.update(hashed.to_numpy().tobytes())
+        h.update(repr(list(result.columns) if isinstance(result, pd.DataFrame) else result.name).encode())
+    return h.hexdigest()[:16]
+
+
+def stages(path: str) -> List[Tuple[str, Callable[[], object]]]:
+    """(name, call) for every benchmarked stage; later stages reuse earlier stages' inputs."""
+    raw = agg.read_raw(path)
+    df = agg.parse_dates(raw)
+    df = df.loc[df["year"] == YEAR]
+    aggs = sorted(
+        (fn for name, fn in inspect.getmembers(agg, inspect.isfunction) if name.startswith("agg_")),
+        key=lambda fn: fn.__code__.co_firstlineno,
+    )
+    return [
+        ("read_raw", lambda: agg.read_raw(path)),
+        ("parse_dates", lambda: agg.parse_dates(raw)),
+        ("count_qa_checks", lambda: agg.count_qa_checks(raw)),
+        ("normalize_sex", lambda: agg.normalize_sex(raw["sex"])),
+        ("classify_icd_vehicle", lambda: agg.classify_icd_vehicle(raw["icdcause"])),
+        ("icd_vehicle_map", lambda: raw["icdcause"].astype(object).map(agg.icd_vehicle_map)),
+        ("count_tables", lambda: agg.count_tables(df, agg.AGG_SPECS)),
+    ] + [(fn.__name__, lambda fn=fn: fn(df)) for fn in aggs]
+
+
+def run(path: str) -> Dict[str, dict]:
+    results = {}
+    for name, call in stages(path):
+        # figures are only rendered when their table changed: forget earlier renders so each run draws them
+        if os.path.exists(agg.FIGURE_MANIFEST):
+            os.remove(agg.FIGURE_MANIFEST)
+        start = time.perf_counter()
+        result = call()
+        seconds = time.perf_counter() - start
+
+        if os.path.exists(agg.FIGURE_MANIFEST):
+            os.remove(agg.FIGURE_MANIFEST)
+        tracemalloc.start()
+        call()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        results[name] = {"seconds": round(seconds, 4), "peak_mb": round(peak / 2**20, 1), "checksum": checksum(result)}
+        print(f"  {name:<40} {seconds:8.3f}s {peak / 2**20:9.1f} MB")
+    return results
+
+
+def compare(results: Dict[str, dict], baseline: dict, tolerance: float) -> List[str]:
+    """Regressions of results against baseline["results"], as printable lines."""
+    problems = []
+    print(f"\n{'stage':<40} {'seconds':>9} {'baseline':>9} {'ratio':>6} {'peak MB':>9} {'baseline':>9}  result")
+    for name, now in results.items():
+        before = baseline["results"].get(name)
+        if before is None:
+            print(f"{name:<40} {now['seconds']:9.3f} {'-':>9}   (new stage)")
+            continue
+        ratio = now["seconds"] / before["seconds"] if before["seconds"] else float("inf")
+        same = now["checksum"] == before["checksum"]
+        print(f"{name:<40} {now['seconds']:9.3f} {before['seconds']:9.3f} {ratio:6.2f} "
+              f"{now['peak_mb']:9.1f} {before['peak_mb']:9.1f}  {'same' if same else 'CHANGED'}")
+        if not same:
+            problems.append(f"{name}: result changed ({before['checksum']} -> {now['checksum']})")
+        if ratio > tolerance and now["seconds"] - before["seconds"] > MIN_SLOWDOWN_S:
+            problems.append(f"{name}: {ratio:.2f}x slower ({before['seconds']:.3f}s -> {now['seconds']:.3f}s)")
+        if before["peak_mb"] and now["peak_mb"] > tolerance * before["peak_mb"]:
+            problems.append(f"{name}: peak memory {before['peak_mb']} MB -> {now['peak_mb']} MB")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000, help="synthetic rows (default 1M)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tolerance", type=float, default=1.5,
+                        help="flag stages slower or larger than this multiple of the baseline (default 1.5)")
+    parser.add_argument("--baseline", default=BASELINE, help="baseline JSON (default: benchmarks/baseline.json)")
+    parser.add_argument("--update-baseline", action="store_true", help="store this run as the baseline")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # keep the benchmark's CSVs, figures and caches out of the working tree
+        agg.OUT_DIR = tmp
+        agg.FIG_DIR = os.path.join(tmp, "figures")
+        agg.CACHE_DIR = os.path.join(tmp, "cache")
+        agg.FIGURE_MANIFEST = os.path.join(agg.CACHE_DIR, "figures.json")
+        os.makedirs(agg.FIG_DIR)
+        path = os.path.join(tmp, f"is{YEAR}.csv")
+        print(f"Writing {args.rows:,} synthetic rows...")
+        write_synthetic_is(path, args.rows, YEAR, args.seed)
+        # matplotlib is imported on the first figure drawn; import it here so that no stage pays for it
+        agg._pyplot()
+        print("Running stages (time, then traced peak memory):")
+        results = run(path)
+
+    run_info = {
+        "rows": args.rows,
+        "seed": args.seed,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "machine": f"{platform.machine()} {os.cpu_count()} CPUs",
+    }
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(dict(run_info, results=results), f, ensure_ascii=False, indent=2)
+        print(f"\nBaseline written to {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}; store one with --update-baseline")
+        return
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if (baseline["rows"], baseline["seed"]) != (args.rows, args.seed):
+        print(f"\nBaseline is for {baseline['rows']:,} rows, seed {baseline['seed']}; not comparable")
+        return
+    problems = compare(results, baseline, args.tolerance)
+    if problems:
+        print("\nRegressions:\n  " + "\n  ".join(problems))
+        sys.exit(1)
+    print("\nNo regressions.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Check and time byte-range ingestion of one raw IS file against a whole-file read.
+
+The records of raw_file are split into --ranges byte ranges (raw_byte_ranges) and each range is read on
+its own (read_raw_range): together they must give exactly the rows of read_raw(raw_file), in order. A
+small file with quoted fields holding commas, quotes and newlines is split at every possible number of
+ranges and checked the same way. Then the counts of the whole file (file_partials, one process) are timed
+against the counts of its ranges in --jobs worker processes (range_partials), and the two cubes must be
+equal. Any mismatch makes the exit status 1.
+
+    python benchmarks/bench_ranges.py is2018.csv --ranges 32 --jobs 32
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import aggregate_from_raw as agg  # noqa: E402
+
+QUOTED = (
+    'prov,sex,age,adate,icdcause,note\n'
+    'กรุงเทพมหานคร,1,30,01/01/2018,V23.4,"a, b"\n'
+    'ชลบุรี,2,41,02/01/2018,V43.5,"line one\nline two"\n'
+    '"เชียง""ใหม่",1,,03/01/2018,W01,""\n'
+    'ภูเก็ต,2,7,04/01/2018,V87.7,"""quoted""\n, and\n\nmore"\n'
+    'ขอนแก่น,1,66,05/01/2018,V29.9,plain\n'
+)
+
+
+def same_rows(path: str, ranges: list) -> bool:
+    """Whether the ranges of path read one by one give read_raw(path)'s rows, in order."""
+    whole = agg.read_raw(path)
+    columns = agg.raw_columns(path)
+    parts = [agg.read_raw_range(path, start, end, columns) for start, end in ranges]
+    joined = pd.concat(parts, ignore_index=True) if parts else whole.iloc[:0]
+    if list(joined.columns) != list(whole.columns) or len(joined) != len(whole):
+        return False
+    # per-range categoricals (and age types) differ; the values must not
+    as_values = lambda df: df.astype(object).where(df.notna(), None)  # noqa: E731
+    return as_values(joined).equals(as_values(whole))
+
+
+def cells(cube: pd.Series) -> pd.DataFrame:
+    """A cube's cells as text in a canonical order: level types may differ between slices (a level with
+    no missing value in one range is bool, with the whole file object)."""
+    table = cube.reset_index().astype(str)
+    return table.sort_values(list(table.columns)).reset_index(drop=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("raw_file", nargs="?", default=agg.RAW_FILE, help=f"raw IS CSV (default: {agg.RAW_FILE})")
+    parser.add_argument("--ranges", type=int, default=os.cpu_count(), help="byte ranges (default: number of CPUs)")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="worker processes (default: number of CPUs)")
+    args = parser.parse_args(argv)
+    problems = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        quoted = os.path.join(tmp, "quoted.csv")
+        with open(quoted, "w", encoding="utf-8") as f:
+            f.write(QUOTED)
+        for parts in range(1, len(QUOTED.encode()) + 1):
+            if not same_rows(quoted, agg.raw_byte_ranges(quoted, parts)):
+                problems.append(f"quoted fields: {parts} ranges do not give the rows of a whole-file read")
+                break
+    print(f"quoted fields: {'ok' if not problems else 'MISMATCH'}")
+
+    start = time.perf_counter()
+    ranges = agg.raw_byte_ranges(args.raw_file, args.ranges)
+    split_s = time.perf_counter() - start
+    size = os.path.getsize(args.raw_file)
+    print(f"{args.raw_file}: {size / 2**20:,.0f} MiB in {len(ranges)} ranges, split in {split_s:.2f}s")
+    if not same_rows(args.raw_file, ranges):
+        problems.append(f"{args.raw_file}: the ranges do not give the rows of a whole-file read")
+    print(f"row set: {'ok' if not problems else 'MISMATCH'}")
+
+    year = agg.file_year(args.raw_file)
+    start = time.perf_counter()
+    whole = agg.file_partials(args.raw_file)
+    whole_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    formats = agg.pin_file_date_formats(args.raw_file, {})
+    acc = None
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = [pool.submit(agg.range_partials, args.raw_file, a, b, formats, year) for a, b in ranges]
+        for future in futures:
+            acc = agg.merge_partials(acc, future.result())
+    ranges_s = time.perf_counter() - start
+    if not cells(acc["cube"]).equals(cells(whole["cube"])):
+        problems.append("the cube of the ranges differs from the cube of the whole file")
+
+    print(f"{'whole file, 1 process':<32} {whole_s:6.2f}s")
+    print(f"{f'{len(ranges)} ranges, {args.jobs} processes':<32} {ranges_s:6.2f}s  ({whole_s / ranges_s:.1f}x)")
+    if problems:
+        print("\nMISMATCHES:\n" + "\n".join(f"  {p}" for p in problems))
+        sys.exit(1)
+    print("\nSame rows and counts.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Load-test a running serve_aggregates.py: requests per second and latency under concurrent clients.
+
+Each of --clients keep-alive connections sends requests back to back for --seconds, cycling through every
+table (JSON and CSV, all years and each year) and a set of cube queries, so the LRU cache serves most of
+them once warm. Prints throughput, latency percentiles and the status codes seen.
+
+    python serve_aggregates.py is2018.csv &
+    python benchmarks/bench_serve.py --clients 32 --seconds 10
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter
+from typing import List, Tuple
+from urllib.parse import quote, urlsplit
+
+import numpy as np
+
+
+async def _get(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, host: str, path: str) -> Tuple[int, bytes]:
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode())
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    length = next(int(line.split(":", 1)[1]) for line in lines if line.lower().startswith("content-length:"))
+    return int(lines[0].split(" ")[1]), await reader.readexactly(length)
+
+
+def request_paths(index: dict) -> List[str]:
+    """Every table for all years and each year, as JSON and CSV, plus roll-ups by one and two dimensions."""
+    paths = []
+    for fmt in ["json", "csv"]:
+        for name in index["tables"]:
+            paths.append(f"/tables/{name}?format={fmt}")
+            paths += [f"/tables/{name}?year={year}&format={fmt}" for year in index["years"]]
+        for dim in index["dimensions"]:
+            paths.append(f"/query?by={dim}&format={fmt}")
+            if dim != "year":
+                paths += [f"/query?by=year,{dim}&year={year}&format={fmt}" for year in index["years"]]
+    bkk = quote("กรุงเทพมหานคร")
+    paths += [f"/query?by=quarter,sex&prov={bkk}", f"/tables/hour_of_day?prov={bkk}", f"/tables/mode_mix?prov={bkk}"]
+    return paths
+
+
+async def client(host: str, port: int, paths: List[str], offset: int, deadline: float, latencies: list, statuses: Counter):
+    reader, writer = await asyncio.open_connection(host, port)
+    i = offset
+    try:
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            status, _ = await _get(reader, writer, host, paths[i % len(paths)])
+            latencies.append(time.perf_counter() - start)
+            statuses[status] += 1
+            i += 1
+    finally:
+        writer.close()
+
+
+async def run(url: str, clients: int, seconds: float) -> None:
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    reader, writer = await asyncio.open_connection(host, port)
+    _, body = await _get(reader, writer, host, "/tables")
+    writer.close()
+    paths = request_paths(json.loads(body))
+    print(f"{len(paths)} distinct requests, {clients} clients, {seconds:g}s")
+
+    latencies, statuses = [], Counter()
+    deadline = time.perf_counter() + seconds
+    start = time.perf_counter()
+    await asyncio.gather(*(client(host, port, paths, k * 7, deadline, latencies, statuses) for k in range(clients)))
+    elapsed = time.perf_counter() - start
+
+    ms = np.array(latencies) * 1000
+    print(f"{len(ms):,} requests in {elapsed:.1f}s: {len(ms) / elapsed:,.0f} requests/s")
+    print(f"latency ms: p50 {np.percentile(ms, 50):.1f}  p90 {np.percentile(ms, 90):.1f}  "
+          f"p99 {np.percentile(ms, 99):.1f}  max {ms.max():.1f}")
+    print(f"status: {dict(sorted(statuses.items()))}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8765", help="service address (default: http://127.0.0.1:8765)")
+    parser.add_argument("--clients", type=int, default=32, help="concurrent keep-alive connections (default 32)")
+    parser.add_argument("--seconds", type=float, default=10, help="test duration (default 10)")
+    args = parser.parse_args(argv)
+    asyncio.run(run(args.url, args.clients, args.seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Check and time the share intervals of share_intervals (Wilson and multinomial bootstrap).
+
+Synthetic province x vehicle-type counts for every gazetteer province are bootstrapped with
+bootstrap_interval (one batched multinomial draw) and, for a few provinces, by resampling their rows;
+the two percentile intervals must agree to within --tolerance. Wilson intervals are checked against the
+textbook formula cell by cell. Then share_intervals is timed at --replicates replicates. Any mismatch
+makes the exit status 1.
+
+    python benchmarks/bench_shares.py --replicates 10000
+"""
+import argparse
+import math
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import aggregate_from_raw as agg  # noqa: E402
+
+
+def synthetic_counts(seed: int = 0) -> pd.Series:
+    """Cases per (prov, vehicle_type) for every gazetteer province: skewed totals, some zero cells."""
+    rng = np.random.default_rng(seed)
+    provinces = [name for code, name in sorted(agg.gazetteer().names.items()) if code < 100]
+    totals = (40_000 / np.arange(1, len(provinces) + 1) ** 0.9).astype(int) + 5
+    shares = rng.dirichlet(np.full(len(agg.VEHICLE_TYPES), 0.6), size=len(provinces))
+    cells = np.array([rng.multinomial(n, p) for n, p in zip(totals, shares)])
+    index = pd.MultiIndex.from_product([provinces, agg.VEHICLE_TYPES], names=["prov", "vehicle_type"])
+    return pd.Series(cells.ravel(), index=index)
+
+
+def wilson(x: int, n: int, z: float) -> tuple:
+    p = x / n
+    centre = (p + z * z / (2 * n)) / (1 + z * z / n)
+    half = z / (1 + z * z / n) * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n))
+    return max(0.0, centre - half), min(1.0, centre + half)
+
+
+def row_bootstrap(row: np.ndarray, replicates: int, rng: np.random.Generator) -> np.ndarray:
+    """Percentile interval (2, categories) from resampling the rows behind one count vector."""
+    rows = np.repeat(np.arange(len(row)), row)
+    picks = rows[rng.integers(0, len(rows), size=(replicates, len(rows)))]
+    shares = np.stack([(picks == k).mean(axis=1) for k in range(len(row))], axis=1)
+    alpha = (1 - agg.SHARE_CONFIDENCE) / 2
+    return np.quantile(shares, [alpha, 1 - alpha], axis=0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--replicates", type=int, default=agg.BOOTSTRAP_REPLICATES,
+                        help=f"bootstrap replicates for the timing run (default {agg.BOOTSTRAP_REPLICATES})")
+    parser.add_argument("--tolerance", type=float, default=0.01, help="allowed interval difference (default 0.01)")
+    args = parser.parse_args(argv)
+    problems = []
+
+    counts = synthetic_counts()
+    matrix = counts.to_numpy().reshape(-1, len(agg.VEHICLE_TYPES))
+    rng = np.random.default_rng(1)
+    low, high = agg.bootstrap_interval(matrix, rng, 4000)
+    # the smallest provinces have a few hundred rows: cheap to resample row by row
+    for i in range(len(matrix) - 3, len(matrix)):
+        expected = row_bootstrap(matrix[i], 4000, rng)
+        worst = max(np.abs(low[i] - expected[0]).max(), np.abs(high[i] - expected[1]).max())
+        print(f"province {i}: {matrix[i].sum():,} rows, largest interval difference {worst:.4f}")
+        if worst > args.tolerance:
+            problems.append(f"province {i}: multinomial and row bootstrap differ by {worst:.4f}")
+
+    totals = np.repeat(matrix.sum(axis=1), matrix.shape[1])
+    got = np.stack(agg.wilson_interval(matrix.ravel(), totals), axis=1)
+    z = agg.NormalDist().inv_cdf(0.5 + agg.SHARE_CONFIDENCE / 2)
+    expected = np.array([wilson(int(x), int(n), z) for x, n in zip(matrix.ravel(), totals)])
+    if not np.allclose(got, expected):
+        problems.append("Wilson intervals differ from the formula")
+    print(f"Wilson intervals: {'ok' if np.allclose(got, expected) else 'MISMATCH'}")
+
+    agg.BOOTSTRAP_REPLICATES = args.replicates
+    start = time.perf_counter()
+    table = agg.share_intervals(counts, "vehicle_type", 2018)
+    seconds = time.perf_counter() - start
+    print(f"share_intervals: {len(table):,} cells x {args.replicates:,} replicates in {seconds:.2f}s")
+    if problems:
+        print("\nMISMATCHES:\n" + "\n".join(f"  {p}" for p in problems))
+        sys.exit(1)
+    print("\nSame intervals.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Check and time small-cell suppression (suppress_counts, suppress_series).
+
+Synthetic district x quarter x vehicle-type counts for one year (skewed district sizes, many small cells)
+are suppressed with suppress_counts and, on a smaller table, by a cell-by-cell Python reference applying
+the same rule line by line; the two must hide the same cells. The full table is checked for what the
+suppression promises: no published cell below the threshold, and no line whose only hidden cell its total
+would give away. Then a province x day series of --years years is suppressed with suppress_series. Any
+mismatch makes the exit status 1.
+
+    python benchmarks/bench_suppression.py --districts 928 --threshold 5
+"""
+import argparse
+import os
+import sys
+import time
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import aggregate_from_raw as agg  # noqa: E402
+
+QUARTERS = ["Q1", "Q2", "Q3", "Q4"]
+
+
+def synthetic_counts(districts: int, seed: int = 0) -> pd.Series:
+    """Cases per (district, quarter, vehicle_type) for one year; observed cells only, like a cube roll-up."""
+    rng = np.random.default_rng(seed)
+    sizes = 40_000 / np.arange(1, districts + 1) ** 0.5
+    mix = rng.dirichlet(np.full(len(agg.VEHICLE_TYPES), 0.5), size=districts)
+    means = sizes[:, None, None] / 4 * mix[:, None, :] * rng.uniform(0.8, 1.2, (districts, 4, 1))
+    cells = rng.poisson(means)
+    index = pd.MultiIndex.from_product(
+        [[f"d{i:04d}" for i in range(districts)], QUARTERS, agg.VEHICLE_TYPES],
+        names=["district", "quarter", "vehicle_type"],
+    )
+    counts = pd.Series(cells.ravel(), index=index)
+    return counts[counts > 0]
+
+
+def reference(counts: pd.Series, threshold: int) -> np.ndarray:
+    """The same primary and complementary suppression, one line at a time in plain Python."""
+    keys = list(counts.index)
+    values = counts.to_numpy()
+    hidden = [0 < v < threshold for v in values]
+    lines = []
+    for axis in range(counts.index.nlevels):
+        members = defaultdict(list)
+        for i, key in enumerate(keys):
+            members[key[:axis] + key[axis + 1:]].append(i)
+        lines.append(list(members.values()))
+    changed = any(hidden)
+    while changed:
+        changed = False
+        for axis_lines in lines:
+            for cells in axis_lines:
+                if sum(hidden[i] for i in cells) != 1:
+                    continue
+                candidates = [(values[i], i) for i in cells if not hidden[i] and values[i] > 0]
+                if candidates:
+                    hidden[min(candidates)[1]] = True
+                    changed = True
+    return np.array(hidden)
+
+
+def problems_of(counts: pd.Series, hidden: np.ndarray, threshold: int) -> list:
+    """Published small cells and lines that give their one hidden cell away."""
+    values = counts.to_numpy()
+    problems = []
+    if ((values > 0) & (values < threshold) & ~hidden).any():
+        problems.append("a cell below the threshold is published")
+    frame = counts.reset_index(name="cases").assign(hidden=hidden, open=~hidden & (values > 0))
+    keys = list(counts.index.names)
+    for key in keys:
+        others = [k for k in keys if k != key]
+        lines = frame.groupby(others, observed=True)[["hidden", "open"]].sum()
+        exposed = (lines["hidden"] == 1) & (lines["open"] > 0)
+        if exposed.any():
+            problems.append(f"{int(exposed.sum())} lines along {key} give their hidden cell away")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--districts", type=int, default=928, help="synthetic districts (default 928, all of Thailand)")
+    parser.add_argument("--threshold", type=int, default=5, help="suppress cells below this (default 5)")
+    parser.add_argument("--years", type=int, default=1, help="years of the daily series (default 1)")
+    args = parser.parse_args(argv)
+    problems = []
+
+    small = synthetic_counts(60, seed=1)
+    got, expected = agg.suppress_counts(small, args.threshold), reference(small, args.threshold)
+    if not np.array_equal(got, expected):
+        problems.append(f"{int((got != expected).sum())} cells differ from the reference")
+    print(f"reference table: {len(small):,} cells, {int(expected.sum())} hidden: "
+          f"{'same' if np.array_equal(got, expected) else 'MISMATCH'}")
+
+    counts = synthetic_counts(args.districts)
+    start = time.perf_counter()
+    hidden = agg.suppress_counts(counts, args.threshold)
+    seconds = time.perf_counter() - start
+    primary = int(((counts > 0) & (counts < args.threshold)).sum())
+    problems += problems_of(counts, hidden, args.threshold)
+    print(f"{'suppress_counts':<20} {seconds:6.3f}s  ({len(counts):,} cells: {primary:,} primary, "
+          f"{int(hidden.sum()) - primary:,} complementary)")
+
+    years = list(range(2016, 2016 + args.years))
+    rng = np.random.default_rng(2)
+    provinces = 77
+    days = pd.date_range(f"{years[0]}-01-01", f"{years[-1]}-12-31", freq="D")
+    rates = 300 / np.arange(1, provinces + 1) ** 1.2
+    matrix = rng.poisson(np.broadcast_to(rates[:, None], (provinces, len(days))))
+    matrix = np.vstack([matrix, matrix.sum(axis=0)])
+    start = time.perf_counter()
+    hidden_days, hidden_weeks = agg.suppress_series(matrix, days, args.threshold)
+    seconds = time.perf_counter() - start
+    if ((matrix > 0) & (matrix < args.threshold) & ~hidden_days).any():
+        problems.append("a day below the threshold is published")
+    print(f"{'suppress_series':<20} {seconds:6.3f}s  ({matrix.size:,} days: {int(hidden_days.sum()):,} hidden, "
+          f"{int(hidden_weeks.sum()):,} weeks hidden)")
+
+    if problems:
+        print("\nPROBLEMS:\n" + "\n".join(f"  {p}" for p in problems))
+        sys.exit(1)
+    print("\nSuppression holds.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""Write a synthetic raw IS file: realistic-looking rows at any scale, without the restricted is2018.csv.
+
+Rows mimic the raw extract: day-first adate/hdate strings with a mix of Gregorian and Buddhist-era
+years plus missing and unparseable values, Thai province and district names with a skewed Bangkok
+share, messy sex codes, ICD-10 icdcause values (mostly V01-V89 transport codes in several spellings,
+some falls and other causes), Head_Injury flags and a few columns the pipeline does not use. Rows are
+generated and written in chunks, so 50M rows need no more memory than one chunk.
+
+    python benchmarks/synthetic_is.py is2018.csv --rows 5000000 --year 2018
+"""
+import argparse
+import os
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+PROVINCES = [
+    "กรุงเทพมหานคร", "กระบี่", "กาญจนบุรี", "กาฬสินธุ์", "กำแพงเพชร", "ขอนแก่น", "จันทบุรี", "ฉะเชิงเทรา",
+    "ชลบุรี", "ชัยนาท", "ชัยภูมิ", "ชุมพร", "เชียงราย", "เชียงใหม่", "ตรัง", "ตราด", "ตาก", "นครนายก",
+    "นครปฐม", "นครพนม", "นครราชสีมา", "นครศรีธรรมราช", "นครสวรรค์", "นนทบุรี", "นราธิวาส", "น่าน",
+    "บึงกาฬ", "บุรีรัมย์", "ปทุมธานี", "ประจวบคีรีขันธ์", "ปราจีนบุรี", "ปัตตานี", "พระนครศรีอยุธยา", "พะเยา",
+    "พังงา", "พัทลุง", "พิจิตร", "พิษณุโลก", "เพชรบุรี", "เพชรบูรณ์", "แพร่", "ภูเก็ต", "มหาสารคาม",
+    "มุกดาหาร", "แม่ฮ่องสอน", "ยโสธร", "ยะลา", "ร้อยเอ็ด", "ระนอง", "ระยอง", "ราชบุรี", "ลพบุรี", "ลำปาง",
+    "ลำพูน", "เลย", "ศรีสะเกษ", "สกลนคร", "สงขลา", "สตูล", "สมุทรปราการ", "สมุทรสงคราม", "สมุทรสาคร",
+    "สระแก้ว", "สระบุรี", "สิงห์บุรี", "สุโขทัย", "สุพรรณบุรี", "สุราษฎร์ธานี", "สุรินทร์", "หนองคาย",
+    "หนองบัวลำภู", "อ่างทอง", "อำนาจเจริญ", "อุดรธานี", "อุตรดิตถ์", "อุทัยธานี", "อุบลราชธานี",
+]
+BANGKOK_DISTRICTS = [
+    "พระนคร", "ดุสิต", "หนองจอก", "บางรัก", "บางเขน", "บางกะปิ", "ปทุมวัน", "ป้อมปราบศัตรูพ่าย", "พระโขนง",
+    "มีนบุรี", "ลาดกระบัง", "ยานนาวา", "สัมพันธวงศ์", "พญาไท", "ธนบุรี", "บางกอกใหญ่", "ห้วยขวาง", "คลองสาน",
+    "ตลิ่งชัน", "บางกอกน้อย", "บางขุนเทียน", "ภาษีเจริญ", "หนองแขม", "ราษฎร์บูรณะ", "บางพลัด", "ดินแดง",
+    "บึงกุ่ม", "สาทร", "บางซื่อ", "จตุจักร", "บางคอแหลม", "ประเวศ", "คลองเตย", "สวนหลวง", "จอมทอง",
+    "ดอนเมือง", "ราชเทวี", "ลาดพร้าว", "วัฒนา", "บางแค", "หลักสี่", "สายไหม", "คันนายาว", "สะพานสูง",
+    "วังทองหลาง", "คลองสามวา", "บางนา", "ทวีวัฒนา", "ทุ่งครุ", "บางบอน",
+]
+BANGKOK_SHARE = 0.18
+DISTRICTS_PER_PROVINCE = 12
+SEX_CODES = ["1", "2", "1", "2", "M", "F", "m", "f", "ชาย", "หญิง", " 1 ", "0", "9", "x", ""]
+SEX_WEIGHTS = [0.34, 0.16, 0.1, 0.05, 0.08, 0.04, 0.02, 0.01, 0.08, 0.04, 0.02, 0.02, 0.02, 0.01, 0.01]
+HEAD_INJURY = ["HI", "non-HI", "hi", "Non-HI", ""]
+HEAD_INJURY_WEIGHTS = [0.25, 0.6, 0.03, 0.07, 0.05]
+OTHER_CAUSES = ["W19", "W01.0", "X59", "W54", "Y04", "X40", "W67"]
+
+
+def _zipf_choice(rng: np.random.Generator, k: int, size: int, a: float) -> np.ndarray:
+    """size draws from 0..k-1 with probability proportional to 1 / (rank + 1) ** a."""
+    w = 1.0 / np.arange(1, k + 1) ** a
+    return rng.choice(k, size, p=w / w.sum())
+
+
+def _vehicle_weights() -> np.ndarray:
+    """V01-V89 weights: motorcycles (V20-V29) dominate Thai road injuries, then cars and pickups."""
+    w = np.ones(89)
+    w[19:29] = 40  # V20-V29
+    w[39:49] = 6   # V40-V49
+    w[49:59] = 5   # V50-V59
+    w[0:9] = 4     # V01-V09
+    w[9:19] = 2    # V10-V19
+    return w / w.sum()
+
+
+# Every text column is drawn from a small pool of distinct strings and indexed per row, which keeps
+# generation vectorized (about as fast as writing the CSV).
+V_POOL = np.array(
+    [f"V{v:02d}.{d}" for v in range(1, 90) for d in range(10)]
+    + [f"V{v:02d}" for v in range(1, 90)] + [f"v{v:02d}" for v in range(1, 90)], dtype=object
+)
+ATIME_POOL = np.array([f"{m // 60:02d}:{m % 60:02d}" for m in range(24 * 60)], dtype=object)
+DISTRICT_POOL = np.array(
+    [[f"อำเภอ{k + 1} {prov}" for k in range(DISTRICTS_PER_PROVINCE)] for prov in PROVINCES], dtype=object
+)
+
+
+def _date_pool(year: int) -> pd.DatetimeIndex:
+    # neighbouring years plus a margin for admissions a few days after the accident
+    return pd.date_range(f"{year - 1}-01-01", f"{year + 2}-01-31", freq="D")
+
+
+def _date_strings(days: np.ndarray, pool: pd.DatetimeIndex, be_share: float, rng: np.random.Generator) -> np.ndarray:
+    """dd/mm/yyyy strings for days (positions in pool), be_share of them with Buddhist-era years."""
+    gregorian = pool.strftime("%d/%m/%Y").to_numpy(dtype=object)
+    be = (pool.strftime("%d/%m/").to_numpy(dtype=object) + (pool.year + 543).astype(str).to_numpy(dtype=object))
+    strings = np.concatenate([gregorian, be])
+    return strings[days + np.where(rng.random(len(days)) < be_share, len(pool), 0)]
+
+
+def _icd_codes(n: int, rng: np.random.Generator) -> np.ndarray:
+    v = rng.choice(89, n, p=_vehicle_weights())
+    spelling = rng.random(n)
+    # "V20.3" mostly, "V20" or "v20" sometimes
+    idx = np.where(spelling < 0.85, v * 10 + rng.integers(0, 10, n), np.where(spelling < 0.95, 890 + v, 979 + v))
+    codes = V_POOL[idx]
+    other = rng.random(n)
+    codes[other < 0.08] = np.array(OTHER_CAUSES, dtype=object)[rng.integers(0, len(OTHER_CAUSES), (other < 0.08).sum())]
+    codes[(other >= 0.08) & (other < 0.1)] = None
+    return codes
+
+
+def synthetic_is(rows: int, year: int = 2018, seed: int = 0) -> pd.DataFrame:
+    """rows synthetic raw IS rows for events in year (Gregorian)."""
+    rng = np.random.default_rng(seed)
+    # provinces other than Bangkok by a fixed, seed-independent size ranking
+    ranking = np.random.default_rng(77).permutation(len(PROVINCES) - 1) + 1
+    prov_idx = np.where(
+        rng.random(rows) < BANGKOK_SHARE, 0, ranking[_zipf_choice(rng, len(ranking), rows, 0.8)]
+    )
+    prov = np.array(PROVINCES, dtype=object)[prov_idx]
+    district = DISTRICT_POOL[prov_idx, _zipf_choice(rng, DISTRICTS_PER_PROVINCE, rows, 1.2)]
+    bkk = prov_idx == 0
+    district[bkk] = np.array(BANGKOK_DISTRICTS, dtype=object)[_zipf_choice(rng, len(BANGKOK_DISTRICTS), bkk.sum(), 0.7)]
+
+    # days into the year, more around New Year and Songkran; a few percent in the neighbouring years
+    pool = _date_pool(year)
+    first = (pd.Timestamp(f"{year}-01-01") - pool[0]).days
+    day = rng.integers(0, 365, rows)
+    festival = rng.random(rows) < 0.08
+    day[festival] = rng.choice(np.r_[0:4, 101:108, 361:365], festival.sum())
+    aday = first + day + np.where(rng.random(rows) < 0.03, rng.choice([-365, 365], rows), 0)
+    hday = aday + rng.choice([0, 0, 0, 1, 2], rows)
+    adate = _date_strings(aday, pool, 0.35, rng)
+    hdate = _date_strings(hday, pool, 0.35, rng)
+    adate[rng.random(rows) < 0.05] = None
+    adate[rng.random(rows) < 0.005] = "ไม่ทราบ"
+    hdate[rng.random(rows) < 0.08] = None
+    # crashes peak in the evening
+    hour_w = np.bincount(np.r_[np.arange(24), np.arange(16, 23).repeat(3)])
+    minute = rng.choice(24, rows, p=hour_w / hour_w.sum()) * 60 + rng.integers(0, 60, rows)
+    atime = ATIME_POOL[minute]
+    atime[rng.random(rows) < 0.04] = None
+
+    age = np.clip(rng.gamma(3.5, 9.0, rows), 0, 99).astype(int).astype(object)
+    age[rng.random(rows) < 0.01] = None
+
+    def pick(values, weights=None):
+        values = np.array(values, dtype=object)
+        if weights is None:
+            return values[rng.integers(0, len(values), rows)]
+        return values[rng.choice(len(values), rows, p=np.array(weights) / sum(weights))]
+
+    return pd.DataFrame({
+        "hn": rng.integers(10**6, 10**8, rows),
+        "hosp": rng.integers(10000, 11500, rows),
+        "prov": prov,
+        "aampur": district,
+        "sex": pick(SEX_CODES, SEX_WEIGHTS),
+        "age": age,
+        "occu": pick(["01", "02", "03", "05", "08", "12", "99"]),
+        "adate": adate,
+        "atime": atime,
+        "hdate": hdate,
+        "injp": pick(["1", "2", "3", "9"]),
+        "risk1": pick(["0", "1", "9", ""]),
+        "icdcause": _icd_codes(rows, rng),
+        "Head_Injury": pick(HEAD_INJURY, HEAD_INJURY_WEIGHTS),
+        "staer": pick(["1", "2", "3", "4", "5", "6", "7"]),
+    })
+
+
+def write_synthetic_is(
+    path: str, rows: int, year: int = 2018, seed: int = 0, chunk_rows: Optional[int] = 1_000_000
+) -> None:
+    """Write rows synthetic rows to path as CSV, chunk_rows at a time (chunk i uses seed + i)."""
+    chunk_rows = chunk_rows or rows
+    written = 0
+    for i, start in enumerate(range(0, rows, chunk_rows)):
+        chunk = synthetic_is(min(chunk_rows, rows - start), year, seed + i)
+        chunk.to_csv(path, mode="w" if i == 0 else "a", header=i == 0, index=False)
+        written += len(chunk)
+    assert written == rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", help="CSV to write, e.g. is2018.csv")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="rows to write (default 1M)")
+    parser.add_argument("--year", type=int, default=2018, help="Gregorian year of the events")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    write_synthetic_is(args.path, args.rows, args.year, args.seed)
+    print(f"{args.rows:,} rows -> {args.path} ({os.path.getsize(args.path) / 2**20:,.0f} MiB)")
+
+
+if __name__ == "__main__":
+    main()
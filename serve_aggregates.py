@@ -0,0 +1,480 @@
+"""Serve the aggregate tables, and any roll-up of the count cube, as JSON or CSV over local HTTP.
+
+The raw files are counted once into the count cube (through the incremental state under state/, so a
+restart or a reload parses only rows appended since) and every response is computed from the cube in
+memory, then kept in an LRU cache of rendered responses. The raw files are polled: when one changes or a
+new file matching the patterns lands, the cube is rebuilt in a worker process while the current one keeps
+serving, then swapped in and the cache emptied.
+
+    GET /tables                                  table names, dimensions and years
+    GET /tables/<name>?year=2018&prov=...        one aggregate table, the rows of outputs/<name>_<year>.csv
+    GET /query?by=prov,sex&year=2018&hour=7,8    cases by any dimensions, filtered by any dimensions
+    GET /health                                  data loaded, cache statistics
+
+Filters take comma-separated values (an empty value selects missing ones) and format=csv returns CSV
+instead of JSON. With --suppress-below, only the published tables are served, suppressed as in
+outputs/: /tables/<name> takes no filter but year, and /query is refused. Suppression protects each table
+on its own, so arbitrary slices, which could be differenced against each other to recover hidden cells,
+are not served.
+
+    python serve_aggregates.py 'is20*.csv' --port 8765
+    curl 'http://127.0.0.1:8765/tables/province?year=2018&format=csv'
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, unquote
+
+import numpy as np
+import pandas as pd
+
+from aggregate_from_raw import (
+    AGG_SPECS,
+    DATE_FORMAT,
+    RAW_FILE,
+    SUPPRESS_BELOW,
+    _level_codes,
+    cube_dims,
+    cube_query,
+    cube_slice,
+    cube_table,
+    file_partials,
+    finish_year,
+    merge_partials,
+    raw_paths,
+    suppression,
+    suppression_threshold,
+)
+
+HOST = "127.0.0.1"
+PORT = 8765
+POLL_SECONDS = 5.0
+CACHE_ENTRIES = 1024
+MAX_HEADER_BYTES = 1 << 16
+
+SPECS = {spec.name: spec for spec in AGG_SPECS}
+REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed",
+           431: "Request Header Fields Too Large", 500: "Internal Server Error"}
+CONTENT_TYPES = {"json": "application/json; charset=utf-8", "csv": "text/csv; charset=utf-8"}
+
+# ---------------------- Data ----------------------
+
+
+def raw_signature(patterns: List[str]) -> Tuple[Tuple[str, int, int], ...]:
+    """(path, size, mtime) of every existing raw file matching patterns; any change means a reload."""
+    signature = []
+    for path in raw_paths(patterns):
+        if os.path.isfile(path):
+            st = os.stat(path)
+            signature.append((path, st.st_size, st.st_mtime_ns))
+    return tuple(signature)
+
+
+def load_parts(paths: List[str], date_formats: Optional[Dict[str, str]] = None) -> dict:
+    """The merged count cube of paths and what the service reports about it. Runs in a worker process."""
+    acc = None
+    for path in paths:
+        acc = merge_partials(acc, file_partials(path, date_formats=date_formats, incremental=True))
+    return {
+        "cube": acc["cube"],
+        "years": sorted(int(y) for y in acc["qa_year_counts"].index),
+        "raw_files": acc["raw_files"],
+        "total_rows_raw": acc["total_rows_raw"],
+        "rows_parsed": acc["rows_parsed"],
+    }
+
+
+def _label(value) -> str:
+    """A dimension value as written in a URL: 7 for the float 7.0, an empty string for missing."""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return ""
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        return str(int(value))
+    return str(value)
+
+
+@dataclass
+class Snapshot:
+    """One load of the raw files; replaced as a whole on reload, so a request sees a single version."""
+    cube: pd.Series
+    years: List[int]
+    raw_files: List[str]
+    total_rows_raw: int
+    rows_parsed: int
+    signature: Tuple[Tuple[str, int, int], ...]
+    generation: int
+    loaded_at: float = field(default_factory=time.time)
+    labels: Dict[str, Dict[str, object]] = field(default_factory=dict)
+
+    def values(self, dim: str, labels: List[str]) -> list:
+        """Cube values of dim for URL labels; raises RequestError for a value the data does not have."""
+        if dim not in self.labels:
+            self.labels[dim] = {_label(v): v for v in _level_codes(self.cube, dim)[1]}
+        known = self.labels[dim]
+        values = []
+        for label in labels:
+            if label == "":
+                values.append(None)
+            elif label in known:
+                values.append(known[label])
+            else:
+                raise RequestError(400, f"no {dim} {label!r} in the data")
+        return values
+
+
+class RequestError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+# ---------------------- Responses ----------------------
+
+
+class ResponseCache:
+    """Rendered responses by request, least recently used evicted first beyond max_entries."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[tuple, Tuple[str, bytes]]" = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key: tuple) -> Optional[Tuple[str, bytes]]:
+        found = self.entries.get(key)
+        if found is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return found
+
+    def put(self, key: tuple, response: Tuple[str, bytes]) -> None:
+        self.entries[key] = response
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+def _filters(snapshot: Snapshot, params: Dict[str, List[str]], skip: Tuple[str, ...]) -> Dict[str, list]:
+    """{dimension: values} from the query parameters other than skip."""
+    where = {}
+    for name, labels in params.items():
+        if name in skip:
+            continue
+        if name not in cube_dims(snapshot.cube):
+            raise RequestError(400, f"unknown parameter {name!r}; filter by {', '.join(cube_dims(snapshot.cube))}")
+        where[name] = snapshot.values(name, [v for label in labels for v in label.split(",")])
+    return where
+
+
+def _table(snapshot: Snapshot, name: str, params: Dict[str, List[str]]) -> pd.DataFrame:
+    """Rows of table name for the requested years (default all), counted over the filtered cube."""
+    spec = SPECS.get(name)
+    if spec is None:
+        raise RequestError(404, f"no table {name!r}; tables are {', '.join(SPECS)}")
+    filtered = sorted(set(params) - {"format", "year"})
+    if filtered and suppression_threshold():
+        raise RequestError(403, f"cannot filter by {', '.join(filtered)} with --suppress-below; only year selects rows")
+    where = _filters(snapshot, params, ("format", "year"))
+    years = snapshot.years
+    if "year" in params:
+        wanted = set(snapshot.values("year", [v for label in params["year"] for v in label.split(",")]))
+        years = [year for year in years if year in wanted]
+    counts = cube_table(cube_slice(snapshot.cube, where) if where else snapshot.cube, spec)
+    tables = [out for out in (finish_year(spec, counts, year) for year in years) if out is not None]
+    if not tables:
+        raise RequestError(404, f"table {name!r} cannot be built from these raw files")
+    return tables[0] if len(tables) == 1 else pd.concat(tables, ignore_index=True)
+
+
+def _query(snapshot: Snapshot, params: Dict[str, List[str]]) -> pd.DataFrame:
+    """Cases by the dimensions in by (none: the total), over the cells matching the other parameters."""
+    if suppression_threshold():
+        raise RequestError(403, "/query is not served with --suppress-below; use the published /tables")
+    by = list(dict.fromkeys(dim for label in params.get("by", []) for dim in label.split(",") if dim))
+    unknown = [dim for dim in by if dim not in cube_dims(snapshot.cube)]
+    if unknown:
+        raise RequestError(400, f"cannot group by {', '.join(unknown)}; dimensions are {', '.join(cube_dims(snapshot.cube))}")
+    where = _filters(snapshot, params, ("format", "by"))
+    if not by:
+        cells = cube_slice(snapshot.cube, where) if where else snapshot.cube
+        return pd.DataFrame({"cases": [int(cells.sum())]})
+    out = cube_query(snapshot.cube, by, where).reset_index(name="cases")
+    for col in out.columns:
+        # hours are floats only to hold missing values
+        if out[col].dtype.kind == "f" and (out[col].dropna() % 1 == 0).all():
+            out[col] = out[col].astype("Int64")
+    return out
+
+
+def _index(snapshot: Snapshot) -> dict:
+    return {
+        "tables": list(SPECS),
+        "dimensions": cube_dims(snapshot.cube),
+        "years": snapshot.years,
+        "raw_files": snapshot.raw_files,
+    }
+
+
+def render(snapshot: Snapshot, path: str, params: Dict[str, List[str]]) -> Tuple[str, bytes]:
+    """(content type, body) of one GET; raises RequestError for a request it cannot answer."""
+    fmt = params.get("format", ["json"])[-1]
+    if fmt not in CONTENT_TYPES:
+        raise RequestError(400, f"format must be json or csv, not {fmt!r}")
+    if path in ("/", "/tables"):
+        return CONTENT_TYPES["json"], json.dumps(_index(snapshot), ensure_ascii=False).encode("utf-8")
+    if path.startswith("/tables/"):
+        out = _table(snapshot, path[len("/tables/"):], params)
+    elif path == "/query":
+        out = _query(snapshot, params)
+    else:
+        raise RequestError(404, f"no such path {path!r}; try /tables, /tables/<name>, /query or /health")
+    if fmt == "csv":
+        return CONTENT_TYPES["csv"], out.to_csv(index=False).encode("utf-8")
+    return CONTENT_TYPES["json"], out.to_json(orient="records", force_ascii=False).encode("utf-8")
+
+
+# ---------------------- Service ----------------------
+
+
+class AggregateService:
+    """The current Snapshot, the response cache and the reload loop behind the HTTP handler."""
+
+    def __init__(
+        self,
+        patterns: List[str],
+        date_formats: Optional[Dict[str, str]] = None,
+        cache_entries: int = CACHE_ENTRIES,
+    ):
+        self.patterns = patterns
+        self.date_formats = date_formats
+        self.cache = ResponseCache(cache_entries)
+        self.snapshot: Optional[Snapshot] = None
+        self.reloads = self.failed_reloads = 0
+        self._inflight: Dict[tuple, asyncio.Future] = {}
+        self._loader = ProcessPoolExecutor(max_workers=1)
+
+    def _swap(self, parts: dict, signature: tuple) -> None:
+        generation = 0 if self.snapshot is None else self.snapshot.generation + 1
+        self.snapshot = Snapshot(signature=signature, generation=generation, **parts)
+        self.cache.clear()
+        print(f"Loaded {', '.join(parts['raw_files'])}: {parts['rows_parsed']:,} rows in "
+              f"{len(parts['years'])} year(s), {len(parts['cube']):,} cube cells (generation {generation})")
+
+    def load(self) -> None:
+        """First load, in this process, before serving."""
+        signature = raw_signature(self.patterns)
+        if not signature:
+            raise FileNotFoundError(f"no raw file matches {' '.join(self.patterns)}")
+        self._swap(load_parts([path for path, _, _ in signature], self.date_formats), signature)
+
+    async def watch(self, interval: float) -> None:
+        """Reload when the raw files' signature changed and then held still for one interval (a file still
+        being copied is not loaded half-written). A failed reload keeps the current data and is not retried
+        until the files change again."""
+        loop = asyncio.get_running_loop()
+        seen = failed = None
+        while True:
+            await asyncio.sleep(interval)
+            signature = raw_signature(self.patterns)
+            stable, seen = signature == seen, signature
+            if not signature or signature == self.snapshot.signature or signature == failed or not stable:
+                continue
+            print("Raw files changed; reloading...")
+            try:
+                parts = await loop.run_in_executor(
+                    self._loader, load_parts, [path for path, _, _ in signature], self.date_formats
+                )
+            except Exception as e:
+                self.failed_reloads += 1
+                failed = signature
+                print(f"Reload failed, still serving generation {self.snapshot.generation}: {e!r}")
+                continue
+            self.reloads += 1
+            self._swap(parts, signature)
+
+    def close(self) -> None:
+        self._loader.shutdown(cancel_futures=True)
+
+    def health(self) -> dict:
+        snapshot = self.snapshot
+        return {
+            "generation": snapshot.generation,
+            "loaded_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(snapshot.loaded_at)),
+            "raw_files": snapshot.raw_files,
+            "years": snapshot.years,
+            "total_rows_raw": snapshot.total_rows_raw,
+            "rows_parsed": snapshot.rows_parsed,
+            "cube_cells": len(snapshot.cube),
+            "reloads": self.reloads,
+            "failed_reloads": self.failed_reloads,
+            "cache": self.cache.stats(),
+        }
+
+    async def respond(self, method: str, target: str) -> Tuple[int, str, bytes]:
+        """(status, content type, body) for one request."""
+        if method not in ("GET", "HEAD"):
+            return self._error(405, f"{method} is not supported; use GET")
+        path, _, query = target.partition("?")
+        path = unquote(path).rstrip("/") or "/"
+        if path == "/health":
+            return 200, CONTENT_TYPES["json"], json.dumps(self.health(), ensure_ascii=False).encode("utf-8")
+        params: Dict[str, List[str]] = {}
+        for name, value in parse_qsl(query, keep_blank_values=True):
+            params.setdefault(name, []).append(value)
+        snapshot = self.snapshot
+        key = (snapshot.generation, path, tuple(sorted((k, tuple(v)) for k, v in params.items())))
+        cached = self.cache.get(key)
+        if cached is not None:
+            return (200,) + cached
+
+        # compute off the event loop; identical requests arriving meanwhile share the one computation
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().run_in_executor(None, render, snapshot, path, params)
+            self._inflight[key] = future
+            future.add_done_callback(lambda f: self._done(key, f))
+        try:
+            return (200,) + await asyncio.shield(future)
+        except RequestError as e:
+            return self._error(e.status, str(e))
+        except Exception:
+            traceback.print_exc()
+            return self._error(500, f"failed to answer {target}")
+
+    def _done(self, key: tuple, future: asyncio.Future) -> None:
+        self._inflight.pop(key, None)
+        if not future.cancelled() and future.exception() is None and key[0] == self.snapshot.generation:
+            self.cache.put(key, future.result())
+
+    @staticmethod
+    def _error(status: int, message: str) -> Tuple[int, str, bytes]:
+        return status, CONTENT_TYPES["json"], json.dumps({"error": message}, ensure_ascii=False).encode("utf-8")
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """HTTP/1.1 with keep-alive: answer requests on one connection until the client closes it."""
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except asyncio.LimitOverrunError:
+                    await self._send(writer, "HEAD", *self._error(431, "request headers too large"), keep_alive=False)
+                    return
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+                # browsers percent-encode URLs, but curl and scripts may send Thai names as raw UTF-8
+                lines = head.decode("utf-8", "replace").split("\r\n")
+                request = lines[0].split(" ")
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    method, target, version = request
+                    # digits only: int() would also take "-5", "+5" or "1_0", and a negative length breaks readexactly
+                    length = headers.get("content-length") or "0"
+                    if not (length.isascii() and length.isdigit()):
+                        raise ValueError(length)
+                    length = int(length)
+                except ValueError:
+                    await self._send(writer, "GET", *self._error(400, "malformed request"), keep_alive=False)
+                    return
+                if length:
+                    await reader.readexactly(length)
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection == "keep-alive" or (version == "HTTP/1.1" and connection != "close")
+                await self._send(writer, method, *await self.respond(method, target), keep_alive=keep_alive)
+                if not keep_alive:
+                    return
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _send(
+        writer: asyncio.StreamWriter, method: str, status: int, content_type: str, body: bytes, keep_alive: bool
+    ) -> None:
+        head = (
+            f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Access-Control-Allow-Origin: *\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        ).encode("latin-1")
+        writer.write(head if method == "HEAD" else head + body)
+        await writer.drain()
+
+
+async def serve(service: AggregateService, host: str, port: int, poll: float) -> None:
+    server = await asyncio.start_server(service.handle_connection, host, port, limit=MAX_HEADER_BYTES)
+    print(f"Serving on http://{host}:{port}/tables (polling raw files every {poll:g}s)")
+    async with server:
+        await asyncio.gather(server.serve_forever(), service.watch(poll))
+
+
+# ---------------------- Main ----------------------
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "raw_files", nargs="*", default=[RAW_FILE],
+        help=f"raw IS CSVs or glob patterns; new files matching a pattern are picked up (default: {RAW_FILE})",
+    )
+    parser.add_argument("--host", default=HOST, help=f"address to listen on (default: {HOST})")
+    parser.add_argument("--port", type=int, default=PORT, help=f"port to listen on (default: {PORT})")
+    parser.add_argument(
+        "--poll", type=float, default=POLL_SECONDS,
+        help=f"seconds between checks of the raw files for changes (default: {POLL_SECONDS:g})",
+    )
+    parser.add_argument(
+        "--cache-entries", type=int, default=CACHE_ENTRIES,
+        help=f"rendered responses kept, least recently used evicted first (default: {CACHE_ENTRIES})",
+    )
+    parser.add_argument(
+        "--date-format", default=DATE_FORMAT,
+        help='strftime format of adate/hdate, e.g. "%%d/%%m/%%Y" (default: inferred from the first value)',
+    )
+    parser.add_argument(
+        "--suppress-below", type=int, default=SUPPRESS_BELOW, metavar="N",
+        help="serve only the published tables, with cells of fewer than N cases hidden as in outputs/ "
+             f"(no /query, no filters but year; default: {SUPPRESS_BELOW}, nothing hidden)",
+    )
+    args = parser.parse_args(argv)
+    date_formats = {"adate": args.date_format, "hdate": args.date_format} if args.date_format else None
+
+    service = AggregateService(args.raw_files, date_formats, args.cache_entries)
+    print(f"Loading {' '.join(args.raw_files)}...")
+    service.load()
+    try:
+        with suppression(args.suppress_below):
+            asyncio.run(serve(service, args.host, args.port, args.poll))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+
+if __name__ == "__main__":
+    main()